@@ -21,7 +21,7 @@ __author__ = 'hcaesar'
 
 from pycocotools import mask
 from pycocotools.coco import COCO
-from pycocotools.cocostuffhelper import cocoSegmentationToSegmentationMap, segmentationToCocoMask
+from pycocotools.cocostuffhelper import cocoSegmentationToSegmentationMap
 import numpy as np
 import scipy.io # To open matlab <= v7.0 files
 import io
@@ -252,9 +252,9 @@ def internalToCocoGTDemo(dataType='train2017', dataDir='../..',
                     # Set all thing classes to the new 'other' class
                     labelMap[labelMapThings > 0] = stuffEndId + 1
 
-                # Add stuff annotations
-                labelsAll = np.unique(labelMap)
-                labelsValid = [i for i in labelsAll if i >= stuffStartId]
+                # Add stuff annotations (the masks of all labels are encoded in a single pass)
+                labelRs = mask.encodeLabelMap(labelMap)
+                labelsValid = [l for l in labelRs if l >= stuffStartId]
                 for i, labelId in enumerate(labelsValid):
                     # Add a comma and line break after each annotation
                     assert annId - annIdStart <= 1e7, 'Error: Annotation ids are not unique!'
@@ -263,8 +263,8 @@ def internalToCocoGTDemo(dataType='train2017', dataDir='../..',
                     else:
                         annotStr = ',\n'
 
-                    # Create mask and encode it
-                    Rs = segmentationToCocoMask(labelMap, labelId)
+                    # Get encoded mask
+                    Rs = labelRs[labelId]
 
                     # Create annotation data
                     anndata = {}
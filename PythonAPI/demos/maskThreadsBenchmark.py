@@ -0,0 +1,91 @@
+"""
+Thread-scaling benchmark for the pycocotools mask kernels.
+
+The C calls in pycocotools._mask run without the GIL, so per-image
+maskUtils.iou calls scale over a ThreadPoolExecutor without the pickling
+costs of a process pool. Run from the PythonAPI directory:
+
+    python demos/maskThreadsBenchmark.py --images 200 --dts 50 --gts 20
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# use the pycocotools of this checkout (the script directory is demos/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pycocotools import mask as maskUtils
+
+
+def randomRles(rng, n, h, w):
+    """
+    Encode n random rectangles-with-holes of an h x w image as compressed RLEs
+    :param rng: numpy random generator
+    :return: list of RLE dicts
+    """
+    masks = np.zeros((h, w, n), dtype=np.uint8, order='F')
+    for i in range(n):
+        y0, x0 = rng.integers(0, h//2), rng.integers(0, w//2)
+        y1, x1 = y0 + rng.integers(h//8, h//2), x0 + rng.integers(w//8, w//2)
+        masks[y0:y1, x0:x1, i] = 1
+        masks[y0:y1:7, x0:x1:5, i] = 0
+    return maskUtils.encode(masks)
+
+
+def makeImages(nImgs, nDts, nGts, h, w, seed=0):
+    """
+    Create the dt and gt RLEs of nImgs synthetic images
+    :return: list of (dt, gt, iscrowd) tuples, one per image
+    """
+    rng = np.random.default_rng(seed)
+    return [(randomRles(rng, nDts, h, w), randomRles(rng, nGts, h, w), [0] * nGts) for _ in range(nImgs)]
+
+
+def imageIou(img):
+    dt, gt, iscrowd = img
+    return maskUtils.iou(dt, gt, iscrowd)
+
+
+def run(images, threads, repeat):
+    """
+    Time maskUtils.iou over all images with a thread pool
+    :return: best wall time over repeat runs (s)
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        tic = time.time()
+        if threads == 1:
+            list(map(imageIou, images))
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(imageIou, images))
+        best = min(best, time.time() - tic)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ThreadPoolExecutor scaling of per-image maskUtils.iou')
+    parser.add_argument('--images', type=int, default=200, help='number of images')
+    parser.add_argument('--dts', type=int, default=50, help='detections per image')
+    parser.add_argument('--gts', type=int, default=20, help='ground truths per image')
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per setting (best is reported)')
+    args = parser.parse_args()
+
+    images = makeImages(args.images, args.dts, args.gts, args.height, args.width)
+    cores = os.cpu_count() or 1
+    threads = sorted(set([1, 2, 4, 8, 16, cores]) & set(range(1, cores + 1)))
+    print('{} images, {} dts x {} gts, {}x{}, {} cores'.format(
+        args.images, args.dts, args.gts, args.height, args.width, cores))
+    base = run(images, 1, args.repeat)
+    for n in threads:
+        t = base if n == 1 else run(images, n, args.repeat)
+        print('threads={:3d}  time={:8.3f}s  speedup={:5.2f}x'.format(n, t, base / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# distutils: language = c
+
+#**************************************************************************
+# Microsoft COCO Toolbox.      version 2.0
+# Data, paper, and tutorials available at:  http://mscoco.org/
+# Code written by Piotr Dollar and Tsung-Yi Lin, 2015.
+# Licensed under the Simplified BSD License [see coco/license.txt]
+#**************************************************************************
+
+# Compiled kernels used by COCOeval. They replicate the greedy matching of
+# the original Python implementation of COCOeval.evaluateImg exactly, but
+# run the loops over IoU thresholds, detections and ground truths in C.
+
+cimport cython
+import numpy as np
+
+# greedy matching of detections to ground truths at every IoU threshold
+#  ious     - [DxG] iou between the D score-sorted dts and G ignore-sorted gts
+#  gtIg     - [G] ignore flag for each gt
+#  iscrowd  - [G] crowd flag for each gt
+#  iouThrs  - [T] iou thresholds
+#  gtIds    - [G] id of each gt
+#  dtIds    - [D] id of each dt
+# returns gtm [TxG], dtm [TxD] and dtIg [TxD] as in COCOeval.evaluateImg
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def evaluateMatches(const double[:, :] ious, const unsigned char[:] gtIg, const unsigned char[:] iscrowd,
+                    const double[:] iouThrs, const double[:] gtIds, const double[:] dtIds):
+    cdef Py_ssize_t T = iouThrs.shape[0], D = dtIds.shape[0], G = gtIds.shape[0]
+    gtm  = np.zeros((T, G))
+    dtm  = np.zeros((T, D))
+    dtIg = np.zeros((T, D))
+    cdef double[:, :] _gtm = gtm, _dtm = dtm, _dtIg = dtIg
+    cdef Py_ssize_t t, d, g, m
+    cdef double iou
+    if ious.shape[0] == 0 or ious.shape[1] == 0:
+        return gtm, dtm, dtIg
+    with nogil:
+        for t in range(T):
+            for d in range(D):
+                # information about best match so far (m=-1 -> unmatched)
+                iou = iouThrs[t] if iouThrs[t] < 1-1e-10 else 1-1e-10
+                m = -1
+                for g in range(G):
+                    # if this gt already matched, and not a crowd, continue
+                    if _gtm[t, g] > 0 and not iscrowd[g]:
+                        continue
+                    # if dt matched to reg gt, and on ignore gt, stop
+                    if m > -1 and gtIg[m] == 0 and gtIg[g] == 1:
+                        break
+                    # continue to next gt unless better match made
+                    if ious[d, g] < iou:
+                        continue
+                    # if match successful and best so far, store appropriately
+                    iou = ious[d, g]
+                    m = g
+                # if match made store id of match for both dt and gt
+                if m == -1:
+                    continue
+                _dtIg[t, d] = gtIg[m]
+                _dtm[t, d]  = gtIds[m]
+                _gtm[t, m]  = dtIds[d]
+    return gtm, dtm, dtIg
+
+# greedy matching for several area ranges at once, sharing the dt sort and ious
+#  ious     - [DxG] iou between the D score-sorted dts and the G gts (unsorted)
+#  gtOrder  - [AxG] ignore-last order of the gts for each area range
+#  gtIg     - [AxG] ignore flag of each gt (unsorted) for each area range
+#  iscrowd  - [G] crowd flag for each gt (unsorted)
+#  iouThrs  - [T] iou thresholds
+#  gtIds    - [G] id of each gt (unsorted)
+#  dtIds    - [D] id of each dt
+# returns gtm [AxTxG] (gts in gtOrder), dtm [AxTxD] and dtIg [AxTxD], for each
+# area range the same as evaluateMatches on the ignore-sorted gts
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def evaluateMatchesAreas(const double[:, :] ious, const Py_ssize_t[:, :] gtOrder, const unsigned char[:, :] gtIg,
+                         const unsigned char[:] iscrowd, const double[:] iouThrs,
+                         const double[:] gtIds, const double[:] dtIds):
+    cdef Py_ssize_t A = gtOrder.shape[0], T = iouThrs.shape[0], D = dtIds.shape[0], G = gtIds.shape[0]
+    gtm  = np.zeros((A, T, G))
+    dtm  = np.zeros((A, T, D))
+    dtIg = np.zeros((A, T, D))
+    cdef double[:, :, :] _gtm = gtm, _dtm = dtm, _dtIg = dtIg
+    cdef Py_ssize_t a, t, d, g, gg, m
+    cdef double iou
+    if ious.shape[0] == 0 or ious.shape[1] == 0:
+        return gtm, dtm, dtIg
+    with nogil:
+        for a in range(A):
+            for t in range(T):
+                for d in range(D):
+                    iou = iouThrs[t] if iouThrs[t] < 1-1e-10 else 1-1e-10
+                    m = -1
+                    for g in range(G):
+                        gg = gtOrder[a, g]
+                        if _gtm[a, t, g] > 0 and not iscrowd[gg]:
+                            continue
+                        if m > -1 and gtIg[a, gtOrder[a, m]] == 0 and gtIg[a, gg] == 1:
+                            break
+                        if ious[d, gg] < iou:
+                            continue
+                        iou = ious[d, gg]
+                        m = g
+                    if m == -1:
+                        continue
+                    _dtIg[a, t, d] = gtIg[a, gtOrder[a, m]]
+                    _dtm[a, t, d]  = gtIds[gtOrder[a, m]]
+                    _gtm[a, t, m]  = dtIds[d]
+    return gtm, dtm, dtIg
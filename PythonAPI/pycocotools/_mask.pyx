@@ -18,17 +18,23 @@ PYTHON_VERSION = sys.version_info[0]
 import numpy as np
 cimport numpy as np
 from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy
 
 # intialized Numpy. must do.
 np.import_array()
 
+# raised by decodeLabelMap(overlap='error') and confusion for overlapping masks
+class OverlapError(Exception):
+    pass
+
 # import numpy C function
 # we use PyArray_ENABLEFLAGS to make Numpy ndarray responsible to memoery management
 cdef extern from "numpy/arrayobject.h":
     void PyArray_ENABLEFLAGS(np.ndarray arr, int flags)
 
 # Declare the prototype of the C functions in MaskApi.h
-cdef extern from "maskApi.h":
+# none of them touches Python objects, so they are all called without the GIL
+cdef extern from "maskApi.h" nogil:
     ctypedef unsigned int uint
     ctypedef unsigned long siz
     ctypedef unsigned char byte
@@ -40,38 +46,158 @@ cdef extern from "maskApi.h":
         uint* cnts,
     void rlesInit( RLE **R, siz n )
     void rleEncode( RLE *R, const byte *M, siz h, siz w, siz n )
+    void rleEncodeStrided( RLE *R, const void *M, siz h, siz w, siz n, long sh, long sw, long sn, int type, int useThr, double thr )
     void rleDecode( const RLE *R, byte *mask, siz n )
+    siz rleEncodeLabels( const void *L, siz h, siz w, long sh, long sw, int type, const long long *sel, siz nsel, long long **vals, RLE **R )
+    void rleDecodePacked( const RLE *R, byte *mask, siz n )
+    void rleEncodePacked( RLE *R, const byte *mask, siz h, siz w, siz n, long sh, long sw, long sn )
+    void rleDecodeCrop( const RLE *R, byte *M, siz n, long x0, long y0, siz cw, siz ch, long sh, long sw, long sn )
+    siz rlePaint( const RLE *R, const long long *labels, siz n, void *L, int type, long sh, long sw, int overlap )
     void rleMerge( const RLE *R, RLE *M, siz n, int intersect )
+    int rleConfusion( const RLE *gt, const long long *gl, siz ng, const RLE *dt, const long long *dl, siz nd, siz L, long long *C )
     void rleArea( const RLE *R, siz n, uint *a )
     void rleIou( RLE *dt, RLE *gt, siz m, siz n, byte *iscrowd, double *o )
+    void rleIouUnpruned( RLE *dt, RLE *gt, siz m, siz n, byte *iscrowd, double *o )
     void bbIou( BB dt, BB gt, siz m, siz n, byte *iscrowd, double *o )
+    siz objNms( const BB bb, const RLE *R, const uint *cats, double *s, siz n, double thr, int method, double sigma, double sthr, siz *keep )
     void rleToBbox( const RLE *R, BB bb, siz n )
     void rleFrBbox( RLE *R, const BB bb, siz h, siz w, siz n )
+    void rleFrBoxMasks( RLE *R, const double *M, siz mh, siz mw, const BB bb, siz h, siz w, siz n, double thr )
     void rleFrPoly( RLE *R, const double *xy, siz k, siz h, siz w )
     char* rleToString( const RLE *R )
     void rleFrString( RLE *R, char *s, siz h, siz w )
 
 # python class to wrap RLE array in C
 # the class handles the memory allocation and deallocation
+#  RLEs(n)        - n empty RLEs (used internally)
+#  RLEs(rleObjs)  - parse a list of compressed RLE dicts (or a single one) once
+#  RLEs(Rs)       - concatenate RLEs objects (sharing their counts)
+# Parsed RLEs can be passed to every function instead of the dicts. Indexing
+# with an int, a slice or a list of indices returns RLEs views that share the
+# parsed counts of the original, which stay alive as long as any view does.
 cdef class RLEs:
     cdef RLE *_R
     cdef siz _n
+    cdef object _owner      # object(s) a view shares the counts with (None if not a view)
+    cdef bint _ownsR        # whether _R was allocated by this object
 
-    def __cinit__(self, siz n =0):
+    def __cinit__(self, rleObjs=0):
+        cdef siz i, j, n
+        cdef RLEs Rs
+        self._owner = None
+        self._ownsR = True
+        if isinstance(rleObjs, int):
+            n = rleObjs
+            rlesInit(&self._R, n)
+            self._n = n
+        elif isinstance(rleObjs, dict):
+            self._parse([rleObjs])
+        elif len(rleObjs) > 0 and all([isinstance(obj, RLEs) for obj in rleObjs]):
+            # concatenation of views: copy the RLE structs, share the counts
+            n = sum([len(obj) for obj in rleObjs])
+            rlesInit(&self._R, 0)
+            free(self._R)
+            self._R = <RLE*> malloc(n* sizeof(RLE))
+            self._n = n
+            j = 0
+            for Rs in rleObjs:
+                for i in range(Rs._n):
+                    self._R[j] = Rs._R[i]
+                    j += 1
+            self._owner = list(rleObjs)
+        else:
+            self._parse(rleObjs)
+
+    cdef _parse(self, rleObjs):
+        # parse compressed RLE strings without the GIL (see _frString)
+        cdef siz n = len(rleObjs)
         rlesInit(&self._R, n)
         self._n = n
+        cdef RLE* R = self._R
+        cdef bytes py_string
+        cdef char** c_strings = <char**> malloc(n* sizeof(char*))
+        cdef siz* hw = <siz*> malloc(2*n* sizeof(siz))
+        cdef siz i
+        py_strings = []
+        try:
+            for i, obj in enumerate(rleObjs):
+                if PYTHON_VERSION == 2:
+                    py_string = str(obj['counts']).encode('utf8')
+                elif PYTHON_VERSION == 3:
+                    py_string = str.encode(obj['counts']) if type(obj['counts']) == str else obj['counts']
+                else:
+                    raise Exception('Python version must be 2 or 3')
+                py_strings.append(py_string)
+                c_strings[i] = py_string
+                hw[2*i], hw[2*i+1] = obj['size'][0], obj['size'][1]
+            with nogil:
+                for i in range(n):
+                    rleFrString( <RLE*> &R[i], c_strings[i], hw[2*i], hw[2*i+1] )
+        finally:
+            free(c_strings)
+            free(hw)
 
-    # free the RLE array here
+    # free the RLE array here (the counts only if they are not shared)
     def __dealloc__(self):
         if self._R is not NULL:
-            for i in range(self._n):
-                free(self._R[i].cnts)
-            free(self._R)
+            if self._owner is None:
+                for i in range(self._n):
+                    free(self._R[i].cnts)
+            if self._ownsR:
+                free(self._R)
+
     def __getattr__(self, key):
         if key == 'n':
             return self._n
         raise AttributeError(key)
 
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, key):
+        cdef RLEs Rs
+        cdef siz i, n = self._n
+        cdef Py_ssize_t k, start, stop, step
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            if step != 1:
+                return self[list(range(start, stop, step))]
+            # contiguous view into the RLE array of this object
+            Rs = RLEs(0)
+            free(Rs._R)
+            Rs._R = self._R + start
+            Rs._n = max(stop - start, 0)
+            Rs._ownsR = False
+            Rs._owner = self
+            return Rs
+        if isinstance(key, (int, np.integer)):
+            k = key + n if key < 0 else key
+            if k < 0 or k >= <Py_ssize_t> n:
+                raise IndexError('RLEs index out of range')
+            return self[k:k+1]
+        # list, tuple or array of indices (or a boolean mask)
+        inds = np.asarray(key)
+        if inds.dtype == bool:
+            if len(inds) != n:
+                raise IndexError('boolean index does not match the number of RLEs')
+            inds = np.nonzero(inds)[0]
+        inds = inds.astype(np.intp).ravel()
+        inds[inds < 0] += n
+        if np.any(inds < 0) or np.any(inds >= <Py_ssize_t> n):
+            raise IndexError('RLEs index out of range')
+        Rs = RLEs(0)
+        free(Rs._R)
+        Rs._R = <RLE*> malloc(len(inds)* sizeof(RLE))
+        Rs._n = len(inds)
+        for i in range(Rs._n):
+            Rs._R[i] = self._R[inds[i]]
+        Rs._owner = self
+        return Rs
+
+    def tolist(self):
+        # compressed RLE dicts of all masks
+        return _toString(self)
+
 # python class to wrap Mask array in C
 # the class handles the memory allocation and deallocation
 cdef class Masks:
@@ -102,64 +228,189 @@ cdef class Masks:
 # internal conversion from Python RLEs object to compressed RLE format
 def _toString(RLEs Rs):
     cdef siz n = Rs.n
+    cdef RLE* R = Rs._R
     cdef bytes py_string
-    cdef char* c_string
+    cdef char** c_strings = <char**> malloc(n* sizeof(char*))
+    cdef siz i
+    with nogil:
+        for i in range(n):
+            c_strings[i] = rleToString( <RLE*> &R[i] )
     objs = []
     for i in range(n):
-        c_string = rleToString( <RLE*> &Rs._R[i] )
-        py_string = c_string
+        py_string = c_strings[i]
         objs.append({
-            'size': [Rs._R[i].h, Rs._R[i].w],
+            'size': [R[i].h, R[i].w],
             'counts': py_string
         })
-        free(c_string)
+        free(c_strings[i])
+    free(c_strings)
     return objs
 
 # internal conversion from compressed RLE format to Python RLEs object
+# parsed RLEs are passed through as they are
 def _frString(rleObjs):
-    cdef siz n = len(rleObjs)
-    Rs = RLEs(n)
-    cdef bytes py_string
-    cdef char* c_string
-    for i, obj in enumerate(rleObjs):
-        if PYTHON_VERSION == 2:
-            py_string = str(obj['counts']).encode('utf8')
-        elif PYTHON_VERSION == 3:
-            py_string = str.encode(obj['counts']) if type(obj['counts']) == str else obj['counts']
-        else:
-            raise Exception('Python version must be 2 or 3')
-        c_string = py_string
-        rleFrString( <RLE*> &Rs._R[i], <char*> c_string, obj['size'][0], obj['size'][1] )
-    return Rs
+    if isinstance(rleObjs, RLEs):
+        return rleObjs
+    return RLEs(list(rleObjs))
 
 # encode mask to RLEs objects
 # list of RLE string can be generated by RLEs member function
-def encode(np.ndarray[np.uint8_t, ndim=3, mode='fortran'] mask):
-    h, w, n = mask.shape[0], mask.shape[1], mask.shape[2]
+# the [hxwxn] mask may have any memory layout and be of type bool, uint8,
+# float32 or float64; pixels are set where the mask is nonzero, or, given a
+# threshold, where it is >= threshold (thresholding is fused with the encoding)
+# given packedHeight=h the mask is a uint8 [(h+7)/8 x w x n] array of bits
+# packed along h, as returned by decode(rleObjs, packed=True)
+def encode(np.ndarray mask, threshold=None, packedHeight=None):
+    if mask.ndim != 3:
+        raise Exception('mask must have shape [h x w x n]')
+    if packedHeight is not None:
+        return _encodePacked(mask, packedHeight)
+    if mask.dtype == np.bool_ or mask.dtype == np.uint8:
+        type = 0
+    elif mask.dtype == np.float32:
+        type = 1
+    elif mask.dtype == np.float64:
+        type = 2
+    elif threshold is None:
+        mask, type = mask != 0, 0
+    else:
+        mask, type, threshold = mask >= threshold, 0, None
+    cdef siz h = mask.shape[0], w = mask.shape[1], n = mask.shape[2]
+    cdef long sh = mask.strides[0], sw = mask.strides[1], sn = mask.strides[2]
+    cdef int _type = type, useThr = threshold is not None
+    cdef double thr = 0 if threshold is None else threshold
+    cdef RLEs Rs = RLEs(n)
+    cdef void* M = np.PyArray_DATA(mask)
+    with nogil:
+        rleEncodeStrided(Rs._R, M, h, w, n, sh, sw, sn, _type, useThr, thr)
+    objs = _toString(Rs)
+    return objs
+
+def _encodePacked(np.ndarray mask, siz h):
+    if mask.dtype != np.uint8 or mask.shape[0] != (h+7)//8:
+        raise Exception('packed mask must be a uint8 array of shape [(h+7)/8 x w x n]')
+    cdef siz w = mask.shape[1], n = mask.shape[2]
+    cdef long sh = mask.strides[0], sw = mask.strides[1], sn = mask.strides[2]
     cdef RLEs Rs = RLEs(n)
-    rleEncode(Rs._R,<byte*>mask.data,h,w,n)
+    cdef byte* M = <byte*> np.PyArray_DATA(mask)
+    with nogil:
+        rleEncodePacked(Rs._R, M, h, w, n, sh, sw, sn)
     objs = _toString(Rs)
     return objs
 
+# encode every label of an [h x w] integer label map (any memory order) as an
+# RLE in one column-major scan, returning {label: RLE} sorted by label (or in
+# the order of labels, of which only the ones present are encoded)
+def encodeLabelMap(np.ndarray labelMap, labels=None):
+    if labelMap.ndim != 2:
+        raise Exception('labelMap must have shape [h x w]')
+    types = [np.dtype(t) for t in (np.uint8, np.uint16, np.int32, np.int64)]
+    if labelMap.dtype == np.bool_:
+        labelMap = labelMap.view(np.uint8)
+    elif labelMap.dtype not in types:
+        labelMap = labelMap.astype(np.int64)
+    cdef np.ndarray[np.int64_t, ndim=1] sel
+    cdef long long* _sel = NULL
+    cdef siz nsel = 0
+    if labels is not None:
+        sel = np.array(labels, dtype=np.int64).reshape(-1)
+        _sel, nsel = <long long*> sel.data, sel.shape[0]
+    cdef siz h = labelMap.shape[0], w = labelMap.shape[1], i, n
+    cdef long sh = labelMap.strides[0], sw = labelMap.strides[1]
+    cdef int type = types.index(labelMap.dtype)
+    cdef void* L = np.PyArray_DATA(labelMap)
+    cdef long long* vals
+    cdef RLEs Rs = RLEs(0)
+    free(Rs._R)
+    with nogil:
+        n = rleEncodeLabels(L, h, w, sh, sw, type, _sel, nsel, &vals, &Rs._R)
+    Rs._n = n
+    keys = [vals[i] for i in range(n)]
+    free(vals)
+    objs = dict(zip(keys, _toString(Rs)))
+    if labels is None:
+        objs = {k: objs[k] for k in sorted(objs)}
+    return objs
+
 # decode mask from compressed list of RLE string or RLEs object
-def decode(rleObjs):
+# with packed=True bits are packed along h into a uint8 [(h+7)/8 x w x n]
+# array (np.unpackbits(masks, axis=0, count=h) restores the byte masks)
+def decode(rleObjs, packed=False):
     cdef RLEs Rs = _frString(rleObjs)
     h, w, n = Rs._R[0].h, Rs._R[0].w, Rs._n
-    masks = Masks(h, w, n)
-    rleDecode(<RLE*>Rs._R, masks._mask, n);
+    cdef np.ndarray bits
+    if packed:
+        bits = np.empty(((h+7)//8, w, n), dtype=np.uint8, order='F')
+        with nogil:
+            rleDecodePacked(<RLE*>Rs._R, <byte*> bits.data, Rs._n)
+        return bits
+    cdef Masks masks = Masks(h, w, n)
+    with nogil:
+        rleDecode(<RLE*>Rs._R, masks._mask, Rs._n)
     return np.array(masks)
 
+# decode the window [x y w h] of every mask into a [h x w x n] uint8 array, or
+# into out (uint8 or bool of that shape, in any memory order); pixels of the
+# window outside the image are 0
+def decodeCrop(rleObjs, window, out=None):
+    cdef RLEs Rs = _frString(rleObjs)
+    cdef long x0 = window[0], y0 = window[1]
+    cdef siz cw = window[2], ch = window[3], n = Rs._n
+    if out is None:
+        out = np.empty((ch, cw, n), dtype=np.uint8, order='F')
+    elif out.shape != (ch, cw, n) or out.dtype not in (np.uint8, np.bool_) or not out.flags.writeable:
+        raise Exception('out must be a writeable uint8 or bool array of shape {}'.format((ch, cw, n)))
+    cdef long sh = out.strides[0], sw = out.strides[1], sn = out.strides[2]
+    cdef byte* M = <byte*> np.PyArray_DATA(out)
+    with nogil:
+        rleDecodeCrop(<RLE*> Rs._R, M, n, x0, y0, cw, ch, sh, sw, sn)
+    return out
+
+# paint the masks with their labels into one [h x w] label map (out, or a new
+# array of dtype), in order; overlap decides which label a pixel covered by
+# several masks gets: 'last', 'first' (nonzero labels are kept) or 'error'
+def decodeLabelMap(rleObjs, labels, out=None, dtype=np.int32, overlap='last'):
+    cdef RLEs Rs = _frString(rleObjs)
+    cdef np.ndarray[np.int64_t, ndim=1] _labels = np.array(labels, dtype=np.int64).reshape(-1)
+    cdef siz i, n = Rs._n
+    if _labels.shape[0] != n:
+        raise Exception('The number of masks and labels must be the same.')
+    if overlap not in ('last', 'first', 'error'):
+        raise Exception('overlap must be one of \'last\', \'first\' or \'error\'.')
+    if out is None:
+        if n == 0:
+            raise Exception('out is required to paint an empty list of masks.')
+        out = np.zeros((Rs._R[0].h, Rs._R[0].w), dtype=dtype)
+    types = [np.dtype(t) for t in (np.uint8, np.uint16, np.int32, np.int64)]
+    if out.ndim != 2 or out.dtype not in types or not out.flags.writeable:
+        raise Exception('out must be a writeable [h x w] array of type uint8, uint16, int32 or int64.')
+    for i in range(n):
+        if Rs._R[i].h != out.shape[0] or Rs._R[i].w != out.shape[1]:
+            raise Exception('The size of every mask must match the label map.')
+    cdef int type = types.index(out.dtype), _overlap = ('last', 'first', 'error').index(overlap)
+    cdef long sh = out.strides[0], sw = out.strides[1]
+    cdef void* L = np.PyArray_DATA(out)
+    cdef long long* lbl = <long long*> _labels.data
+    with nogil:
+        i = rlePaint(<RLE*> Rs._R, lbl, n, L, type, sh, sw, _overlap)
+    if i > 0:
+        raise OverlapError('Mask {} overlaps pixels that are already labeled.'.format(i-1))
+    return out
+
 def merge(rleObjs, intersect=0):
     cdef RLEs Rs = _frString(rleObjs)
     cdef RLEs R = RLEs(1)
-    rleMerge(<RLE*>Rs._R, <RLE*> R._R, <siz> Rs._n, intersect)
+    cdef int _intersect = intersect
+    with nogil:
+        rleMerge(<RLE*>Rs._R, <RLE*> R._R, <siz> Rs._n, _intersect)
     obj = _toString(R)[0]
     return obj
 
 def area(rleObjs):
     cdef RLEs Rs = _frString(rleObjs)
     cdef uint* _a = <uint*> malloc(Rs._n* sizeof(uint))
-    rleArea(Rs._R, Rs._n, _a)
+    with nogil:
+        rleArea(Rs._R, Rs._n, _a)
     cdef np.npy_intp shape[1]
     shape[0] = <np.npy_intp> Rs._n
     a = np.array((Rs._n, ), dtype=np.uint8)
@@ -167,12 +418,37 @@ def area(rleObjs):
     PyArray_ENABLEFLAGS(a, np.NPY_OWNDATA)
     return a
 
+# [L x L] pixel confusion between the labels of the gt and dt masks (two
+# label maps given as non-overlapping masks with labels in [0, L)), computed
+# on the runs without decoding; masks overlapping within gt or dt raise
+def confusion(gt, gtLabels, dt, dtLabels, siz labelCount):
+    cdef RLEs G = _frString(gt), D = _frString(dt)
+    cdef np.ndarray[np.int64_t, ndim=1] gl = np.array(gtLabels, dtype=np.int64).reshape(-1)
+    cdef np.ndarray[np.int64_t, ndim=1] dl = np.array(dtLabels, dtype=np.int64).reshape(-1)
+    cdef siz i
+    if gl.shape[0] != G._n or dl.shape[0] != D._n:
+        raise Exception('The number of masks and labels must be the same.')
+    sizes = set([(G._R[i].h, G._R[i].w) for i in range(G._n)] + [(D._R[i].h, D._R[i].w) for i in range(D._n)])
+    if len(sizes) > 1:
+        raise Exception('All masks must have the same size.')
+    C = np.zeros((labelCount, labelCount), dtype=np.int64)
+    cdef np.ndarray[np.int64_t, ndim=2] _C = C
+    cdef int err
+    with nogil:
+        err = rleConfusion(G._R, <long long*> gl.data, G._n, D._R, <long long*> dl.data, D._n, labelCount, <long long*> _C.data)
+    if err:
+        raise OverlapError('Some pixels have more than one label.')
+    return C
+
 # iou computation. support function overload (RLEs-RLEs and bbox-bbox).
-def iou( dt, gt, pyiscrowd ):
+# pruned=False walks all runs of every pair of RLEs, as a reference for the pruned walk.
+def iou( dt, gt, pyiscrowd, pruned=True ):
     def _preproc(objs):
         if len(objs) == 0:
             return objs
-        if type(objs) == np.ndarray:
+        if type(objs) == RLEs:
+            pass
+        elif type(objs) == np.ndarray:
             if len(objs.shape) == 1:
                 objs = objs.reshape((objs[0], 1))
             # check if it's Nx4 bbox
@@ -195,9 +471,23 @@ def iou( dt, gt, pyiscrowd ):
             raise Exception('unrecognized type.  The following type: RLEs (rle), np.ndarray (box), and list (box) are supported.')
         return objs
     def _rleIou(RLEs dt, RLEs gt, np.ndarray[np.uint8_t, ndim=1] iscrowd, siz m, siz n, np.ndarray[np.double_t,  ndim=1] _iou):
-        rleIou( <RLE*> dt._R, <RLE*> gt._R, m, n, <byte*> iscrowd.data, <double*> _iou.data )
+        cdef RLE* d = dt._R
+        cdef RLE* g = gt._R
+        cdef byte* c = <byte*> iscrowd.data
+        cdef double* o = <double*> _iou.data
+        if pruned:
+            with nogil:
+                rleIou( d, g, m, n, c, o )
+        else:
+            with nogil:
+                rleIouUnpruned( d, g, m, n, c, o )
     def _bbIou(np.ndarray[np.double_t, ndim=2] dt, np.ndarray[np.double_t, ndim=2] gt, np.ndarray[np.uint8_t, ndim=1] iscrowd, siz m, siz n, np.ndarray[np.double_t, ndim=1] _iou):
-        bbIou( <BB> dt.data, <BB> gt.data, m, n, <byte*> iscrowd.data, <double*>_iou.data )
+        cdef BB d = <BB> dt.data
+        cdef BB g = <BB> gt.data
+        cdef byte* c = <byte*> iscrowd.data
+        cdef double* o = <double*> _iou.data
+        with nogil:
+            bbIou( d, g, m, n, c, o )
     def _len(obj):
         cdef siz N = 0
         if type(obj) == RLEs:
@@ -238,11 +528,60 @@ def iou( dt, gt, pyiscrowd ):
     _iouFun(dt, gt, iscrowd, m, n, iou)
     return iou.reshape((m,n), order='F')
 
+# non-maximum suppression of boxes ([nx4] array or list) or RLEs by descending score
+#  categories - optional category of each object, only objects of the same category
+#               suppress each other (batched nms in one pass)
+#  method     - 'hard' (greedy), or 'linear' / 'gaussian' Soft-NMS decaying the scores
+#               of overlapping objects instead of removing them (until below scoreThr)
+# returns the indices of the kept objects in descending (decayed) score order, and
+# for Soft-NMS also their decayed scores
+def nms(objs, scores, double thr, categories=None, method='hard', double sigma=0.5, double scoreThr=0.001):
+    methods = {'hard': 0, 'linear': 1, 'gaussian': 2}
+    if not method in methods:
+        raise Exception('nms method should be one of {}'.format(', '.join(methods)))
+    cdef int _method = methods[method]
+    cdef np.ndarray[np.double_t, ndim=1] s = np.array(scores, dtype=np.double).ravel()
+    cdef siz n = s.shape[0]
+    # stable sort by descending score, ties keep their input order
+    order = np.argsort(-s, kind='mergesort')
+    s = np.ascontiguousarray(s[order])
+    cdef RLEs Rs = None
+    cdef np.ndarray[np.double_t, ndim=2] bb
+    if type(objs) == RLEs or (type(objs) == list and len(objs) > 0 and type(objs[0]) == dict):
+        Rs = _frString(objs)[order]
+        bb = toBbox(Rs)
+    else:
+        bb = np.array(objs, dtype=np.double).reshape((-1, 4))
+        bb = np.ascontiguousarray(bb[order])
+    if not bb.shape[0] == n:
+        raise Exception('the number of objects and scores should be the same')
+    cdef np.ndarray[np.uint32_t, ndim=1] cats
+    cdef uint* _cats = NULL
+    if categories is not None:
+        cats = np.unique(np.asarray(categories).ravel(), return_inverse=True)[1].astype(np.uint32)
+        if not cats.shape[0] == n:
+            raise Exception('the number of objects and categories should be the same')
+        cats = np.ascontiguousarray(cats[order])
+        _cats = <uint*> cats.data
+    cdef np.ndarray[np.intp_t, ndim=1] keep = np.zeros((n,), dtype=np.intp)
+    cdef RLE* _R = Rs._R if Rs is not None else NULL
+    cdef BB _bb = <BB> bb.data
+    cdef double* _s = <double*> s.data
+    cdef siz* _keep = <siz*> keep.data
+    cdef siz k
+    with nogil:
+        k = objNms(_bb, _R, _cats, _s, n, thr, _method, sigma, scoreThr, _keep)
+    kept = keep[:k]
+    if _method == 0:
+        return order[kept]
+    return order[kept], s[kept]
+
 def toBbox( rleObjs ):
     cdef RLEs Rs = _frString(rleObjs)
     cdef siz n = Rs.n
     cdef BB _bb = <BB> malloc(4*n* sizeof(double))
-    rleToBbox( <const RLE*> Rs._R, _bb, n )
+    with nogil:
+        rleToBbox( <const RLE*> Rs._R, _bb, n )
     cdef np.npy_intp shape[1]
     shape[0] = <np.npy_intp> 4*n
     bb = np.array((1,4*n), dtype=np.double)
@@ -252,18 +591,53 @@ def toBbox( rleObjs ):
 
 def frBbox(np.ndarray[np.double_t, ndim=2] bb, siz h, siz w ):
     cdef siz n = bb.shape[0]
-    Rs = RLEs(n)
-    rleFrBbox( <RLE*> Rs._R, <const BB> bb.data, h, w, n )
+    cdef RLEs Rs = RLEs(n)
+    cdef BB _bb = <BB> bb.data
+    with nogil:
+        rleFrBbox( <RLE*> Rs._R, <const BB> _bb, h, w, n )
+    objs = _toString(Rs)
+    return objs
+
+# paste n [mh x mw] soft masks (e.g. mask head outputs) into their [x y w h]
+# boxes of an [h x w] image and encode the pixels >= threshold, resizing
+# bilinearly and emitting the runs directly without an image-sized canvas
+def frBoxMasks(masks, bb, siz h, siz w, double threshold=0.5):
+    cdef np.ndarray[np.double_t, ndim=3] _masks = np.ascontiguousarray(masks, dtype=np.double)
+    cdef np.ndarray[np.double_t, ndim=2] _bb = np.ascontiguousarray(bb, dtype=np.double).reshape((-1, 4))
+    cdef siz n = _masks.shape[0], mh = _masks.shape[1], mw = _masks.shape[2]
+    if _bb.shape[0] != n:
+        raise Exception('The number of masks and boxes must be the same.')
+    if threshold <= 0:
+        raise Exception('threshold must be positive.')
+    cdef RLEs Rs = RLEs(n)
+    cdef double* M = <double*> _masks.data
+    cdef BB B = <BB> _bb.data
+    with nogil:
+        rleFrBoxMasks(Rs._R, M, mh, mw, B, h, w, n, threshold)
     objs = _toString(Rs)
     return objs
 
 def frPoly( poly, siz h, siz w ):
     cdef np.ndarray[np.double_t, ndim=1] np_poly
-    n = len(poly)
-    Rs = RLEs(n)
-    for i, p in enumerate(poly):
-        np_poly = np.array(p, dtype=np.double, order='F')
-        rleFrPoly( <RLE*>&Rs._R[i], <const double*> np_poly.data, int(len(p)/2), h, w )
+    cdef siz n = len(poly)
+    cdef RLEs Rs = RLEs(n)
+    # convert all polygons first, then rasterize them without the GIL
+    cdef double** xy = <double**> malloc(n* sizeof(double*))
+    cdef siz* k = <siz*> malloc(n* sizeof(siz))
+    cdef siz i
+    np_polys = []
+    try:
+        for i, p in enumerate(poly):
+            np_poly = np.array(p, dtype=np.double, order='F')
+            np_polys.append(np_poly)
+            xy[i] = <double*> np_poly.data
+            k[i] = int(len(p)/2)
+        with nogil:
+            for i in range(n):
+                rleFrPoly( <RLE*>&Rs._R[i], <const double*> xy[i], k[i], h, w )
+    finally:
+        free(xy)
+        free(k)
     objs = _toString(Rs)
     return objs
 
@@ -278,8 +652,7 @@ def frUncompressedRLE(ucRles, siz h, siz w):
         cnts = np.array(ucRles[i]['counts'], dtype=np.uint32)
         # time for malloc can be saved here but it's fine
         data = <uint*> malloc(len(cnts)* sizeof(uint))
-        for j in range(len(cnts)):
-            data[j] = <uint> cnts[j]
+        memcpy(data, cnts.data, len(cnts)* sizeof(uint))
         R = RLE(ucRles[i]['size'][0], ucRles[i]['size'][1], len(cnts), <uint*> data)
         Rs._R[0] = R
         objs.append(_toString(Rs)[0])
@@ -81,6 +81,7 @@ import numpy as np
 import copy
 import itertools
 from . import mask as maskUtils
+from .ioutils import open_text_file, iter_json_dataset
 import os
 from collections import defaultdict
 import sys
@@ -96,21 +97,30 @@ def _isArrayLike(obj):
 
 
 class COCO:
-    def __init__(self, annotation_file=None):
+    def __init__(self, annotation_file=None, stream=False):
         """
         Constructor of Microsoft COCO helper class for reading and visualizing annotations.
-        :param annotation_file (str): location of annotation file
+        :param annotation_file (str): location of annotation file (plain, gzip- or zstd-compressed)
         :param image_folder (str): location to the folder that hosts images.
+        :param stream (bool): parse the annotation file element by element and build the index on the fly,
+                              which needs much less peak memory for large files
         :return:
         """
         # load dataset
         self.dataset, self.anns, self.cats, self.imgs = dict(), dict(), dict(), dict()
         self.imgToAnns, self.catToImgs = defaultdict(list), defaultdict(list)
         if annotation_file is not None:
-            if isinstance(annotation_file, str):
+            if isinstance(annotation_file, str) and stream:
+                print('loading annotations and creating index...')
+                tic = time.time()
+                self.createIndexFromFile(annotation_file)
+                print('Done (t={:0.2f}s)'.format(time.time()- tic))
+            elif isinstance(annotation_file, str):
                 print('loading annotations into memory...')
                 tic = time.time()
-                dataset = json.load(open(annotation_file, 'r'))
+                textFile, rawFile = open_text_file(annotation_file)
+                with textFile, rawFile:
+                    dataset = json.load(textFile)
                 assert type(dataset)==dict, 'annotation file format {} not supported'.format(type(dataset))
                 print('Done (t={:0.2f}s)'.format(time.time()- tic))
                 self.dataset = dataset
@@ -152,6 +162,43 @@ class COCO:
         self.imgs = imgs
         self.cats = cats
 
+    def createIndexFromFile(self, annotation_file):
+        """
+        Stream the annotation file and build the dataset and the index while it is parsed,
+        without holding the whole file as text (see ioutils.iter_json_dataset).
+        :param annotation_file (str): location of annotation file (plain, gzip- or zstd-compressed)
+        :return:
+        """
+        dataset = {}
+        anns, cats, imgs = {}, {}, {}
+        imgToAnns,catToImgs = defaultdict(list),defaultdict(list)
+        for key, value, isElement in iter_json_dataset(annotation_file):
+            if not isElement:
+                dataset[key] = value
+                continue
+            dataset[key].append(value)
+            if key == 'annotations':
+                imgToAnns[value['image_id']].append(value)
+                anns[value['id']] = value
+                if 'category_id' in value:
+                    catToImgs[value['category_id']].append(value['image_id'])
+            elif key == 'images':
+                imgs[value['id']] = value
+            elif key == 'categories':
+                cats[value['id']] = value
+
+        # as in createIndex, catToImgs is only defined for datasets with categories
+        if 'categories' not in dataset:
+            catToImgs = defaultdict(list)
+
+        # create class members
+        self.dataset = dataset
+        self.anns = anns
+        self.imgToAnns = imgToAnns
+        self.catToImgs = catToImgs
+        self.imgs = imgs
+        self.cats = cats
+
     def info(self):
         """
         Print information about the annotation file.
@@ -447,42 +494,57 @@ class COCO:
         if 'caption' in anns[0]:
             imgIds = set([img['id'] for img in res.dataset['images']]) & set([ann['image_id'] for ann in anns])
             res.dataset['images'] = [img for img in res.dataset['images'] if img['id'] in imgIds]
-            for id, ann in enumerate(anns):
-                ann['id'] = id+1
-        elif 'bbox' in anns[0] and not anns[0]['bbox'] == []:
+        elif ('bbox' in anns[0] and not anns[0]['bbox'] == []) or 'segmentation' in anns[0] or 'keypoints' in anns[0]:
             res.dataset['categories'] = copy.deepcopy(self.dataset['categories'])
-            for id, ann in enumerate(anns):
+        self.prepareRes(anns)
+        print('DONE (t={:0.2f}s)'.format(time.time()- tic))
+
+        res.dataset['annotations'] = anns
+        res.createIndex()
+        return res
+
+    def prepareRes(self, anns, startId=1):
+        """
+        Fill in the ids and the fields derived from the result type (area, bbox, iscrowd)
+        of result annotations in place, as done by loadRes.
+        :param   anns (object array): result annotations of a single type
+        :param   startId (int)      : id assigned to the first annotation
+        :return: None
+        """
+        if len(anns) == 0:
+            return
+        if 'caption' in anns[0]:
+            for id, ann in enumerate(anns, startId):
+                ann['id'] = id
+        elif 'bbox' in anns[0] and not anns[0]['bbox'] == []:
+            for id, ann in enumerate(anns, startId):
                 bb = ann['bbox']
                 x1, x2, y1, y2 = [bb[0], bb[0]+bb[2], bb[1], bb[1]+bb[3]]
                 if not 'segmentation' in ann:
                     ann['segmentation'] = [[x1, y1, x1, y2, x2, y2, x2, y1]]
                 ann['area'] = bb[2]*bb[3]
-                ann['id'] = id+1
+                ann['id'] = id
                 ann['iscrowd'] = 0
         elif 'segmentation' in anns[0]:
-            res.dataset['categories'] = copy.deepcopy(self.dataset['categories'])
-            for id, ann in enumerate(anns):
-                # now only support compressed RLE format as segmentation results
-                ann['area'] = maskUtils.area(ann['segmentation'])
+            # now only support compressed RLE format as segmentation results
+            # parse all of them once for both the areas and the boxes
+            Rs = maskUtils.RLEs([ann['segmentation'] for ann in anns])
+            areas, bbs = maskUtils.area(Rs), maskUtils.toBbox(Rs)
+            for id, ann in enumerate(anns, startId):
+                ann['area'] = areas[id-startId]
                 if not 'bbox' in ann:
-                    ann['bbox'] = maskUtils.toBbox(ann['segmentation'])
-                ann['id'] = id+1
+                    ann['bbox'] = bbs[id-startId]
+                ann['id'] = id
                 ann['iscrowd'] = 0
         elif 'keypoints' in anns[0]:
-            res.dataset['categories'] = copy.deepcopy(self.dataset['categories'])
-            for id, ann in enumerate(anns):
+            for id, ann in enumerate(anns, startId):
                 s = ann['keypoints']
                 x = s[0::3]
                 y = s[1::3]
                 x0,x1,y0,y1 = np.min(x), np.max(x), np.min(y), np.max(y)
                 ann['area'] = (x1-x0)*(y1-y0)
-                ann['id'] = id + 1
+                ann['id'] = id
                 ann['bbox'] = [x0,y0,x1-x0,y1-y0]
-        print('DONE (t={:0.2f}s)'.format(time.time()- tic))
-
-        res.dataset['annotations'] = anns
-        res.createIndex()
-        return res
 
     def download(self, tarDir = None, imgIds = [] ):
         '''
@@ -23,17 +23,16 @@ def annsToSeg(anns, coco_instance):
     h = image_details['height']
     w = image_details['width']
 
-    class_seg = np.zeros((h, w))
-    instance_seg = np.zeros((h, w))
-    id_seg = np.zeros((h, w))
-    masks, anns = annsToMask(anns, h, w)
+    # smaller items first, so they are not covered by overlapping segs
+    anns = sorted(anns, key=lambda x: x['area'])
+    rles = maskUtils.RLEs([annToRLE(ann, h, w) for ann in anns])
 
-    for i, mask in enumerate(masks):
-        class_seg = np.where(class_seg>0, class_seg, mask*anns[i]['category_id'])
-        instance_seg = np.where(instance_seg>0, instance_seg, mask*(i+1))
-        id_seg = np.where(id_seg > 0, id_seg, mask * anns[i]['id'])
+    class_seg = maskUtils.decodeLabelMap(rles, [ann['category_id'] for ann in anns], overlap='first')
+    instance_seg = maskUtils.decodeLabelMap(rles, np.arange(1, len(anns) + 1), overlap='first')
+    id_seg = maskUtils.decodeLabelMap(rles, [ann['id'] for ann in anns], dtype=np.int64, overlap='first')
 
-    return class_seg, instance_seg, id_seg.astype(np.int64)
+    # the class and instance maps are float64 like before
+    return class_seg.astype(np.float64), instance_seg.astype(np.float64), id_seg
 
 
 def annToRLE(ann, h, w):
@@ -4,8 +4,12 @@ import numpy as np
 import datetime
 import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from . import mask as maskUtils
+from . import _cocoeval
+from .ioutils import save_checkpoint, load_checkpoint, annotations_fingerprint
 import copy
+import os
 
 class COCOeval:
     # Interface for evaluating detection on the Microsoft COCO dataset.
@@ -29,6 +33,7 @@ class COCOeval:
     #  iouType    - ['segm'] set iouType to 'segm', 'bbox' or 'keypoints'
     #  iouType replaced the now DEPRECATED useSegm parameter.
     #  useCats    - [1] if true use category labels for evaluation
+    #  kpt_oks_sigmas - [None] keypoint OKS sigmas (array or dict keyed by catId)
     # Note: if useCats=0 category labels are ignored as in proposal scoring.
     # Note: multiple areaRngs [Ax2] and maxDets [Mx1] can be specified.
     #
@@ -41,6 +46,17 @@ class COCOeval:
     #  dtScores   - [1xD] confidence of each dt
     #  gtIgnore   - [1xG] ignore flag for each gt
     #  dtIgnore   - [TxD] ignore flag for each dt at each IoU
+    # evaluate(workers=N) shards the images across N processes and merges the
+    # results into the same "evalImgs" order as a serial run.
+    # evaluate(sparse=True) only visits (image, category) pairs that have gts
+    # or dts and stores "evalImgs" as a dict keyed by (imgId, catId) holding
+    # one result per area range, which accumulate() understands as well.
+    # evaluate(compact=True) keeps the results in a columnar EvalImgsStore and
+    # exposes "evalImgs" as a lazy view of it (see also COCOevalOnline).
+    # evaluate(checkpoint=path) saves the results of finished shards of images
+    # to path every checkpointInterval seconds; an evaluation restarted with the
+    # same path and params skips them. The file is removed once evaluate is
+    # done. The ious of resumed shards are not restored.
     #
     # accumulate(): accumulates the per-image, per-category evaluation
     # results in "evalImgs" into the dictionary "eval" with fields:
@@ -77,6 +93,11 @@ class COCOeval:
         self._paramsEval = {}               # parameters for evaluation
         self.stats = []                     # result summarization
         self.ious = {}                      # ious between all gts and dts
+        self._iouCache = None               # signatures of the ious kept for the next evaluate()
+        self._iousReuse = {}                # cached ious valid for the current evaluate()
+        self._iouStats = {}                 # number of reused and computed ious
+        self._sigmas = {}                   # keypoint sigmas of each category
+        self._rles = {}                     # parsed RLEs of the gt and dt segmentations
         if not cocoGt is None:
             self.params.imgIds = sorted(cocoGt.getImgIds())
             self.params.catIds = sorted(cocoGt.getCatIds())
@@ -87,11 +108,6 @@ class COCOeval:
         Prepare ._gts and ._dts for evaluation based on params
         :return: None
         '''
-        def _toMask(anns, coco):
-            # modify ann['segmentation'] by reference
-            for ann in anns:
-                rle = coco.annToRLE(ann)
-                ann['segmentation'] = rle
         p = self.params
         if p.useCats:
             gts=self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=p.imgIds, catIds=p.catIds))
@@ -99,29 +115,57 @@ class COCOeval:
         else:
             gts=self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=p.imgIds))
             dts=self.cocoDt.loadAnns(self.cocoDt.getAnnIds(imgIds=p.imgIds))
+        self._gts, self._dts = self._groupAnns(gts, dts, self.cocoDt)
+        self.evalImgs = defaultdict(list)   # per-image per-category evaluation results
+        self.eval     = {}                  # accumulated evaluation results
 
+    def _groupAnns(self, gts, dts, cocoDt):
+        '''
+        Convert and flag gts and dts for evaluation and group them by (imgId, catId)
+        :param gts: gt annotations (modified in place)
+        :param dts: dt annotations (modified in place)
+        :param cocoDt: coco object the dts belong to (used for the image sizes)
+        :return: gts and dts grouped in two dicts keyed by (imgId, catId)
+        '''
+        def _toMask(anns, coco):
+            # modify ann['segmentation'] by reference
+            for ann in anns:
+                rle = coco.annToRLE(ann)
+                ann['segmentation'] = rle
+        p = self.params
         # convert ground truth to mask if iouType == 'segm'
         if p.iouType == 'segm':
             _toMask(gts, self.cocoGt)
-            _toMask(dts, self.cocoDt)
+            _toMask(dts, cocoDt)
+            # parse all RLEs once, computeIoU gathers views of them
+            self._rles = {'gt': self._parseRles(gts), 'dt': self._parseRles(dts)}
+        else:
+            self._rles = {}
         # set ignore flag
         for gt in gts:
             gt['ignore'] = gt['ignore'] if 'ignore' in gt else 0
             gt['ignore'] = 'iscrowd' in gt and gt['iscrowd']
             if p.iouType == 'keypoints':
                 gt['ignore'] = (gt['num_keypoints'] == 0) or gt['ignore']
-        self._gts = defaultdict(list)       # gt for evaluation
-        self._dts = defaultdict(list)       # dt for evaluation
+        _gts = defaultdict(list)       # gt for evaluation
+        _dts = defaultdict(list)       # dt for evaluation
         for gt in gts:
-            self._gts[gt['image_id'], gt['category_id']].append(gt)
+            _gts[gt['image_id'], gt['category_id']].append(gt)
         for dt in dts:
-            self._dts[dt['image_id'], dt['category_id']].append(dt)
-        self.evalImgs = defaultdict(list)   # per-image per-category evaluation results
-        self.eval     = {}                  # accumulated evaluation results
+            _dts[dt['image_id'], dt['category_id']].append(dt)
+        return _gts, _dts
 
-    def evaluate(self):
+    def evaluate(self, workers=None, sparse=False, compact=False, checkpoint=None, checkpointInterval=60):
         '''
         Run per image evaluation on given images and store results (a list of dict) in self.evalImgs
+        :param workers: number of worker processes the images are sharded across (default: serial)
+        :param sparse: only evaluate (image, category) pairs with gts or dts and store the results
+                       in a dict keyed by (imgId, catId) holding one result per area range
+        :param compact: only evaluate (image, category) pairs with gts or dts and keep the results in
+                        a columnar EvalImgsStore; self.evalImgs is then a lazy EvalImgsView of it
+        :param checkpoint: path of a file the results of finished images are saved to, and
+                           resumed from if it exists (compact=True keeps it small)
+        :param checkpointInterval: minimum number of seconds between two checkpoint saves
         :return: None
         '''
         tic = time.time()
@@ -139,27 +183,285 @@ class COCOeval:
         self.params=p
 
         self._prepare()
+        self._sigmas = {catId: self._catSigmas(catId) for catId in p.catIds} if p.iouType == 'keypoints' else {}
+        # ious still valid from the last evaluate() are not computed again
+        self._iousReuse = self._reusableIous()
         # loop through images, area range, max detection number
+        layout = 'compact' if compact else 'sparse' if sparse else 'dense'
+        if checkpoint is not None or (workers is not None and workers > 1):
+            self.ious, evalImgs = self._evaluateParallel(p.imgIds, workers, layout, checkpoint, checkpointInterval)
+        else:
+            self.ious, evalImgs = self._evaluateImgs(p.imgIds, layout)
+        if compact:
+            self.evalImgs = EvalImgsView(evalImgs, p)
+        elif sparse:
+            self.evalImgs = evalImgs
+        else:
+            # flatten to the [KxAxI] layout indexed by accumulate()
+            self.evalImgs = [e for evalCat in evalImgs for evalArea in evalCat for e in evalArea]
+        self._updateIouCache()
+        self._paramsEval = copy.deepcopy(self.params)
+        toc = time.time()
+        print('DONE (t={:0.2f}s).'.format(toc-tic))
+
+    def reevaluate(self, params=None, **kwargs):
+        '''
+        Run evaluate() again (e.g. after changing areaRng, iouThrs or maxDets), recomputing
+        only the matching while the gts, dts and top maxDets[-1] dts of a pair are unchanged
+        :param params: new params (default: keep self.params)
+        :param kwargs: options passed on to evaluate()
+        :return: dict with the number of (image, category) iou matrices 'reused' and 'computed'
+        '''
+        if params is not None:
+            self.params = params
+        self.evaluate(**kwargs)
+        print('Reused {reused} and computed {computed} iou matrices.'.format(**self._iouStats))
+        return dict(self._iouStats)
+
+    def _iouKey(self):
+        # everything besides the gts and dts of a pair the ious depend on
+        p = self.params
+        sigmas = tuple((catId, tuple(sigmas)) for catId, sigmas in sorted(self._sigmas.items()))
+        return (p.iouType, p.useCats, None if p.useCats else tuple(p.catIds), id(self.cocoGt), id(self.cocoDt), sigmas)
+
+    def _iouSig(self, imgId, catId):
+        # (gt id, crowd, geometry) and (dt id, score, geometry) the ious of a pair were computed from,
+        # so anns edited in place or from another coco object are not mistaken for the cached ones
+        p = self.params
+        if p.useCats:
+            gt = self._gts[imgId,catId]
+            dt = self._dts[imgId,catId]
+        else:
+            gt = [_ for cId in p.catIds for _ in self._gts[imgId,cId]]
+            dt = [_ for cId in p.catIds for _ in self._dts[imgId,cId]]
+        geom = self._geomSig
+        return tuple((g['id'], g['iscrowd'], geom(g)) for g in gt), tuple((d['id'], d['score'], geom(d)) for d in dt)
+
+    def _geomSig(self, ann):
+        # the part of an ann the ious depend on (the segmentation is an RLE after _prepare)
+        iouType = self.params.iouType
+        if iouType == 'segm':
+            return tuple(ann['segmentation']['size']), ann['segmentation']['counts']
+        if iouType == 'bbox':
+            return tuple(ann['bbox'])
+        return tuple(ann['keypoints']), tuple(ann.get('bbox', ())), ann.get('area')
+
+    def _reusableIous(self):
+        '''
+        Get the ious of the last evaluate() that are still valid for the current params
+        :return: dict of ious keyed by (imgId, catId)
+        '''
+        cache = self._iouCache
+        if cache is None or cache['key'] != self._iouKey():
+            return {}
+        p = self.params
+        setI = set(p.imgIds)
+        setK = set(p.catIds) if p.useCats else set([-1])
+        return {key: self.ious[key] for key, (sig, cacheMaxDet) in cache['sigs'].items()
+                if key[0] in setI and key[1] in setK and key in self.ious
+                and p.maxDets[-1] <= cacheMaxDet and sig == self._iouSig(*key)}
+
+    def _updateIouCache(self):
+        '''
+        Record the signatures of self.ious so the next evaluate() can reuse them
+        :return: None
+        '''
+        maxDet = self.params.maxDets[-1]
+        sigs = {}
+        oldSigs = self._iouCache['sigs'] if self._iousReuse else {}
+        for key in self.ious:
+            if key in self._iousReuse:
+                sigs[key] = oldSigs[key]
+                continue
+            sig = self._iouSig(*key)
+            # ious of pairs with at most maxDet dts are not cut and valid for any maxDet
+            sigs[key] = (sig, maxDet if len(sig[1]) > maxDet else float('inf'))
+        self._iouCache = {'key': self._iouKey(), 'sigs': sigs}
+        self._iouStats = {'reused': len(self._iousReuse), 'computed': len(self.ious) - len(self._iousReuse)}
+        self._iousReuse = {}
+
+    def _evaluateImgs(self, imgIds, layout='dense'):
+        '''
+        Compute ious and per image evaluation results for the given images
+        :param imgIds: ids of the images to evaluate
+        :param layout: 'dense' evaluates every (image, category) pair, 'sparse' and 'compact'
+                       only the pairs with gts or dts
+        :return: ious (dict) and evalImgs ([K][A] nested lists of results for each image in imgIds
+                 if dense, a dict of [A] results keyed by (imgId, catId) if sparse, or an
+                 EvalImgsStore if compact)
+        '''
+        p = self.params
         catIds = p.catIds if p.useCats else [-1]
 
         if p.iouType == 'segm' or p.iouType == 'bbox':
-            computeIoU = self.computeIoU
+            _computeIoU = self.computeIoU
         elif p.iouType == 'keypoints':
-            computeIoU = self.computeOks
+            _computeIoU = self.computeOks
+        def computeIoU(imgId, catId):
+            ious = self._iousReuse.get((imgId, catId))
+            return _computeIoU(imgId, catId) if ious is None else ious
+        # all area ranges of an (image, category) pair are evaluated in one pass
+        evaluateImgAreas = self.evaluateImgAreas
+        maxDet = p.maxDets[-1]
+
+        if layout == 'sparse':
+            pairs = self._evalPairs(imgIds)
+            self.ious = {(imgId, catId): computeIoU(imgId, catId) for imgId, catId in pairs}
+            evalImgs = {(imgId, catId): evaluateImgAreas(imgId, catId, p.areaRng, maxDet)
+                        for imgId, catId in pairs}
+            return self.ious, evalImgs
+
+        if layout == 'compact':
+            # the store packs the results in small chunks as they come in, so only a few
+            # result dicts of each category and area range are alive at a time
+            store = EvalImgsStore(len(catIds), len(p.areaRng), len(p.iouThrs))
+            catPos = {catId: k for k, catId in enumerate(catIds)}
+            imgPos = {imgId: i for i, imgId in enumerate(p.imgIds)}
+            self.ious = {}
+            for imgId, catId in self._evalPairs(imgIds):
+                self.ious[imgId, catId] = computeIoU(imgId, catId)
+                for a, e in enumerate(evaluateImgAreas(imgId, catId, p.areaRng, maxDet)):
+                    store.add(catPos[catId], a, imgPos[imgId], e)
+            store.flush()
+            return self.ious, store
+
         self.ious = {(imgId, catId): computeIoU(imgId, catId) \
-                        for imgId in p.imgIds
+                        for imgId in imgIds
                         for catId in catIds}
 
-        evaluateImg = self.evaluateImg
-        maxDet = p.maxDets[-1]
-        self.evalImgs = [evaluateImg(imgId, catId, areaRng, maxDet)
-                 for catId in catIds
-                 for areaRng in p.areaRng
-                 for imgId in p.imgIds
-             ]
-        self._paramsEval = copy.deepcopy(self.params)
-        toc = time.time()
-        print('DONE (t={:0.2f}s).'.format(toc-tic))
+        evalImgs = [[[] for _ in p.areaRng] for _ in catIds]
+        for k, catId in enumerate(catIds):
+            for imgId in imgIds:
+                for a, e in enumerate(evaluateImgAreas(imgId, catId, p.areaRng, maxDet)):
+                    evalImgs[k][a].append(e)
+        return self.ious, evalImgs
+
+    def _evalPairs(self, imgIds):
+        '''
+        Get the (imgId, catId) pairs of the given images that have any gt or dt
+        :param imgIds: ids of the images to evaluate
+        :return: sorted list of (imgId, catId) pairs, catId is -1 if useCats=0
+        '''
+        setI = set(imgIds)
+        pairs = set(key for key, anns in self._gts.items() if len(anns) > 0 and key[0] in setI)
+        pairs |= set(key for key, anns in self._dts.items() if len(anns) > 0 and key[0] in setI)
+        if not self.params.useCats:
+            pairs = set((imgId, -1) for imgId, _ in pairs)
+        return sorted(pairs)
+
+    def _evaluateParallel(self, imgIds, workers, layout='dense', checkpoint=None, checkpointInterval=60):
+        '''
+        Shard the images across a process pool (or evaluate the shards in this process if
+        workers is None) and merge the per image results in the same order as a serial run
+        of _evaluateImgs. With a checkpoint the results of finished shards are saved to it
+        and the shards already in it are not evaluated again.
+        :param imgIds: ids of the images to evaluate
+        :param workers: number of worker processes
+        :param layout: 'dense', 'sparse' or 'compact' (see _evaluateImgs)
+        :param checkpoint: path of the checkpoint file (default: no checkpoints)
+        :param checkpointInterval: minimum number of seconds between two checkpoint saves
+        :return: ious (dict) and evalImgs (see _evaluateImgs)
+        '''
+        p = self.params
+        catIds = p.catIds if p.useCats else [-1]
+        parallel = workers is not None and workers > 1
+        # results of finished shards (ious are not checkpointed)
+        done, bounds = {}, None
+        checkpointKey = None if checkpoint is None else self._checkpointKey(imgIds, layout)
+        if checkpoint is not None:
+            state = load_checkpoint(checkpoint)
+            if state is not None:
+                if state['key'] != checkpointKey:
+                    raise Exception('The checkpoint {} was saved by a different evaluation, '
+                                    'remove it to start over.'.format(checkpoint))
+                bounds = state['bounds']
+                done = {s: ({}, evalImgs) for s, evalImgs in state['evalImgs'].items()}
+                print('Resuming {} of {} shards from {}'.format(len(done), len(bounds)-1, checkpoint))
+        if bounds is None:
+            # contiguous shards (a few per worker for load balancing) keep the merge a simple
+            # concatenation, checkpoints are saved at shard granularity
+            nShards = 4*workers if parallel else 1
+            if checkpoint is not None:
+                nShards = max(nShards, 100)
+            nShards = min(len(imgIds), nShards)
+            bounds = np.linspace(0, len(imgIds), nShards+1).astype(int).tolist()
+        shards = [imgIds[b0:b1] for b0, b1 in zip(bounds[:-1], bounds[1:])]
+        todo = [s for s in range(len(shards)) if s not in done]
+        shardOf = {imgId: s for s in todo for imgId in shards[s]}
+        gts = {s: defaultdict(list) for s in todo}
+        dts = {s: defaultdict(list) for s in todo}
+        for key, anns in self._gts.items():
+            if key[0] in shardOf:
+                gts[shardOf[key[0]]][key] = anns
+        for key, anns in self._dts.items():
+            if key[0] in shardOf:
+                dts[shardOf[key[0]]][key] = anns
+        # each worker gets a light copy of the evaluator without the coco apis
+        jobs = []
+        for s in todo:
+            E = copy.copy(self)
+            E.cocoGt, E.cocoDt = None, None
+            E._gts, E._dts = gts[s], dts[s]
+            E.ious, E.evalImgs, E.eval = {}, [], {}
+            E._iouCache = None
+            E._rles = {}    # ann identities do not survive pickling, workers use the dicts
+            E._iousReuse = {key: ious for key, ious in self._iousReuse.items() if shardOf.get(key[0]) == s}
+            jobs.append((E, shards[s], layout))
+
+        def saveCheckpoint():
+            save_checkpoint(checkpoint, {'key': checkpointKey, 'bounds': bounds,
+                                         'evalImgs': {s: evalImgs for s, (_, evalImgs) in done.items()}})
+
+        executor = ProcessPoolExecutor(max_workers=workers) if parallel else None
+        try:
+            results = executor.map(_evaluateShard, jobs) if parallel else map(_evaluateShard, jobs)
+            lastSave = time.time()
+            for s, result in zip(todo, results):
+                done[s] = result
+                if checkpoint is not None and time.time() - lastSave >= checkpointInterval:
+                    saveCheckpoint()
+                    lastSave = time.time()
+        except BaseException:
+            # keep what is done (e.g. on KeyboardInterrupt) for the next run
+            if checkpoint is not None and len(done) > 0:
+                saveCheckpoint()
+            raise
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        ious = {}
+        if layout == 'compact':
+            evalImgs = EvalImgsStore(len(catIds), len(p.areaRng), len(p.iouThrs))
+        elif layout == 'sparse':
+            evalImgs = {}
+        else:
+            evalImgs = [[[] for _ in p.areaRng] for _ in catIds]
+        for s in range(len(shards)):
+            shardIous, shardEvalImgs = done[s]
+            ious.update(shardIous)
+            if layout == 'compact':
+                evalImgs.merge(shardEvalImgs)
+                continue
+            if layout == 'sparse':
+                evalImgs.update(shardEvalImgs)
+                continue
+            for k, evalCat in enumerate(shardEvalImgs):
+                for a, evalArea in enumerate(evalCat):
+                    evalImgs[k][a].extend(evalArea)
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        return ious, evalImgs
+
+    def _checkpointKey(self, imgIds, layout):
+        # everything the results saved in a checkpoint depend on, including the content of the annotations
+        p = self.params
+        sigmas = tuple((catId, tuple(sigmas)) for catId, sigmas in sorted(self._sigmas.items()))
+        gts = [gt for key in sorted(self._gts) for gt in self._gts[key]]
+        dts = [dt for key in sorted(self._dts) for dt in self._dts[key]]
+        return (p.iouType, p.useCats, tuple(p.catIds), tuple(imgIds), tuple(p.iouThrs),
+                tuple(tuple(r) for r in p.areaRng), tuple(p.maxDets), sigmas, layout,
+                annotations_fingerprint(gts), annotations_fingerprint(dts))
 
     def computeIoU(self, imgId, catId):
         p = self.params
@@ -177,8 +479,8 @@ class COCOeval:
             dt=dt[0:p.maxDets[-1]]
 
         if p.iouType == 'segm':
-            g = [g['segmentation'] for g in gt]
-            d = [d['segmentation'] for d in dt]
+            g = self._annRles(gt, self._rles.get('gt'))
+            d = self._annRles(dt, self._rles.get('dt'))
         elif p.iouType == 'bbox':
             g = [g['bbox'] for g in gt]
             d = [d['bbox'] for d in dt]
@@ -190,6 +492,23 @@ class COCOeval:
         ious = maskUtils.iou(d,g,iscrowd)
         return ious
 
+    def _parseRles(self, anns):
+        '''
+        Parse the RLE segmentations of anns in one go
+        :return: RLEs and dict mapping id(ann) to its index
+        '''
+        return maskUtils.RLEs([ann['segmentation'] for ann in anns]), {id(ann): i for i, ann in enumerate(anns)}
+
+    def _annRles(self, anns, parsed):
+        '''
+        Get the segmentations of anns as views of the parsed RLEs, or as the
+        RLE dicts if some of them were not parsed
+        '''
+        inds = [parsed[1].get(id(ann)) for ann in anns] if parsed is not None else [None]
+        if None in inds:
+            return [ann['segmentation'] for ann in anns]
+        return parsed[0][inds]
+
     def computeOks(self, imgId, catId):
         p = self.params
         # dimention here should be Nxm
@@ -202,37 +521,58 @@ class COCOeval:
         # if len(gts) == 0 and len(dts) == 0:
         if len(gts) == 0 or len(dts) == 0:
             return []
-        ious = np.zeros((len(dts), len(gts)))
-        sigmas = np.array([.26, .25, .25, .35, .35, .79, .79, .72, .72, .62,.62, 1.07, 1.07, .87, .87, .89, .89])/10.0
+        sigmas = self._sigmas.get(catId)
+        if sigmas is None:
+            sigmas = self._catSigmas(catId)
         vars = (sigmas * 2)**2
         k = len(sigmas)
-        # compute oks between each detection and ground truth object
-        for j, gt in enumerate(gts):
-            # create bounds for ignore regions(double the gt bbox)
-            g = np.array(gt['keypoints'])
-            xg = g[0::3]; yg = g[1::3]; vg = g[2::3]
-            k1 = np.count_nonzero(vg > 0)
-            bb = gt['bbox']
-            x0 = bb[0] - bb[2]; x1 = bb[0] + bb[2] * 2
-            y0 = bb[1] - bb[3]; y1 = bb[1] + bb[3] * 2
-            for i, dt in enumerate(dts):
-                d = np.array(dt['keypoints'])
-                xd = d[0::3]; yd = d[1::3]
-                if k1>0:
-                    # measure the per-keypoint distance if keypoints visible
-                    dx = xd - xg
-                    dy = yd - yg
-                else:
-                    # measure minimum distance to keypoints in (x0,y0) & (x1,y1)
-                    z = np.zeros((k))
-                    dx = np.max((z, x0-xd),axis=0)+np.max((z, xd-x1),axis=0)
-                    dy = np.max((z, y0-yd),axis=0)+np.max((z, yd-y1),axis=0)
-                e = (dx**2 + dy**2) / vars / (gt['area']+np.spacing(1)) / 2
-                if k1 > 0:
-                    e=e[vg > 0]
-                ious[i, j] = np.sum(np.exp(-e)) / e.shape[0]
+        g = np.array([gt['keypoints'] for gt in gts], dtype=np.double).reshape((len(gts), -1, 3))
+        d = np.array([dt['keypoints'] for dt in dts], dtype=np.double).reshape((len(dts), -1, 3))
+        if g.shape[1] != k or d.shape[1] != k:
+            raise Exception('number of keypoints of category {} does not match its {} sigmas'.format(catId, k))
+        # compute oks between all detections [D] and ground truth objects [G] at once, arrays are [DxGxk]
+        xg = g[:, :, 0]; yg = g[:, :, 1]; vg = g[:, :, 2]
+        xd = d[:, None, :, 0]; yd = d[:, None, :, 1]
+        vis = vg > 0
+        k1 = np.count_nonzero(vis, axis=1)
+        # create bounds for ignore regions(double the gt bbox)
+        bb = np.array([gt['bbox'] for gt in gts], dtype=np.double).reshape((len(gts), 4))
+        x0 = (bb[:, 0] - bb[:, 2])[:, None]; x1 = (bb[:, 0] + bb[:, 2] * 2)[:, None]
+        y0 = (bb[:, 1] - bb[:, 3])[:, None]; y1 = (bb[:, 1] + bb[:, 3] * 2)[:, None]
+        # measure the per-keypoint distance if keypoints visible, else the
+        # minimum distance to keypoints in (x0,y0) & (x1,y1) over all keypoints
+        noVis = (k1 == 0)[:, None]
+        dx = np.where(noVis, np.maximum(0, x0-xd) + np.maximum(0, xd-x1), xd - xg)
+        dy = np.where(noVis, np.maximum(0, y0-yd) + np.maximum(0, yd-y1), yd - yg)
+        area = np.array([gt['area'] for gt in gts], dtype=np.double)[:, None]
+        e = np.exp(-((dx**2 + dy**2) / vars / (area+np.spacing(1)) / 2))
+        # average over the visible keypoints (all if none visible); gts are grouped by
+        # their count so each sum runs over the same contiguous values as per pair
+        vis[k1 == 0] = True
+        n = np.count_nonzero(vis, axis=1)
+        ious = np.zeros((len(dts), len(gts)))
+        for c in np.unique(n):
+            js = np.nonzero(n == c)[0]
+            kpts = np.nonzero(vis[js])[1].reshape((len(js), c))
+            ious[:, js] = np.sum(np.ascontiguousarray(e[:, js[:, None], kpts]), axis=2) / c
         return ious
 
+    def _catSigmas(self, catId):
+        '''
+        Get the OKS sigmas of a category from params.kpt_oks_sigmas (an array for all
+        categories or a dict keyed by catId), else from the 'sigmas' field of the
+        category entry, else the COCO person sigmas
+        :return: [k] array of sigmas
+        '''
+        sigmas = getattr(self.params, 'kpt_oks_sigmas', None)
+        if isinstance(sigmas, dict):
+            sigmas = sigmas.get(catId)
+        if sigmas is None and self.cocoGt is not None and catId in self.cocoGt.cats:
+            sigmas = self.cocoGt.cats[catId].get('sigmas')
+        if sigmas is None:
+            sigmas = COCO_PERSON_SIGMAS
+        return np.array(sigmas, dtype=np.double)
+
     def evaluateImg(self, imgId, catId, aRng, maxDet):
         '''
         perform evaluation for single category and image
@@ -260,41 +600,19 @@ class COCOeval:
         dtind = np.argsort([-d['score'] for d in dt], kind='mergesort')
         dt = [dt[i] for i in dtind[0:maxDet]]
         iscrowd = [int(o['iscrowd']) for o in gt]
-        # load computed ious
-        ious = self.ious[imgId, catId][:, gtind] if len(self.ious[imgId, catId]) > 0 else self.ious[imgId, catId]
+        # load computed ious (cached ious may hold more dts than maxDet)
+        ious = self.ious[imgId, catId][:len(dt), gtind] if len(self.ious[imgId, catId]) > 0 else self.ious[imgId, catId]
 
         T = len(p.iouThrs)
-        G = len(gt)
-        D = len(dt)
-        gtm  = np.zeros((T,G))
-        dtm  = np.zeros((T,D))
         gtIg = np.array([g['_ignore'] for g in gt])
-        dtIg = np.zeros((T,D))
-        if not len(ious)==0:
-            for tind, t in enumerate(p.iouThrs):
-                for dind, d in enumerate(dt):
-                    # information about best match so far (m=-1 -> unmatched)
-                    iou = min([t,1-1e-10])
-                    m   = -1
-                    for gind, g in enumerate(gt):
-                        # if this gt already matched, and not a crowd, continue
-                        if gtm[tind,gind]>0 and not iscrowd[gind]:
-                            continue
-                        # if dt matched to reg gt, and on ignore gt, stop
-                        if m>-1 and gtIg[m]==0 and gtIg[gind]==1:
-                            break
-                        # continue to next gt unless better match made
-                        if ious[dind,gind] < iou:
-                            continue
-                        # if match successful and best so far, store appropriately
-                        iou=ious[dind,gind]
-                        m=gind
-                    # if match made store id of match for both dt and gt
-                    if m ==-1:
-                        continue
-                    dtIg[tind,dind] = gtIg[m]
-                    dtm[tind,dind]  = gt[m]['id']
-                    gtm[tind,m]     = d['id']
+        # greedy matching at every iou threshold is done by the compiled kernel
+        gtm, dtm, dtIg = _cocoeval.evaluateMatches(
+            np.asarray(ious, dtype=np.double).reshape((len(dt), len(gt)) if len(ious) > 0 else (0, 0)),
+            np.array(gtIg, dtype=np.uint8),
+            np.array(iscrowd, dtype=np.uint8),
+            np.asarray(p.iouThrs, dtype=np.double),
+            np.array([g['id'] for g in gt], dtype=np.double),
+            np.array([d['id'] for d in dt], dtype=np.double))
         # set unmatched detections outside of area range to ignore
         a = np.array([d['area']<aRng[0] or d['area']>aRng[1] for d in dt]).reshape((1, len(dt)))
         dtIg = np.logical_or(dtIg, np.logical_and(dtm==0, np.repeat(a,T,0)))
@@ -313,6 +631,71 @@ class COCOeval:
                 'dtIgnore':     dtIg,
             }
 
+    def evaluateImgAreas(self, imgId, catId, aRngs, maxDet):
+        '''
+        perform evaluation for single category and image for all area ranges in one pass
+        (same results as evaluateImg for each area range)
+        :return: list of dicts (single image results, one per area range)
+        '''
+        p = self.params
+        if p.useCats:
+            gt = self._gts[imgId,catId]
+            dt = self._dts[imgId,catId]
+        else:
+            gt = [_ for cId in p.catIds for _ in self._gts[imgId,cId]]
+            dt = [_ for cId in p.catIds for _ in self._dts[imgId,cId]]
+        if len(gt) == 0 and len(dt) ==0:
+            return [None for _ in aRngs]
+
+        # ignore flags of the gts for every area range [AxG] and their ignore-last orders
+        rngs = np.array(aRngs, dtype=np.double).reshape((-1, 2))
+        gtArea = np.array([g['area'] for g in gt], dtype=np.double)
+        gtIg = np.array([bool(g['ignore']) for g in gt], dtype=bool).reshape((1, len(gt)))
+        gtIg = (gtIg | (gtArea < rngs[:, :1]) | (gtArea > rngs[:, 1:])).astype(np.uint8)
+        gtOrder = np.argsort(gtIg, axis=1, kind='mergesort')
+        # sort dt highest score first, once for all area ranges
+        dtind = np.argsort([-d['score'] for d in dt], kind='mergesort')
+        dt = [dt[i] for i in dtind[0:maxDet]]
+        dtArea = np.array([d['area'] for d in dt], dtype=np.double)
+        dtOut = (dtArea < rngs[:, :1]) | (dtArea > rngs[:, 1:])
+        ious = self.ious[imgId, catId]
+        ious = np.asarray(ious, dtype=np.double)[:len(dt)] if len(ious) > 0 else np.zeros((0, 0))
+
+        # area ranges that ignore the same gts share the matching
+        first = {}
+        for a, row in enumerate(gtIg):
+            first.setdefault(row.tobytes(), a)
+        uniq = np.array(sorted(first.values()), dtype=np.intp)
+        inv = np.searchsorted(uniq, [first[row.tobytes()] for row in gtIg])
+        gtm, dtm, dtIg = _cocoeval.evaluateMatchesAreas(
+            ious, gtOrder[uniq], gtIg[uniq],
+            np.array([o['iscrowd'] for o in gt], dtype=np.uint8),
+            np.asarray(p.iouThrs, dtype=np.double),
+            np.array([g['id'] for g in gt], dtype=np.double),
+            np.array([d['id'] for d in dt], dtype=np.double))
+
+        dtIds = [d['id'] for d in dt]
+        dtScores = [d['score'] for d in dt]
+        evalImgs = []
+        for a, aRng in enumerate(aRngs):
+            u = inv[a]
+            # set unmatched detections outside of area range to ignore
+            dtIgA = np.logical_or(dtIg[u], np.logical_and(dtm[u]==0, dtOut[a]))
+            evalImgs.append({
+                'image_id':     imgId,
+                'category_id':  catId,
+                'aRng':         aRng,
+                'maxDet':       maxDet,
+                'dtIds':        list(dtIds),
+                'gtIds':        [gt[i]['id'] for i in gtOrder[a]],
+                'dtMatches':    dtm[u].copy(),
+                'gtMatches':    gtm[u].copy(),
+                'dtScores':     list(dtScores),
+                'gtIgnore':     np.array(gtIg[a, gtOrder[a]].tolist()),
+                'dtIgnore':     dtIgA,
+            })
+        return evalImgs
+
     def accumulate(self, p = None):
         '''
         Accumulate per image evaluation results and store the result in self.eval
@@ -350,65 +733,51 @@ class COCOeval:
         i_list = [n for n, i in enumerate(p.imgIds)  if i in setI]
         I0 = len(_pe.imgIds)
         A0 = len(_pe.areaRng)
-        # retrieve E at each category, area range, and max number of detections
+        compact = isinstance(self.evalImgs, EvalImgsView)
+        sparse = isinstance(self.evalImgs, dict)
+        if compact:
+            # columnar layout: slice the store for the images of p.imgIds
+            store = self.evalImgs.store
+            imgPos = {imgId: i for i, imgId in enumerate(_pe.imgIds)}
+            catPos = {catId: k for k, catId in enumerate(catIds)}
+            areaPos = {tuple(aRng): a for a, aRng in enumerate(_pe.areaRng)}
+            imgSel = np.zeros((I0,), dtype=bool)
+            imgSel[[imgPos[p.imgIds[i]] for i in i_list]] = True
+        elif sparse:
+            # sparse layout: group the evaluated pairs by category, in image order
+            imgPos = {p.imgIds[i]: i for i in i_list}
+            areaPos = {tuple(aRng): a for a, aRng in enumerate(_pe.areaRng)}
+            catImgs = defaultdict(list)
+            for imgId, catId in self.evalImgs:
+                if imgId in imgPos:
+                    catImgs[catId].append((imgPos[imgId], imgId))
+            for imgs in catImgs.values():
+                imgs.sort()
+        # retrieve E at each category and area range, all max number of detections are handled at once
         for k, k0 in enumerate(k_list):
             Nk = k0*A0*I0
             for a, a0 in enumerate(a_list):
                 Na = a0*I0
-                for m, maxDet in enumerate(m_list):
-                    E = [self.evalImgs[Nk + Na + i] for i in i_list]
-                    E = [e for e in E if not e is None]
-                    if len(E) == 0:
-                        continue
-                    dtScores = np.concatenate([e['dtScores'][0:maxDet] for e in E])
-
-                    # different sorting method generates slightly different results.
-                    # mergesort is used to be consistent as Matlab implementation.
-                    inds = np.argsort(-dtScores, kind='mergesort')
-                    dtScoresSorted = dtScores[inds]
-
-                    dtm  = np.concatenate([e['dtMatches'][:,0:maxDet] for e in E], axis=1)[:,inds]
-                    dtIg = np.concatenate([e['dtIgnore'][:,0:maxDet]  for e in E], axis=1)[:,inds]
-                    gtIg = np.concatenate([e['gtIgnore'] for e in E])
-                    npig = np.count_nonzero(gtIg==0 )
-                    if npig == 0:
+                if compact:
+                    res = store.gather(catPos[p.catIds[k0]], areaPos[tuple(p.areaRng[a0])], imgSel)
+                    if res is None:
                         continue
-                    tps = np.logical_and(               dtm,  np.logical_not(dtIg) )
-                    fps = np.logical_and(np.logical_not(dtm), np.logical_not(dtIg) )
-
-                    tp_sum = np.cumsum(tps, axis=1).astype(dtype=np.float)
-                    fp_sum = np.cumsum(fps, axis=1).astype(dtype=np.float)
-                    for t, (tp, fp) in enumerate(zip(tp_sum, fp_sum)):
-                        tp = np.array(tp)
-                        fp = np.array(fp)
-                        nd = len(tp)
-                        rc = tp / npig
-                        pr = tp / (fp+tp+np.spacing(1))
-                        q  = np.zeros((R,))
-                        ss = np.zeros((R,))
-
-                        if nd:
-                            recall[t,k,a,m] = rc[-1]
-                        else:
-                            recall[t,k,a,m] = 0
-
-                        # numpy is slow without cython optimization for accessing elements
-                        # use python array gets significant speed improvement
-                        pr = pr.tolist(); q = q.tolist()
-
-                        for i in range(nd-1, 0, -1):
-                            if pr[i] > pr[i-1]:
-                                pr[i-1] = pr[i]
-
-                        inds = np.searchsorted(rc, p.recThrs, side='left')
-                        try:
-                            for ri, pi in enumerate(inds):
-                                q[ri] = pr[pi]
-                                ss[ri] = dtScoresSorted[pi]
-                        except:
-                            pass
-                        precision[t,:,k,a,m] = np.array(q)
-                        scores[t,:,k,a,m] = np.array(ss)
+                    res = _accumulateMatches(*res, maxDets=m_list, recThrs=p.recThrs)
+                    if res is not None:
+                        precision[:,:,k,a,:len(m_list)], recall[:,k,a,:len(m_list)], scores[:,:,k,a,:len(m_list)] = res
+                    continue
+                if sparse:
+                    catId, a1 = p.catIds[k0], areaPos[tuple(p.areaRng[a0])]
+                    E = [self.evalImgs[imgId, catId][a1] for _, imgId in catImgs[catId]]
+                else:
+                    E = [self.evalImgs[Nk + Na + i] for i in i_list]
+                E = [e for e in E if not e is None]
+                if len(E) == 0:
+                    continue
+                res = _accumulateMatches(*_concatEvalImgs(E), maxDets=m_list, recThrs=p.recThrs)
+                if res is None:
+                    continue
+                precision[:,:,k,a,:len(m_list)], recall[:,k,a,:len(m_list)], scores[:,:,k,a,:len(m_list)] = res
         self.eval = {
             'params': p,
             'counts': [T, R, K, A, M],
@@ -496,6 +865,361 @@ class COCOeval:
     def __str__(self):
         self.summarize()
 
+class COCOevalOnline(COCOeval):
+    # Online variant of COCOeval that evaluates detections batch by batch.
+    #
+    # The usage for COCOevalOnline is as follows:
+    #  E = COCOevalOnline(cocoGt, 'bbox')  # initialize with the ground truth only
+    #  E.params.catIds = ...;              # set parameters before the first update
+    #  for imgIds, dets in batches:
+    #      E.update(imgIds, dets);         # evaluate a batch of images
+    #  E.accumulate();                     # accumulate the images seen so far
+    #  E.summarize();                      # display summary metrics of results
+    # Detections are given in the results file format (see COCO.loadRes) and
+    # all detections of an image must come in the same update. Only the compact
+    # per image match results are kept (see EvalImgsStore), so accumulate() and
+    # summarize() can run at any point and give the same numbers as COCOeval
+    # run on the images seen so far.
+    def __init__(self, cocoGt=None, iouType='segm'):
+        '''
+        Initialize COCOevalOnline using the coco API for gt
+        :param cocoGt: coco object with ground truth annotations
+        :param iouType: 'segm', 'bbox' or 'keypoints'
+        :return: None
+        '''
+        COCOeval.__init__(self, cocoGt, None, iouType)
+        self.cocoDt = cocoGt                # dts are resolved against the gt images
+        self._store = None                  # compact per image results
+        self._seen = set()                  # ids of the images evaluated so far
+        self._numDts = 0                    # number of dts seen so far (for dt ids)
+
+    def evaluate(self, *args, **kwargs):
+        raise Exception('COCOevalOnline evaluates images with update()')
+
+    def _start(self):
+        # freeze the params on the first update
+        p = self.params
+        if not p.useSegm is None:
+            p.iouType = 'segm' if p.useSegm == 1 else 'bbox'
+        p.imgIds = list(np.unique(p.imgIds))
+        if p.useCats:
+            p.catIds = list(np.unique(p.catIds))
+        p.maxDets = sorted(p.maxDets)
+        catIds = p.catIds if p.useCats else [-1]
+        self._store = EvalImgsStore(len(catIds), len(p.areaRng), len(p.iouThrs))
+        self._sigmas = {catId: self._catSigmas(catId) for catId in p.catIds} if p.iouType == 'keypoints' else {}
+        self._imgSet = set(p.imgIds)
+        self._paramsEval = copy.deepcopy(p)
+        self.evalImgs = EvalImgsView(self._store, self._paramsEval)
+
+    def update(self, imgIds, dets):
+        '''
+        Evaluate a batch of images and keep their compact per image results
+        :param imgIds: ids of the images in the batch (including images without dts)
+        :param dets: list of dts of these images in the results file format
+        :return: None
+        '''
+        if self._store is None:
+            self._start()
+        p = self.params
+        imgIds = list(imgIds)
+        setI = set(imgIds)
+        if len(setI) < len(imgIds) or len(setI & self._seen) > 0:
+            raise Exception('images can only be evaluated once')
+        if not setI <= self._imgSet:
+            raise Exception('images are not part of the evaluated ground truth')
+        # shallow copies so the caller's dicts are not modified
+        dets = [dict(dt) for dt in dets if not p.useCats or dt['category_id'] in p.catIds]
+        if not all(dt['image_id'] in setI for dt in dets):
+            raise Exception('detections do not correspond to the images of the batch')
+        self.cocoGt.prepareRes(dets, self._numDts+1)
+        self._numDts += len(dets)
+
+        if p.useCats:
+            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=imgIds, catIds=p.catIds))
+        else:
+            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=imgIds))
+        self._gts, self._dts = self._groupAnns(gts, dets, self.cocoGt)
+        _, store = self._evaluateImgs(imgIds, 'compact')
+        self._store.merge(store)
+        self._seen |= setI
+        # only the compact results are kept
+        self._gts, self._dts, self.ious, self._rles = defaultdict(list), defaultdict(list), {}, {}
+
+    def accumulate(self, p = None):
+        '''
+        Accumulate the results of the images evaluated so far and store the result in self.eval
+        :param p: input params for evaluation (default: params restricted to the images seen so far)
+        :return: None
+        '''
+        if self._store is None:
+            raise Exception('Please run update() first')
+        if p is None:
+            p = copy.deepcopy(self.params)
+            p.imgIds = [imgId for imgId in self._paramsEval.imgIds if imgId in self._seen]
+        COCOeval.accumulate(self, p)
+
+class EvalImgsStore:
+    '''
+    Columnar storage of the per image evaluation results (see COCOeval.evaluateImg).
+    For every category k and area range a the results of all evaluated images are
+    concatenated into flat arrays, with offset tables giving the range of each image:
+     imgIdx     - [N] position of each image in params.imgIds (sorted)
+     dtOff      - [N+1] offsets of the dts of each image into the dt arrays
+     gtOff      - [N+1] offsets of the gts of each image into the gt arrays
+     dtIds, dtScores, gtIds, gtIgnore                      - [D] / [G] flat arrays
+     dtMatches, dtIgnore [TxD] and gtMatches [TxG]         - flat matrices
+    Results are added image by image and packed into chunks of packSize images as
+    they come in, the chunks are merged on first access.
+    '''
+    _fields = ('dtIds', 'dtScores', 'dtMatches', 'dtIgnore', 'gtIds', 'gtIgnore', 'gtMatches')
+    packSize = 64                           # number of results of a (k, a) packed at once
+
+    def __init__(self, K, A, T):
+        self.K, self.A, self.T = K, A, T
+        self._data = {}                     # packed arrays for each (k, a)
+        self._pending = defaultdict(list)   # results not packed yet
+        self._chunks = defaultdict(list)    # packed chunks not merged into _data yet
+
+    def add(self, k, a, i, e):
+        '''
+        Add the result of one image
+        :param k, a: position of the category and area range
+        :param i: position of the image in params.imgIds
+        :param e: result dict as returned by evaluateImg (None is skipped)
+        '''
+        if e is not None:
+            pending = self._pending[k, a]
+            pending.append((i, e))
+            if len(pending) >= self.packSize:
+                self._chunks[k, a].append(self._pack(self._pending.pop((k, a))))
+
+    def flush(self):
+        '''
+        Pack all pending results (e.g. before the store is pickled)
+        '''
+        for key in list(self._pending):
+            self._chunks[key].append(self._pack(self._pending.pop(key)))
+
+    def merge(self, other):
+        '''
+        Add all results of another store with the same dimensions
+        '''
+        for key in set(other._data) | set(other._pending) | set(other._chunks):
+            self._chunks[key].append(other._get(*key))
+
+    def _pack(self, entries):
+        # pack a list of (i, e) or of packed chunks into one chunk sorted by image
+        chunks = [entry for entry in entries if isinstance(entry, dict)]
+        results = [entry for entry in entries if not isinstance(entry, dict)]
+        T = self.T
+        if len(results) > 0:
+            E = [e for _, e in results]
+            chunks.append({
+                'imgIdx':    np.array([i for i, _ in results], dtype=np.int64),
+                'nDt':       np.array([len(e['dtIds']) for e in E], dtype=np.int64),
+                'nGt':       np.array([len(e['gtIds']) for e in E], dtype=np.int64),
+                'dtIds':     np.concatenate([np.array(e['dtIds'], dtype=np.int64) for e in E]),
+                'dtScores':  np.concatenate([np.array(e['dtScores'], dtype=np.double) for e in E]),
+                'dtMatches': np.concatenate([e['dtMatches'].reshape((T, -1)) for e in E], axis=1),
+                'dtIgnore':  np.concatenate([e['dtIgnore'].reshape((T, -1)) for e in E], axis=1).astype(bool),
+                'gtIds':     np.concatenate([np.array(e['gtIds'], dtype=np.int64) for e in E]),
+                'gtIgnore':  np.concatenate([np.array(e['gtIgnore'], dtype=np.int64) for e in E]),
+                'gtMatches': np.concatenate([e['gtMatches'].reshape((T, -1)) for e in E], axis=1),
+            })
+        data = {key: np.concatenate([c[key] for c in chunks], axis=-1)
+                for key in ('imgIdx', 'nDt', 'nGt') + self._fields}
+        # keep the images sorted so slices follow the image order of params.imgIds
+        order = np.argsort(data['imgIdx'], kind='mergesort')
+        if np.any(order != np.arange(len(order))):
+            dtInds = _segmentInds(data['nDt'], order)
+            gtInds = _segmentInds(data['nGt'], order)
+            for key in ('imgIdx', 'nDt', 'nGt'):
+                data[key] = data[key][order]
+            for key in self._fields:
+                data[key] = data[key][..., dtInds if key.startswith('dt') else gtInds]
+        return data
+
+    def _get(self, k, a):
+        # packed arrays of (k, a), merging pending results and chunks first
+        entries = self._pending.pop((k, a), []) + self._chunks.pop((k, a), [])
+        if len(entries) > 0:
+            if (k, a) in self._data:
+                entries.append(self._data[k, a])
+            self._data[k, a] = self._pack(entries)
+        return self._data.get((k, a))
+
+    def get(self, k, a, i):
+        '''
+        Get the result of one image as a dict of arrays
+        :param k, a: position of the category and area range
+        :param i: position of the image in params.imgIds
+        :return: dict with the fields of evaluateImg (without ids and ranges) or None
+        '''
+        data = self._get(k, a)
+        if data is None:
+            return None
+        n = np.searchsorted(data['imgIdx'], i)
+        if n == len(data['imgIdx']) or data['imgIdx'][n] != i:
+            return None
+        d0 = data['nDt'][:n].sum(); d1 = d0 + data['nDt'][n]
+        g0 = data['nGt'][:n].sum(); g1 = g0 + data['nGt'][n]
+        return {key: data[key][..., d0:d1] if key.startswith('dt') else data[key][..., g0:g1]
+                for key in self._fields}
+
+    def gather(self, k, a, imgSel=None):
+        '''
+        Concatenate the results of the selected images (in image order) for accumulate()
+        :param k, a: position of the category and area range
+        :param imgSel: [I] boolean mask of the images to use (default: all)
+        :return: dtScores, dtRank, dtMatches, dtIgnore, gtIgnore (see _concatEvalImgs) or None
+        '''
+        data = self._get(k, a)
+        if data is None:
+            return None
+        nDt, nGt = data['nDt'], data['nGt']
+        dtScores, dtm, dtIg, gtIg = data['dtScores'], data['dtMatches'], data['dtIgnore'], data['gtIgnore']
+        if imgSel is not None:
+            keep = imgSel[data['imgIdx']]
+            if not keep.any():
+                return None
+            if not keep.all():
+                sel = np.nonzero(keep)[0]
+                dtInds = _segmentInds(nDt, sel)
+                gtInds = _segmentInds(nGt, sel)
+                nDt = nDt[sel]
+                dtScores, dtm, dtIg, gtIg = dtScores[dtInds], dtm[:,dtInds], dtIg[:,dtInds], gtIg[gtInds]
+        dtRank = np.arange(len(dtScores)) - np.repeat(np.cumsum(nDt) - nDt, nDt)
+        return dtScores, dtRank, dtm, dtIg, gtIg
+
+class EvalImgsView:
+    '''
+    Read-only, list-like view of an EvalImgsStore in the [KxAxI] layout of
+    COCOeval.evalImgs. The per image result dicts are built on access, so code
+    reading evalImgs[i]['dtMatches'] keeps working.
+    '''
+    def __init__(self, store, params):
+        self.store = store
+        self.params = params
+
+    def __len__(self):
+        return self.store.K * self.store.A * len(self.params.imgIds)
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return [self[i] for i in range(*ind.indices(len(self)))]
+        if ind < 0:
+            ind += len(self)
+        if ind < 0 or ind >= len(self):
+            raise IndexError('evalImgs index out of range')
+        p = self.params
+        I = len(p.imgIds)
+        k, ind = divmod(ind, self.store.A*I)
+        a, i = divmod(ind, I)
+        e = self.store.get(k, a, i)
+        if e is None:
+            return None
+        return {
+                'image_id':     p.imgIds[i],
+                'category_id':  p.catIds[k] if p.useCats else -1,
+                'aRng':         p.areaRng[a],
+                'maxDet':       p.maxDets[-1],
+                'dtIds':        e['dtIds'].tolist(),
+                'gtIds':        e['gtIds'].tolist(),
+                'dtMatches':    e['dtMatches'],
+                'gtMatches':    e['gtMatches'],
+                'dtScores':     e['dtScores'].tolist(),
+                'gtIgnore':     e['gtIgnore'],
+                'dtIgnore':     e['dtIgnore'],
+            }
+
+    def __iter__(self):
+        for ind in range(len(self)):
+            yield self[ind]
+
+def _segmentInds(counts, sel):
+    '''
+    Flat indices of the selected segments of a concatenation of segments
+    :param counts: [N] length of each segment
+    :param sel: [S] selected segments (in output order)
+    :return: indices into the concatenated array
+    '''
+    starts = np.cumsum(counts) - counts
+    lens = counts[sel]
+    return np.repeat(starts[sel] - (np.cumsum(lens) - lens), lens) + np.arange(lens.sum())
+
+def _concatEvalImgs(E):
+    '''
+    Concatenate the per image results of one category and area range
+    :param E: list of per image results (see COCOeval.evaluateImg)
+    :return: tuple of dtScores [D], dtRank [D] (position of each dt within its image),
+             dtMatches [TxD], dtIgnore [TxD] and gtIgnore [G]
+    '''
+    dtScores = np.concatenate([e['dtScores'] for e in E])
+    dtRank   = np.concatenate([np.arange(len(e['dtScores'])) for e in E])
+    dtm      = np.concatenate([e['dtMatches'] for e in E], axis=1)
+    dtIg     = np.concatenate([e['dtIgnore']  for e in E], axis=1)
+    gtIg     = np.concatenate([e['gtIgnore']  for e in E])
+    return dtScores, dtRank, dtm, dtIg, gtIg
+
+def _accumulateMatches(dtScores, dtRank, dtm, dtIg, gtIg, maxDets, recThrs):
+    '''
+    Compute precision, recall and scores of one category and area range for all
+    IoU thresholds and max number of detections at once
+    :param dtScores, dtRank, dtm, dtIg, gtIg: concatenated per image results (see _concatEvalImgs)
+    :param maxDets: [M] thresholds on max detections per image
+    :param recThrs: [R] recall thresholds
+    :return: precision [TxRxM], recall [TxM] and scores [TxRxM], or None if there is no gt to evaluate
+    '''
+    npig = np.count_nonzero(gtIg==0 )
+    if npig == 0:
+        return None
+    T, R, M = dtm.shape[0], len(recThrs), len(maxDets)
+    precision = np.zeros((T,R,M))
+    recall    = np.zeros((T,M))
+    scores    = np.zeros((T,R,M))
+    # different sorting method generates slightly different results.
+    # mergesort is used to be consistent as Matlab implementation.
+    # since it is stable, restricting the sorted order to the top maxDet dts of each
+    # image gives the same order as sorting those dts alone.
+    order = np.argsort(-dtScores, kind='mergesort')
+    for m, maxDet in enumerate(maxDets):
+        inds = order[dtRank[order] < maxDet]
+        dtScoresSorted = dtScores[inds]
+        dtmSorted  = dtm[:,inds]
+        dtIgSorted = dtIg[:,inds]
+        tps = np.logical_and(               dtmSorted,  np.logical_not(dtIgSorted) )
+        fps = np.logical_and(np.logical_not(dtmSorted), np.logical_not(dtIgSorted) )
+
+        tp_sum = np.cumsum(tps, axis=1).astype(dtype=float)
+        fp_sum = np.cumsum(fps, axis=1).astype(dtype=float)
+        nd = tp_sum.shape[1]
+        rc = tp_sum / npig
+        pr = tp_sum / (fp_sum+tp_sum+np.spacing(1))
+        if nd:
+            recall[:,m] = rc[:,-1]
+        # make precision monotonically decreasing (reversed running maximum)
+        pr = np.maximum.accumulate(pr[:,::-1], axis=1)[:,::-1]
+        for t in range(T):
+            ri = np.searchsorted(rc[t], recThrs, side='left')
+            # recall thresholds beyond the max recall keep a precision of 0
+            valid = np.logical_and.accumulate(ri < nd)
+            precision[t,valid,m] = pr[t,ri[valid]]
+            scores[t,valid,m] = dtScoresSorted[ri[valid]]
+    return precision, recall, scores
+
+def _evaluateShard(job):
+    '''
+    Evaluate one shard of images in a worker process (see COCOeval._evaluateParallel)
+    :param job: tuple of (COCOeval, imgIds, layout)
+    :return: ious (dict) and evalImgs (see COCOeval._evaluateImgs)
+    '''
+    E, imgIds, layout = job
+    return E._evaluateImgs(imgIds, layout)
+
+# OKS sigmas of the 17 keypoints of the COCO person category
+COCO_PERSON_SIGMAS = np.array([.26, .25, .25, .35, .35, .79, .79, .72, .72, .62,.62, 1.07, 1.07, .87, .87, .89, .89])/10.0
+
 class Params:
     '''
     Params for coco evaluation api
@@ -504,8 +1228,8 @@ class Params:
         self.imgIds = []
         self.catIds = []
         # np.arange causes trouble.  the data point on arange is slightly larger than the true value
-        self.iouThrs = np.linspace(.5, 0.95, np.round((0.95 - .5) / .05) + 1, endpoint=True)
-        self.recThrs = np.linspace(.0, 1.00, np.round((1.00 - .0) / .01) + 1, endpoint=True)
+        self.iouThrs = np.linspace(.5, 0.95, int(np.round((0.95 - .5) / .05)) + 1, endpoint=True)
+        self.recThrs = np.linspace(.0, 1.00, int(np.round((1.00 - .0) / .01)) + 1, endpoint=True)
         self.maxDets = [1, 10, 100]
         self.areaRng = [[0 ** 2, 1e5 ** 2], [0 ** 2, 32 ** 2], [32 ** 2, 96 ** 2], [96 ** 2, 1e5 ** 2]]
         self.areaRngLbl = ['all', 'small', 'medium', 'large']
@@ -515,12 +1239,15 @@ class Params:
         self.imgIds = []
         self.catIds = []
         # np.arange causes trouble.  the data point on arange is slightly larger than the true value
-        self.iouThrs = np.linspace(.5, 0.95, np.round((0.95 - .5) / .05) + 1, endpoint=True)
-        self.recThrs = np.linspace(.0, 1.00, np.round((1.00 - .0) / .01) + 1, endpoint=True)
+        self.iouThrs = np.linspace(.5, 0.95, int(np.round((0.95 - .5) / .05)) + 1, endpoint=True)
+        self.recThrs = np.linspace(.0, 1.00, int(np.round((1.00 - .0) / .01)) + 1, endpoint=True)
         self.maxDets = [20]
         self.areaRng = [[0 ** 2, 1e5 ** 2], [32 ** 2, 96 ** 2], [96 ** 2, 1e5 ** 2]]
         self.areaRngLbl = ['all', 'medium', 'large']
         self.useCats = 1
+        # per keypoint OKS sigmas, an array or a dict keyed by catId; None uses the
+        # 'sigmas' field of the category entry, else COCO_PERSON_SIGMAS
+        self.kpt_oks_sigmas = None
 
     def __init__(self, iouType='segm'):
         if iouType == 'segm' or iouType == 'bbox':
@@ -3,7 +3,11 @@ __author__ = 'hcaesar'
 import numpy as np
 import datetime
 import time
-from cocostuffhelper import cocoSegmentationToSegmentationMap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from . import mask as maskUtils
+from .ioutils import save_checkpoint, load_checkpoint, annotations_fingerprint, files_fingerprint
 
 class COCOStuffeval:
     # Internal functions for evaluating stuff segmentations against a ground-truth.
@@ -13,7 +17,12 @@ class COCOStuffeval:
     #  E = COCOStuffeval(cocoGt, cocoRes) # initialize COCOStuffeval object
     #  E.params.imgIds = ...              # set parameters as desired
     #  E.evaluate()                       # run per image evaluation
+    #  E.evaluate(workers=8)              # or shard the images across 8 processes
     #  E.summarize()                      # display summary metrics of results
+    # Instead of cocoRes, the results can also be read directly from a folder of
+    # indexed .png (or .npy) label maps named after the images (as written by
+    # cocoSegmentationToPngDemo.py), which skips the conversion to COCO format:
+    #  E = COCOStuffeval(cocoGt, resDir=...)
     # For example usage see pycocostuffEvalDemo.py.
     #
     # Note: Our evaluation has to take place on all classes. If we remove one class
@@ -28,11 +37,17 @@ class COCOStuffeval:
     #  params     - parameters used for evaluation
     #  date       - date evaluation was performed
     #  confusion  - confusion matrix used for the final metrics
+    # evaluate(checkpoint=path) saves the confusion matrix and the ids of the
+    # images evaluated so far to path every checkpointInterval seconds; an
+    # evaluation restarted with the same path and imgIds skips those images.
+    # The file is removed once evaluate is done.
     #
     # summarize(): computes and prints the evaluation metrics.
     # results are printed to stdout and stored in:
     #  stats      - a numpy array of the evaluation metrics (mean IOU etc.)
     #  statsClass - a dict that stores per-class results in ious and maccs
+    # summarizeGroups(groupOf) computes the same metrics for any other mapping
+    # of the leaf categories to groups.
     #
     # See also coco, mask, pycocostuffDemo, pycocostuffEvalDemo
     #
@@ -41,7 +56,7 @@ class COCOStuffeval:
     # Code written by Piotr Dollar and Tsung-Yi Lin, 2015.
     # Licensed under the Simplified BSD License [see coco/license.txt]
 
-    def __init__(self, cocoGt, cocoRes, stuffStartId=92, stuffEndId=182, addOther=True):
+    def __init__(self, cocoGt, cocoRes=None, stuffStartId=92, stuffEndId=182, addOther=True, resDir=None):
         '''
         Initialize COCOStuffeval using COCO APIs for gt and dt
         :param cocoGt: COCO object with ground truth annotations
@@ -49,10 +64,14 @@ class COCOStuffeval:
         :param stuffStartId: id of the first stuff class
         :param stuffEndId: id of the last stuff class
         :param addOther: whether to use a other class
+        :param resDir: folder with a .png or .npy label map per image that is used instead of cocoRes
         :return: None
         '''
+        if (cocoRes is None) == (resDir is None):
+            raise Exception('Error: Please specify either cocoRes or resDir!')
         self.cocoGt   = cocoGt              # Ground truth COCO API
         self.cocoRes   = cocoRes            # Result COCO API
+        self.resDir = resDir                # Folder with result label maps
         self.stuffStartId = stuffStartId    # Id of the first stuff class
         self.stuffEndId = stuffEndId        # Id of the last stuff class
         self.addOther = addOther            # Whether to add a class that subsumes all thing classes
@@ -66,10 +85,14 @@ class COCOStuffeval:
         self.catIds = range(stuffStartId, stuffEndId+addOther+1) # Take into account all stuff
                                                                  # classes and one 'other' class
 
-    def evaluate(self):
+    def evaluate(self, workers=None, checkpoint=None, checkpointInterval=60):
         '''
         Run per image evaluation on given images and store results in self.confusion.
-        Note that this can take up to several hours.
+        :param workers: number of worker processes the images are sharded across (default: serial),
+                        or with resDir the number of threads that read the label maps (default: all cores)
+        :param checkpoint: path of a file the confusion matrix of the evaluated images is saved to,
+                           and resumed from if it exists
+        :param checkpointInterval: minimum number of seconds between two checkpoint saves
         :return: None
         '''
 
@@ -80,8 +103,12 @@ class COCOStuffeval:
             % (len(imgIds), len(self.catIds)))
 
         # Check that all images in params occur in GT and results
-        gtImgIds = sorted(set(self.cocoGt.getImgIds()))
-        resImgIds = sorted(set([a['image_id'] for a in self.cocoRes.anns.values()]))
+        gtImgIds = set(self.cocoGt.getImgIds())
+        if self.resDir is not None:
+            resPaths = _getLabelMapPaths(self.resDir)
+            resImgIds = set(resPaths)
+        else:
+            resImgIds = set([imgId for imgId, anns in self.cocoRes.imgToAnns.items() if len(anns) > 0])
         missingInGt = [p for p in imgIds if p not in gtImgIds]
         missingInRes = [p for p in imgIds if p not in resImgIds]
         if len(missingInGt) > 0:
@@ -92,10 +119,63 @@ class COCOStuffeval:
         # Create confusion matrix
         labelCount = max([c for c in self.cocoGt.cats])
         confusion = np.zeros((labelCount, labelCount))
-        for i, imgId in enumerate(imgIds):
-            if i+1 == 1 or i+1 == len(imgIds) or (i+1) % 10 == 0:
-                print('Evaluating image %d of %d: %d' % (i+1, len(imgIds), imgId))
-            confusion = self._accumulateConfusion(self.cocoGt, self.cocoRes, confusion, imgId)
+
+        # Resume from the checkpoint
+        doneImgIds = []
+        checkpointKey = None
+        if checkpoint is not None:
+            # Identify the gt and results by their content (or by the files in resDir)
+            imgIdSet = set(imgIds)
+            gtAnns = [a for a in self.cocoGt.dataset['annotations'] if a['image_id'] in imgIdSet]
+            if self.resDir is not None:
+                resFingerprint = files_fingerprint([resPaths[imgId] for imgId in imgIds])
+            else:
+                resFingerprint = annotations_fingerprint(
+                    [a for a in self.cocoRes.dataset['annotations'] if a['image_id'] in imgIdSet])
+            checkpointKey = (tuple(imgIds), labelCount, tuple(self.catIds),
+                             annotations_fingerprint(gtAnns), resFingerprint)
+            state = load_checkpoint(checkpoint)
+            if state is not None:
+                if state['key'] != checkpointKey:
+                    raise Exception('Error: The checkpoint %s was saved by a different evaluation, '
+                                    'remove it to start over!' % checkpoint)
+                confusion, doneImgIds = state['confusion'], state['imgIds']
+                print('Resuming %d of %d images from %s' % (len(doneImgIds), len(imgIds), checkpoint))
+        done = set(doneImgIds)
+        todoImgIds = [imgId for imgId in imgIds if imgId not in done]
+
+        def saveCheckpoint():
+            save_checkpoint(checkpoint, {'key': checkpointKey, 'imgIds': doneImgIds, 'confusion': confusion})
+
+        lastSave = time.time()
+        try:
+            if self.resDir is not None or (workers is not None and workers > 1):
+                if self.resDir is not None:
+                    shards = self._evaluateLabelMaps(todoImgIds, resPaths, labelCount, workers)
+                else:
+                    shards = self._evaluateParallel(todoImgIds, labelCount, workers)
+                for shardImgIds, shardConfusion in shards:
+                    confusion += shardConfusion
+                    doneImgIds.extend(shardImgIds)
+                    if checkpoint is not None and time.time() - lastSave >= checkpointInterval:
+                        saveCheckpoint()
+                        lastSave = time.time()
+            else:
+                for i, imgId in enumerate(todoImgIds):
+                    if i+1 == 1 or i+1 == len(todoImgIds) or (i+1) % 10 == 0:
+                        print('Evaluating image %d of %d: %d' % (i+1, len(todoImgIds), imgId))
+                    confusion = self._accumulateConfusion(self.cocoGt, self.cocoRes, confusion, imgId)
+                    doneImgIds.append(imgId)
+                    if checkpoint is not None and time.time() - lastSave >= checkpointInterval:
+                        saveCheckpoint()
+                        lastSave = time.time()
+        except BaseException:
+            # Keep what is done (e.g. on KeyboardInterrupt) for the next run
+            if checkpoint is not None and len(doneImgIds) > 0:
+                saveCheckpoint()
+            raise
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
         self.confusion = confusion
 
         # Set eval struct to be used later
@@ -108,9 +188,112 @@ class COCOStuffeval:
         toc = time.time()
         print('DONE (t={:0.2f}s).'.format(toc-tic))
 
+    def _evaluateParallel(self, imgIds, labelCount, workers):
+        '''
+        Shard the images across a process pool and yield the confusion matrices of the shards.
+        The workers only receive the RLEs and labels of their images, not the COCO apis.
+        :param imgIds: ids of the images to evaluate
+        :param labelCount: size of the confusion matrix
+        :param workers: number of worker processes
+        :return: generator of (shardImgIds, confusion) with the int64 confusion matrix of each shard
+        '''
+        # contiguous shards, a few per worker for load balancing
+        nShards = min(len(imgIds), 4*workers)
+        bounds = np.linspace(0, len(imgIds), nShards+1).astype(int)
+        shards = [imgIds[b0:b1] for b0, b1 in zip(bounds[:-1], bounds[1:])]
+
+        # the annotations of a shard are only gathered when it is submitted, and at most
+        # two shards per worker are in flight, so the workers start right away
+        def job(shard):
+            return ([self._getImageAnns(self.cocoGt, self.cocoRes, imgId) for imgId in shard],
+                    list(self.catIds), labelCount)
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            try:
+                for s in range(len(shards)):
+                    while len(pending) < 2*workers and s + len(pending) < len(shards):
+                        pending.append(executor.submit(_evaluateShard, job(shards[s + len(pending)])))
+                    shardConfusion = pending.popleft().result()
+                    print('Evaluated shard %d of %d' % (s+1, len(shards)))
+                    yield shards[s], shardConfusion
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _evaluateLabelMaps(self, imgIds, resPaths, labelCount, workers=None):
+        '''
+        Read the result label maps in a thread pool and yield the confusion matrices of the images.
+        At most a few images per thread are in flight, so the label maps are streamed from disk.
+        :param imgIds: ids of the images to evaluate
+        :param resPaths: dict that maps image ids to the paths of their label maps
+        :param labelCount: size of the confusion matrix
+        :param workers: number of threads (default: number of cores)
+        :return: generator of ([imgId], confusion) with the int64 confusion matrix of each image
+        '''
+        def imageConfusion(imgId):
+            imageAnns = self._getLabelMapAnns(self.cocoGt, imgId, resPaths[imgId])
+            return _imageConfusion(imageAnns, self.catIds, labelCount)
+
+        threads = workers if workers is not None and workers > 0 else (os.cpu_count() or 1)
+        pending = deque()
+        imgIdIter = iter(imgIds)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            try:
+                for i in range(len(imgIds)):
+                    while len(pending) < 4*threads:
+                        imgId = next(imgIdIter, None)
+                        if imgId is None:
+                            break
+                        pending.append((imgId, executor.submit(imageConfusion, imgId)))
+                    imgId, future = pending.popleft()
+                    if i+1 == 1 or i+1 == len(imgIds) or (i+1) % 10 == 0:
+                        print('Evaluating image %d of %d: %d' % (i+1, len(imgIds), imgId))
+                    yield [imgId], future.result()
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def _getLabelMapAnns(self, cocoGt, imgId, resPath):
+        '''
+        Gather the (non-crowd) GT annotations of an image and encode its result label map.
+        Like pngToCocoResult, labels below stuffStartId are treated as unlabeled.
+        :param cocoGt: COCO object with ground truth annotations
+        :param imgId: id of the current image
+        :param resPath: path of the .png or .npy label map of the image
+        :return: tuple of (imgId, h, w, rlesGt, labelsGt, rlesRes, labelsRes) with RLE dicts
+        '''
+        img = cocoGt.imgs[imgId]
+        annsGt = cocoGt.loadAnns(cocoGt.getAnnIds(imgIds=imgId, iscrowd=False))
+        labelMap = _loadLabelMap(resPath)
+        if labelMap.shape != (img['height'], img['width']):
+            raise Exception('Error: The label map of image %d has size %s instead of %s!'
+                            % (imgId, labelMap.shape, (img['height'], img['width'])))
+        labelRs = maskUtils.encodeLabelMap(labelMap)
+        labelsRes = [l for l in labelRs if l >= self.stuffStartId]
+        return (imgId, img['height'], img['width'],
+                [cocoGt.annToRLE(a) for a in annsGt], [a['category_id'] for a in annsGt],
+                [labelRs[l] for l in labelsRes], labelsRes)
+
+    def _getImageAnns(self, cocoGt, cocoRes, imgId):
+        '''
+        Gather the (non-crowd) annotations of an image in GT and result.
+        :param cocoGt: COCO object with ground truth annotations
+        :param cocoRes: COCO object with detection results
+        :param imgId: id of the current image
+        :return: tuple of (imgId, h, w, rlesGt, labelsGt, rlesRes, labelsRes) with RLE dicts
+        '''
+        img = cocoGt.imgs[imgId]
+        annsGt  = cocoGt.loadAnns(cocoGt.getAnnIds(imgIds=imgId, iscrowd=False))
+        annsRes = cocoRes.loadAnns(cocoRes.getAnnIds(imgIds=imgId, iscrowd=False))
+        return (imgId, img['height'], img['width'],
+                [cocoGt.annToRLE(a) for a in annsGt], [a['category_id'] for a in annsGt],
+                [cocoRes.annToRLE(a) for a in annsRes], [a['category_id'] for a in annsRes])
+
     def _accumulateConfusion(self, cocoGt, cocoRes, confusion, imgId):
         '''
         Accumulate the pixels of the current image in the specified confusion matrix.
+        The GT and result annotations are intersected run by run on their RLEs,
+        which gives the same counts as comparing the decoded label maps.
         Note: For simplicity we do not map the labels to range [0, L-1], 
               but keep the original indices when indexing 'confusion'.
         :param cocoGt: COCO object with ground truth annotations
@@ -119,35 +302,8 @@ class COCOStuffeval:
         :param imgId: id of the current image
         :return: confusion (modified confusion matrix)
         '''
-
-        # Combine all annotations of this image in labelMapGt and labelMapRes
-        labelMapGt  = cocoSegmentationToSegmentationMap(cocoGt,  imgId, includeCrowd=False)
-        labelMapRes = cocoSegmentationToSegmentationMap(cocoRes, imgId, includeCrowd=False)
-
-        # Check that the result has only valid labels
-        invalidLabels = [l for l in np.unique(labelMapRes) if l not in self.catIds]
-        if len(invalidLabels) > 0:
-            raise Exception('Error: Invalid classes predicted in the result file: %s. Please insert only labels in the range [%d, %d]!'
-            % (str(invalidLabels), min(self.catIds), max(self.catIds)))
-        
-        # Filter labels that are not in catIds (includes the 0 label)
-        valid = np.reshape(np.in1d(labelMapGt, self.catIds), labelMapGt.shape)
-        validGt = labelMapGt[valid].astype(int)
-        validRes = labelMapRes[valid].astype(int)
-
-        # Gather annotations in confusion matrix
-        #for g, d in zip(validGt, validRes):
-        #    confusion[g-1, d-1] += 1
-
-        # Much faster version using np.unique
-        n = confusion.shape[0] + 1  # Arbitrary number > labelCount
-        map_for_count = validGt * n + validRes
-        vals, cnts = np.unique(map_for_count, return_counts=True)
-        for v, c in zip(vals, cnts):
-            g = v // n
-            d = v % n
-            confusion[g - 1, d - 1] += c
-
+        imageAnns = self._getImageAnns(cocoGt, cocoRes, imgId)
+        confusion += _imageConfusion(imageAnns, self.catIds, confusion.shape[0])
         return confusion
 
     def summarize(self):
@@ -190,31 +346,60 @@ class COCOStuffeval:
 
         return stats, statsClass
 
+    def summarizeGroups(self, groupOf, classStr='groups'):
+        '''
+        Compute and display the metrics for any grouping of the leaf categories, e.g. another
+        hierarchy than the supercategories. Leaves that are not in groupOf are ignored.
+        :param groupOf: dict that maps leaf category ids to their (sortable) group names
+        :param classStr: the name of the grouping that is printed with the metrics
+        :return: tuple of (general) stats and (per-group) statsClass
+        '''
+
+        # Check if evaluate was run and then compute performance metrics
+        if not self.eval:
+            raise Exception('Error: Please run evaluate() first!')
+        confusionGroup, groups = self._getGroupConfusion(self.confusion, groupOf)
+        [miou, fwiou, macc, pacc, ious, maccs] = self._computeMetrics(confusionGroup)
+
+        # Store metrics
+        stats = np.zeros((4,))
+        stats[0] = self._printSummary('Mean IOU', classStr, miou)
+        stats[1] = self._printSummary('FW IOU', classStr, fwiou)
+        stats[2] = self._printSummary('Mean accuracy', classStr, macc)
+        stats[3] = self._printSummary('Pixel accuracy', classStr, pacc)
+        statsClass = {
+            'groups': groups,
+            'ious': ious,
+            'maccs': maccs
+        }
+
+        return stats, statsClass
+
+    def _getGroupConfusion(self, confusion, groupOf):
+        '''
+        Maps the leaf category confusion matrix to a group confusion matrix with a one-hot
+        projection P from leaves to groups, i.e. confusionGroup = P' * confusion * P.
+        :param confusion: leaf category confusion matrix
+        :param groupOf: dict that maps leaf category ids to their (sortable) group names
+        :return: tuple of confusionGroup (group confusion matrix) and groups (sorted group names)
+        '''
+        groups = sorted(set(groupOf.values()))
+        groupIds = dict(zip(groups, range(0, len(groups))))
+        proj = np.zeros((confusion.shape[0], len(groups)))
+        for catId, group in groupOf.items():
+            proj[catId - 1, groupIds[group]] = 1
+        confusionGroup = proj.T.dot(confusion).dot(proj)
+
+        return confusionGroup, groups
+
     def _getSupCatConfusion(self, confusion):
         '''
         Maps the leaf category confusion matrix to a super category confusion matrix.
         :param confusion: leaf category confusion matrix
         :return: confusionSup (super category confusion matrix)
         '''
-
-        # Retrieve supercategory mapping
-        supCats = [c['supercategory'] for c in self.cocoGt.cats.values()]
-        supCatsUn = sorted(set(supCats))
-        keys = supCatsUn
-        vals = range(0, len(supCatsUn))
-        supCatMap = dict(zip(keys, vals))
-        supCatIds = [supCatMap[s] for s in supCats]
-        supCatCount = len(supCatsUn)
-
-        # Compute confusion matrix for supercategories
-        confusionSup = np.zeros((supCatCount, supCatCount))
-        for supCatIdA in xrange(0, supCatCount):
-            for supCatIdB in xrange(0, supCatCount):
-                curLeavesA = np.where([s == supCatIdA for s in supCatIds])[0] + self.stuffStartId - 1
-                curLeavesB = np.where([s == supCatIdB for s in supCatIds])[0] + self.stuffStartId - 1
-                confusionLeaves = confusion[curLeavesA, :]
-                confusionLeaves = confusionLeaves[:, curLeavesB]
-                confusionSup[supCatIdA, supCatIdB] = confusionLeaves.sum()
+        supCatOf = dict([(c['id'], c['supercategory']) for c in self.cocoGt.cats.values()])
+        confusionSup, _ = self._getGroupConfusion(confusion, supCatOf)
         assert confusionSup.sum() == confusion.sum()
 
         return confusionSup
@@ -269,6 +454,96 @@ class COCOStuffeval:
         print(iStr.format(titleStr, classStr, val))
         return val
 
+def _imageConfusion(imageAnns, catIds, labelCount):
+    '''
+    Compute the confusion matrix of a single image from the RLEs of its annotations.
+    :param imageAnns: tuple of (imgId, h, w, rlesGt, labelsGt, rlesRes, labelsRes) (see COCOStuffeval._getImageAnns)
+    :param catIds: ids of the classes that are evaluated
+    :param labelCount: size of the confusion matrix
+    :return: confusion (int64 confusion matrix of the image)
+    '''
+    imgId, h, w, rlesGt, labelsGt, rlesRes, labelsRes = imageAnns
+    rlesRes = maskUtils.RLEs(rlesRes)
+
+    # Intersect GT and result, ignoring GT labels that are not in catIds (includes the 0 label)
+    catIds = set(catIds)
+    try:
+        confusion = maskUtils.confusion(rlesGt, [l - 1 if l in catIds else -1 for l in labelsGt],
+                                        rlesRes, [l - 1 for l in labelsRes], labelCount)
+    except Exception as e:
+        raise Exception('Error: %s (image %d)!' % (str(e).rstrip('.'), imgId))
+
+    # Check that the result has only valid labels (unlabeled pixels have label 0)
+    areas = maskUtils.area(rlesRes)
+    labelsPresent = set([l for l, a in zip(labelsRes, areas) if a > 0])
+    if areas.sum() < h * w:
+        labelsPresent.add(0)
+    invalidLabels = [l for l in sorted(labelsPresent) if l not in catIds]
+    if len(invalidLabels) > 0:
+        raise Exception('Error: Invalid classes predicted in the result file: %s. Please insert only labels in the range [%d, %d]!'
+        % (str(invalidLabels), min(catIds), max(catIds)))
+
+    return confusion
+
+def _getLabelMapPaths(resDir):
+    '''
+    Find the .png and .npy label maps in a folder. Their file names are either the image
+    id (COCO 2017 format, e.g. 000000000139) or end with it (previous format, e.g.
+    COCO_val2014_000000000139). Other files are skipped.
+    :param resDir: folder with the label maps
+    :return: dict that maps image ids to the paths of their label maps
+    '''
+    resPaths = {}
+    skipped = []
+    for fileName in sorted(os.listdir(resDir)):
+        imgName, ext = os.path.splitext(fileName)
+        if ext not in ('.png', '.npy'):
+            continue
+        tokens = imgName.split('_')
+        if len(tokens) == 1 and imgName.isdigit():
+            imgId = int(imgName)
+        elif len(tokens) == 3 and tokens[2].isdigit():
+            imgId = int(tokens[2])
+        else:
+            skipped.append(fileName)
+            continue
+        if imgId in resPaths:
+            raise Exception('Error: Multiple label maps for image %d in %s!' % (imgId, resDir))
+        resPaths[imgId] = os.path.join(resDir, fileName)
+    if len(skipped) > 0:
+        print('Skipping %d files in %s that are not named <imgId>.png/.npy or <prefix>_<split>_<imgId>.png/.npy: %s'
+              % (len(skipped), resDir, ', '.join(skipped[:3]) + (', ...' if len(skipped) > 3 else '')))
+    return resPaths
+
+def _loadLabelMap(path):
+    '''
+    Read an indexed .png image (with or without color palette) or a .npy array with a label map.
+    :param path: path of the label map
+    :return: labelMap - [h x w] segmentation map that indicates the label of each pixel
+    '''
+    if path.endswith('.npy'):
+        labelMap = np.load(path)
+    else:
+        from PIL import Image # Pillow is only needed for .png label maps
+        with Image.open(path) as im:
+            labelMap = np.array(im)
+    if labelMap.ndim != 2:
+        raise Exception(('Error: Image has %d instead of 2 channels! Most likely you '
+        'provided an RGB image instead of an indexed image (with or without color palette): %s') % (labelMap.ndim, path))
+    return labelMap
+
+def _evaluateShard(job):
+    '''
+    Sum the confusion matrices of one shard of images in a worker process (see COCOStuffeval._evaluateParallel)
+    :param job: tuple of (list of imageAnns, catIds, labelCount)
+    :return: confusion (int64 confusion matrix of the shard)
+    '''
+    images, catIds, labelCount = job
+    confusion = np.zeros((labelCount, labelCount), dtype=np.int64)
+    for imageAnns in images:
+        confusion += _imageConfusion(imageAnns, catIds, labelCount)
+    return confusion
+
 class Params:
     '''
     Params for coco stuff evaluation api
@@ -23,13 +23,7 @@ def segmentationToCocoMask(labelMap, labelId):
     :param labelId: the label from labelMap that will be encoded
     :return: Rs - the encoded label mask for label 'labelId'
     '''
-    labelMask = labelMap == labelId
-    labelMask = np.expand_dims(labelMask, axis=2)
-    labelMask = labelMask.astype('uint8')
-    labelMask = np.asfortranarray(labelMask)
-    Rs = mask.encode(labelMask)
-    assert len(Rs) == 1
-    Rs = Rs[0]
+    Rs = mask.encode(labelMap == labelId)
 
     return Rs
 
@@ -52,15 +46,15 @@ def segmentationToCocoResult(labelMap, imgId, stuffStartId=92):
         'provided an RGB image instead of an indexed image (with or without color palette).') % len(shape))
     [h, w] = shape
     assert h > 0 and w > 0
-    labelsAll = np.unique(labelMap)
-    labelsStuff = [i for i in labelsAll if i >= stuffStartId]
+
+    # Encode the masks of all labels in a single pass
+    labelRs = mask.encodeLabelMap(labelMap)
 
     # Add stuff annotations
     anns = []
-    for labelId in labelsStuff:
-
-        # Create mask and encode it
-        Rs = segmentationToCocoMask(labelMap, labelId)
+    for labelId, Rs in labelRs.items():
+        if labelId < stuffStartId:
+            continue
 
         # Create annotation data and add it to the list
         anndata = {}
@@ -83,10 +77,9 @@ def cocoSegmentationToSegmentationMap(coco, imgId, checkUniquePixelLabel=True, i
     # Init
     curImg = coco.imgs[imgId]
     imageSize = (curImg['height'], curImg['width'])
-    labelMap = np.zeros(imageSize)
+    labelMap = np.zeros(imageSize, dtype=np.int32)
 
     # Get annotations of the current image (may be empty)
-    imgAnnots = [a for a in coco.anns.values() if a['image_id'] == imgId]
     if includeCrowd:
         annIds = coco.getAnnIds(imgIds=imgId)
     else:
@@ -94,18 +87,15 @@ def cocoSegmentationToSegmentationMap(coco, imgId, checkUniquePixelLabel=True, i
     imgAnnots = coco.loadAnns(annIds)
 
     # Combine all annotations of this image in labelMap
-    #labelMasks = mask.decode([a['segmentation'] for a in imgAnnots])
-    for a in xrange(0, len(imgAnnots)):
-        labelMask = coco.annToMask(imgAnnots[a]) == 1
-        #labelMask = labelMasks[:, :, a] == 1
-        newLabel = imgAnnots[a]['category_id']
-
-        if checkUniquePixelLabel and (labelMap[labelMask] != 0).any():
-            raise Exception('Error: Some pixels have more than one label (image %d)!' % (imgId))
-
-        labelMap[labelMask] = newLabel
-
-    return labelMap
+    rles = [coco.annToRLE(a) for a in imgAnnots]
+    labels = [a['category_id'] for a in imgAnnots]
+    try:
+        mask.decodeLabelMap(rles, labels, out=labelMap, overlap='error' if checkUniquePixelLabel else 'last')
+    except mask.OverlapError:
+        raise Exception('Error: Some pixels have more than one label (image %d)!' % (imgId))
+
+    # painted as int32, returned as float64 like before
+    return labelMap.astype(np.float64)
 
 def pngToCocoResult(pngPath, imgId, stuffStartId=92):
     '''
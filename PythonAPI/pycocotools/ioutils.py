@@ -2,7 +2,12 @@
 
 __author__ = 'tillvolkmann'
 
+import gzip
+import hashlib
+import io
+import json
 import os
+import pickle
 from shutil import copyfile
 from sys import exit, exc_info
 
@@ -56,5 +61,227 @@ def copy_file(image_path, target_path):
         exit(1)
 
 
+def save_checkpoint(path, state):
+    """
+    Save the state of a long running job so that it can be resumed.
+
+    The state is pickled to a temporary file next to path that then replaces path, so an
+    interrupted save never leaves a truncated checkpoint behind.
+
+    :param path: path of the checkpoint file
+    :param state: picklable object
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Load a state saved with save_checkpoint.
+
+    :param path: path of the checkpoint file
+    :return: the saved state, or None if there is no checkpoint at path
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def annotations_fingerprint(anns):
+    """
+    Hash the fields of annotations that evaluation results depend on, e.g. to tell whether a checkpoint
+    was saved for the same gts and dts.
+
+    :param anns: list of annotation dicts (RLE counts are hashed directly, other segmentations by their repr)
+    :return: hex digest
+    """
+    h = hashlib.sha1()
+    for ann in anns:
+        segm = ann.get('segmentation')
+        if isinstance(segm, dict) and isinstance(segm.get('counts'), (bytes, str)):
+            counts = segm['counts']
+            h.update(counts if isinstance(counts, bytes) else counts.encode('utf-8'))
+            segm = segm.get('size')
+        h.update(repr((ann.get('id'), ann.get('image_id'), ann.get('category_id'), ann.get('iscrowd'),
+                       ann.get('score'), ann.get('area'), ann.get('bbox'), ann.get('keypoints'), segm)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def files_fingerprint(paths):
+    """
+    Hash the names, sizes and modification times of files, e.g. to tell whether a folder of results was
+    overwritten since a checkpoint was saved.
+
+    :param paths: list of file paths
+    :return: hex digest
+    """
+    h = hashlib.sha1()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        h.update(repr((os.path.basename(path), stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def open_text_file(path):
+    """
+    Open a plain, gzip- or zstd-compressed UTF-8 text file for reading.
+
+    The compression is detected from the first bytes of the file. Reading zstd-compressed files
+    requires the zstandard package.
+
+    :param path: path of the file
+    :return: tuple of the text file and the underlying binary file (whose position is in compressed bytes)
+    """
+    raw_file = open(path, 'rb')
+    magic = raw_file.read(4)
+    raw_file.seek(0)
+    if magic[:2] == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=raw_file, mode='rb')
+    elif magic == b'\x28\xb5\x2f\xfd':
+        try:
+            import zstandard
+        except ImportError:
+            raw_file.close()
+            raise Exception('The zstandard package is required to read the zstd-compressed file {}'.format(path))
+        stream = zstandard.ZstdDecompressor().stream_reader(raw_file)
+    else:
+        stream = raw_file
+    return io.TextIOWrapper(stream, encoding='utf-8'), raw_file
+
+
+class _JsonStream:
+    """
+    Incremental tokenizer for a JSON document that is read in chunks.
+    """
+
+    def __init__(self, text_file, chunk_size, on_read=None):
+        self.text_file = text_file
+        self.chunk_size = chunk_size
+        self.on_read = on_read
+        # the decoder only shares equal keys within one value, so share them across elements
+        self.keys = {}
+        self.decoder = json.JSONDecoder(object_pairs_hook=self.make_object)
+        self.buf, self.pos, self.eof = '', 0, False
+
+    def make_object(self, pairs):
+        return {self.keys.setdefault(k, k): v for k, v in pairs}
+
+    def read(self):
+        """
+        Append the next chunk to the buffer, dropping what is already parsed.
+
+        :return: False at the end of the file
+        """
+        if self.eof:
+            return False
+        chunk = self.text_file.read(self.chunk_size)
+        self.eof = len(chunk) == 0
+        self.buf, self.pos = self.buf[self.pos:] + chunk, 0
+        if self.on_read is not None:
+            self.on_read()
+        return not self.eof
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character ('' at the end of the file).
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read():
+                return ''
+
+    def expect(self, chars):
+        """
+        Consume the next character, which must be one of chars.
+
+        :return: the consumed character
+        """
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise Exception('Invalid JSON: expected one of {} but found {!r}'.format(list(chars), c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """
+        Decode the next complete JSON value, reading more chunks until it is in the buffer.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number may continue in the next chunk (e.g. when cut after '.', 'e' or '-'), so it
+                # is only complete if it is followed by a character that cannot be part of it
+                if self.eof or (end < len(self.buf) and self.buf[end] not in '0123456789+-.eE'):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.read()
+
+
+def iter_json_dataset(path, chunk_size=1 << 24, progress=True):
+    """
+    Parse a (compressed) JSON file with a top-level object, like a COCO annotation file, element by element.
+
+    Only one chunk of the file and the current element are held as text, so the peak memory stays close to
+    the size of the parsed objects. Top-level arrays are yielded as (key, [], False) followed by one
+    (key, element, True) per element, all other values as (key, value, False).
+
+    :param path: path of the plain, gzip- or zstd-compressed JSON file (see open_text_file)
+    :param chunk_size: number of characters that are read at once
+    :param progress: print the percentage of the file that has been read
+    :return: generator of (key, value, is_element) tuples
+    """
+    text_file, raw_file = open_text_file(path)
+    total_size = max(os.fstat(raw_file.fileno()).st_size, 1)
+    next_percent = [10]
+
+    def on_read():
+        percent = 100.0 * raw_file.tell() / total_size
+        if progress and percent >= next_percent[0]:
+            print('read {:.0f}% of {}'.format(percent, path))
+            next_percent[0] = 10 * (int(percent) // 10 + 1)
+
+    stream = _JsonStream(text_file, chunk_size, on_read)
+    try:
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            key = stream.value()
+            if not isinstance(key, str):
+                raise Exception('Invalid JSON: expected a key but found {!r}'.format(key))
+            stream.expect(':')
+            if stream.peek() == '[':
+                stream.expect('[')
+                yield key, [], False
+                if stream.peek() != ']':
+                    while True:
+                        yield key, stream.value(), True
+                        if stream.expect(',]') == ']':
+                            break
+                else:
+                    stream.expect(']')
+            else:
+                yield key, stream.value(), False
+            if stream.expect(',}') == '}':
+                break
+        if stream.peek() != '':
+            raise Exception('Invalid JSON: extra data after the top-level object in {}'.format(path))
+    finally:
+        text_file.close()
+        raw_file.close()
+
+
 if __name__ == '__main__':
     pass
\ No newline at end of file
@@ -29,30 +29,66 @@ import pycocotools._mask as _mask
 #
 # The following API functions are defined:
 #  encode         - Encode binary masks using RLE.
+#  encodeLabelMap - Encode every label of a label map using RLE in one pass.
 #  decode         - Decode binary masks encoded via RLE.
+#  decodeCrop     - Decode only a window (by default the bbox) of encoded masks.
+#  decodeLabelMap - Paint encoded masks with integer labels into one label map.
 #  merge          - Compute union or intersection of encoded masks.
 #  iou            - Compute intersection over union between masks.
 #  area           - Compute area of encoded masks.
+#  confusion      - Compute the pixel confusion between two sets of labeled masks.
 #  toBbox         - Get bounding boxes surrounding encoded masks.
 #  frPyObjects    - Convert polygon, bbox, and uncompressed RLE to encoded RLE mask.
+#  frBoxMasks     - Paste small soft masks into their boxes and encode them.
+#  nms            - Non-maximum suppression (greedy or soft) of masks or boxes.
+#  RLEs           - Parse encoded RLE masks once for reuse across the functions above.
 #
 # Usage:
-#  Rs     = encode( masks )
-#  masks  = decode( Rs )
+#  Rs     = encode( masks, threshold=None, packedHeight=None )
+#  masks  = decode( Rs, packed=False )
+#  Rs     = encodeLabelMap( L, labels=None )  ({label: R})
+#  crops  = decodeCrop( Rs, window=None, out=None )
+#  L      = decodeLabelMap( Rs, labels, out=None, dtype=np.int32, overlap='last' )
 #  R      = merge( Rs, intersect=false )
 #  o      = iou( dt, gt, iscrowd )
 #  a      = area( Rs )
+#  C      = confusion( gt, gtLabels, dt, dtLabels, labelCount )
 #  bbs    = toBbox( Rs )
 #  Rs     = frPyObjects( [pyObjects], h, w )
+#  Rs     = frBoxMasks( boxMasks, bbs, h, w, threshold=0.5 )
+#  keep   = nms( dt, scores, thr, categories=None, method='hard' )
+#  Rs     = RLEs( Rs ); Rs[i], Rs[i:j], Rs[[i,j,...]], Rs.tolist()
 #
 # In the API the following formats are used:
 #  Rs      - [dict] Run-length encoding of binary masks
 #  R       - dict Run-length encoding of binary mask
-#  masks   - [hxwxn] Binary mask(s) (must have type np.ndarray(dtype=uint8) in column-major order)
+#  masks   - [hxwxn] Binary mask(s) (np.ndarray of type uint8 in column-major order when decoded)
+# encode accepts masks in any memory order (C, Fortran or strided views) of
+# type bool, uint8, float32 or float64 without copying them. Nonzero pixels are
+# set, or with a threshold the pixels >= threshold (e.g. probability maps).
+# decode(Rs, packed=True) packs 8 rows per byte (msb first), giving a uint8
+# [(h+7)/8 x w x n] array with np.unpackbits(masks, axis=0, count=h) == decode(Rs);
+# encode(masks, packedHeight=h) encodes such packed masks directly.
 #  iscrowd - [nx1] list of np.ndarray. 1 indicates corresponding gt image has crowd region to ignore
 #  bbs     - [nx4] Bounding box(es) stored as [x y w h]
 #  poly    - Polygon stored as [[x1 y1 x2 y2...],[x1 y1 ...],...] (2D list)
+#  boxMasks- [nxmhxmw] Soft masks (e.g. 28x28 mask head probabilities) of the objects in bbs
 #  dt,gt   - May be either bounding boxes or encoded masks
+#  window  - Integer [x y w h] crop of the image shared by all masks in Rs.
+#            If not given, each mask is cropped to its own bbox and a list
+#            of [hxw] crops is returned (or a single crop for a single R).
+#  out     - Optional preallocated uint8/bool [hxwxn] (or [hxw]) array in any
+#            memory order receiving the crops, e.g. a slice of a batch buffer.
+#  L       - [hxw] label map of type uint8, uint16, int32 or int64 (0 is unlabeled).
+#  overlap - Label of pixels covered by several masks, taken in order: 'last',
+#            'first' (labeled pixels are kept), or 'error' (raise OverlapError,
+#            which confusion raises for overlapping masks as well).
+#  C       - [LxL] int64 confusion, C[g,d] pixels with label g in the gt masks and
+#            d in the dt masks (masks within gt or dt must not overlap; labels
+#            outside [0,L) and unlabeled pixels are not counted).
+# Wherever Rs is accepted a parsed RLEs object can be given instead, which
+# skips decoding the compressed counts again. Indexing RLEs returns views
+# sharing the parsed counts; functions return arrays for any RLEs object.
 # Both poly and bbs are 0-indexed (bbox=[0 0 1 1] encloses first pixel).
 #
 # Finally, a note about the intersection over union (iou) computation.
@@ -75,29 +111,50 @@ import pycocotools._mask as _mask
 
 iou         = _mask.iou
 merge       = _mask.merge
+decodeLabelMap = _mask.decodeLabelMap
+confusion   = _mask.confusion
 frPyObjects = _mask.frPyObjects
+frBoxMasks  = _mask.frBoxMasks
+encodeLabelMap = _mask.encodeLabelMap
+nms         = _mask.nms
+RLEs        = _mask.RLEs
+OverlapError = _mask.OverlapError
 
-def encode(bimask):
+def encode(bimask, threshold=None, packedHeight=None):
     if len(bimask.shape) == 3:
-        return _mask.encode(bimask)
+        return _mask.encode(bimask, threshold, packedHeight)
     elif len(bimask.shape) == 2:
-        h, w = bimask.shape
-        return _mask.encode(bimask.reshape((h, w, 1), order='F'))[0]
+        return _mask.encode(bimask[:, :, None], threshold, packedHeight)[0]
 
-def decode(rleObjs):
-    if type(rleObjs) == list:
-        return _mask.decode(rleObjs)
+def decode(rleObjs, packed=False):
+    if type(rleObjs) == list or type(rleObjs) == RLEs:
+        return _mask.decode(rleObjs, packed)
     else:
-        return _mask.decode([rleObjs])[:,:,0]
+        return _mask.decode([rleObjs], packed)[:,:,0]
+
+def decodeCrop(rleObjs, window=None, out=None):
+    if type(rleObjs) == list or type(rleObjs) == RLEs:
+        if window is not None:
+            return _mask.decodeCrop(rleObjs, window, out)
+        if out is not None:
+            raise Exception('out requires a window shared by all masks')
+        Rs = RLEs(rleObjs)
+        return [_mask.decodeCrop(Rs[i], bb.astype(int))[:,:,0] for i, bb in enumerate(_mask.toBbox(Rs))]
+    else:
+        if window is None:
+            window = _mask.toBbox([rleObjs])[0].astype(int)
+        if out is not None:
+            out = out[:,:,None]
+        return _mask.decodeCrop([rleObjs], window, out)[:,:,0]
 
 def area(rleObjs):
-    if type(rleObjs) == list:
+    if type(rleObjs) == list or type(rleObjs) == RLEs:
         return _mask.area(rleObjs)
     else:
         return _mask.area([rleObjs])[0]
 
 def toBbox(rleObjs):
-    if type(rleObjs) == list:
+    if type(rleObjs) == list or type(rleObjs) == RLEs:
         return _mask.toBbox(rleObjs)
     else:
         return _mask.toBbox([rleObjs])[0]
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# test the pycocotools of this checkout (built in place with `make`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
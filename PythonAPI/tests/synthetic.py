@@ -0,0 +1,138 @@
+'''
+Random COCO datasets and results for the tests. Detections are jittered copies
+of the gts (with tied scores) plus random false positives, some images have no
+gts or no detections and the last category has neither.
+'''
+import copy
+
+import numpy as np
+
+from pycocotools import mask as maskUtils
+from pycocotools.coco import COCO
+from pycocotools.cocoeval import COCOeval
+
+NUM_KPTS = 17
+
+
+def randomPolygon(rng, h, w):
+    cx, cy = rng.uniform(0, w), rng.uniform(0, h)
+    r = rng.uniform(2, min(h, w) / 2.)
+    ang = np.sort(rng.uniform(0, 2 * np.pi, rng.integers(3, 8)))
+    xs = np.clip(cx + r * rng.uniform(.5, 1., len(ang)) * np.cos(ang), 0, w - 1)
+    ys = np.clip(cy + r * rng.uniform(.5, 1., len(ang)) * np.sin(ang), 0, h - 1)
+    return np.stack([xs, ys], axis=1).ravel().tolist()
+
+
+def randomKeypoints(rng, bbox, visible=True):
+    x, y, bw, bh = bbox
+    kpts = np.zeros((NUM_KPTS, 3))
+    kpts[:, 0] = rng.uniform(x, x + bw, NUM_KPTS)
+    kpts[:, 1] = rng.uniform(y, y + bh, NUM_KPTS)
+    kpts[:, 2] = 2 if visible else 0
+    return kpts
+
+
+def randomDataset(seed, numImgs=20, numCats=4):
+    '''
+    Random ground truth with polygon, crowd RLE and keypoint annotations
+    :return: dataset dict as read from an annotation file
+    '''
+    rng = np.random.default_rng(seed)
+    cats = [{'id': c + 1, 'name': 'cat%d' % c, 'supercategory': 'super%d' % (c % 2)} for c in range(numCats)]
+    imgs, anns = [], []
+    for i in range(numImgs):
+        h, w = int(rng.integers(40, 160)), int(rng.integers(40, 160))
+        imgId = 1000 + 3 * i
+        imgs.append({'id': imgId, 'height': h, 'width': w, 'file_name': '%012d.jpg' % imgId})
+        # the last category never has gts and every fourth image has none
+        for _ in range(rng.integers(0, 7) if i % 4 else 0):
+            poly = randomPolygon(rng, h, w)
+            rle = maskUtils.merge(maskUtils.frPyObjects([poly], h, w))
+            area = float(maskUtils.area(rle))
+            if area == 0:
+                continue
+            bbox = maskUtils.toBbox(rle).tolist()
+            iscrowd = int(rng.random() < .15)
+            kpts = randomKeypoints(rng, bbox)
+            kpts[rng.random(NUM_KPTS) < .3, 2] = 0
+            if rng.random() < .1:
+                kpts[:, 2] = 0
+            anns.append({
+                'id': len(anns) + 1, 'image_id': imgId, 'category_id': int(rng.integers(1, max(numCats, 2))),
+                'segmentation': {'size': [h, w], 'counts': rle['counts'].decode()} if iscrowd else [poly],
+                'area': area, 'bbox': bbox, 'iscrowd': iscrowd,
+                'keypoints': kpts.ravel().tolist(), 'num_keypoints': int(np.count_nonzero(kpts[:, 2])),
+            })
+    return {'images': imgs, 'annotations': anns, 'categories': cats}
+
+
+def randomResults(dataset, seed, iouType):
+    '''
+    Random detections for a dataset from randomDataset
+    :return: list of dts in the results file format of iouType
+    '''
+    rng = np.random.default_rng(seed)
+    imgs = {img['id']: img for img in dataset['images']}
+    numCats = len(dataset['categories'])
+    dets = []
+    def add(imgId, catId, poly, kpts, score):
+        h, w = imgs[imgId]['height'], imgs[imgId]['width']
+        rle = maskUtils.merge(maskUtils.frPyObjects([poly], h, w))
+        bbox = maskUtils.toBbox(rle).tolist()
+        if bbox[2] == 0 or bbox[3] == 0:
+            return
+        dt = {'image_id': imgId, 'category_id': catId, 'score': score}
+        if iouType == 'segm':
+            dt['segmentation'] = {'size': [h, w], 'counts': rle['counts'].decode()}
+        elif iouType == 'bbox':
+            dt['bbox'] = bbox
+        else:
+            dt['keypoints'] = (kpts if kpts is not None else randomKeypoints(rng, bbox)).ravel().tolist()
+        dets.append(dt)
+    for ann in dataset['annotations']:
+        img = imgs[ann['image_id']]
+        poly = ann['segmentation'][0] if isinstance(ann['segmentation'], list) else \
+            randomPolygon(rng, img['height'], img['width'])
+        for _ in range(rng.integers(0, 3)):
+            catId = ann['category_id'] if rng.random() < .8 else int(rng.integers(1, numCats))
+            kpts = np.array(ann['keypoints']).reshape((-1, 3))
+            kpts[:, :2] += rng.normal(0, 2, (NUM_KPTS, 2))
+            kpts[:, 2] = 1
+            # scores on a coarse grid, so some of them tie
+            add(ann['image_id'], catId, (np.array(poly) + rng.normal(0, 1.5, len(poly))).tolist(), kpts,
+                float(rng.integers(0, 20)) / 20)
+    for n, img in enumerate(dataset['images']):
+        # every fifth image has no detections
+        for _ in range(rng.integers(0, 10) if n % 5 != 2 else 0):
+            add(img['id'], int(rng.integers(1, max(numCats, 2))), randomPolygon(rng, img['height'], img['width']),
+                None, float(rng.random()))
+    return dets
+
+
+def loadCoco(dataset):
+    '''
+    COCO api of a copy of dataset
+    '''
+    return COCO(copy.deepcopy(dataset))
+
+
+def loadRes(cocoGt, dets):
+    '''
+    COCO api of a copy of the results (loadRes modifies them)
+    '''
+    return cocoGt.loadRes(copy.deepcopy(dets))
+
+
+def evaluated(iouType, seed, useCats=1, params=None, **kwargs):
+    '''
+    COCOeval of a random dataset and results, after evaluate(**kwargs)
+    :param params: dict of params to set besides useCats
+    '''
+    dataset = randomDataset(seed)
+    cocoGt = loadCoco(dataset)
+    E = COCOeval(cocoGt, loadRes(cocoGt, randomResults(dataset, seed, iouType)), iouType)
+    E.params.useCats = useCats
+    for key, value in (params or {}).items():
+        setattr(E.params, key, value)
+    E.evaluate(**kwargs)
+    return E
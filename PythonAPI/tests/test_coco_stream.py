@@ -0,0 +1,76 @@
+'''
+COCO(path, stream=True) must load the same dataset and index as COCO(path),
+for plain and compressed files read in chunks that split every kind of value.
+'''
+import functools
+import gzip
+import json
+
+import pytest
+
+from pycocotools import coco, ioutils
+from pycocotools.coco import COCO
+from synthetic import randomDataset
+
+# values that span chunk boundaries: numbers, escaped strings and nested objects
+EXTRA = {
+    'info': {'description': 'quote " backslash \\ slash / tab \t newline \n unicode é中 \U0001F600',
+             'year': 2017, 'version': '1.0', 'nested': {'a': [1, [2, [3, {'b': None}]]], 'c': {}, 'd': []}},
+    'numbers': [0, -0.0, 1, -12, 3.25, -1.5e-7, 6.02e+23, 1e300, 12345678901234567890, 0.1, True, False, None],
+    'licenses': [],
+    'empty': {},
+    'name': 'esc\\aped "name"',
+}
+
+
+def writeDataset(path, dataset, compression, indent):
+    text = json.dumps(dataset, indent=indent).encode('utf-8')
+    if compression == 'gz':
+        text = gzip.compress(text)
+    elif compression == 'zst':
+        zstandard = pytest.importorskip('zstandard')
+        text = zstandard.ZstdCompressor().compress(text)
+    with open(path, 'wb') as f:
+        f.write(text)
+
+
+def assertSameCoco(a, b):
+    assert a.dataset == b.dataset
+    assert json.dumps(a.dataset) == json.dumps(b.dataset)
+    assert a.anns == b.anns and a.imgs == b.imgs and a.cats == b.cats
+    assert dict(a.imgToAnns) == dict(b.imgToAnns)
+    assert dict(a.catToImgs) == dict(b.catToImgs)
+
+
+@pytest.mark.parametrize('compression', ['', 'gz', 'zst'])
+@pytest.mark.parametrize('chunkSize', [1, 2, 3, 7, 64, 1 << 24])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_stream_matches_load(monkeypatch, tmp_path, compression, chunkSize, indent):
+    dataset = dict(randomDataset(0, numImgs=4), **EXTRA)
+    path = str(tmp_path / ('instances.json' + ('.' + compression if compression else '')))
+    writeDataset(path, dataset, compression, indent)
+    monkeypatch.setattr(coco, 'iter_json_dataset', functools.partial(ioutils.iter_json_dataset, chunk_size=chunkSize))
+    ref = COCO(path)
+    assertSameCoco(COCO(path, stream=True), ref)
+    assert ref.dataset == json.loads(json.dumps(dataset))
+
+
+@pytest.mark.parametrize('chunkSize', [1, 2, 5])
+def test_iter_json_dataset_values(tmp_path, chunkSize):
+    path = str(tmp_path / 'values.json')
+    text = '{"a":[1,22,333e-2,-4.5,"x\\"y"],"b":12345,"c":{"d":[]} ,"e":[],"f":-6e7}'
+    with open(path, 'w') as f:
+        f.write(text)
+    items = list(ioutils.iter_json_dataset(path, chunk_size=chunkSize, progress=False))
+    assert items == [('a', [], False), ('a', 1, True), ('a', 22, True), ('a', 3.33, True), ('a', -4.5, True),
+                     ('a', 'x"y', True), ('b', 12345, False), ('c', {'d': []}, False), ('e', [], False),
+                     ('f', -6e7, False)]
+
+
+@pytest.mark.parametrize('text', ['{"a": [1, 2}', '{"a": 1', '{"a": 1} []', '[1, 2]', '{1: 2}'])
+def test_iter_json_dataset_invalid(tmp_path, text):
+    path = str(tmp_path / 'invalid.json')
+    with open(path, 'w') as f:
+        f.write(text)
+    with pytest.raises(Exception):
+        list(ioutils.iter_json_dataset(path, chunk_size=2, progress=False))
@@ -0,0 +1,132 @@
+'''
+The vectorized COCOeval.accumulate must give exactly the precision, recall
+and scores of the original loop over categories, area ranges, max detections
+and IoU thresholds.
+'''
+import copy
+
+import numpy as np
+import pytest
+
+from synthetic import evaluated
+
+
+def pythonAccumulate(E, p):
+    '''
+    Accumulation with the original scalar loops, kept as the reference
+    :return: precision, recall, scores
+    '''
+    p.catIds = p.catIds if p.useCats == 1 else [-1]
+    T           = len(p.iouThrs)
+    R           = len(p.recThrs)
+    K           = len(p.catIds) if p.useCats else 1
+    A           = len(p.areaRng)
+    M           = len(p.maxDets)
+    precision   = -np.ones((T,R,K,A,M)) # -1 for the precision of absent categories
+    recall      = -np.ones((T,K,A,M))
+    scores      = -np.ones((T,R,K,A,M))
+
+    # create dictionary for future indexing
+    _pe = E._paramsEval
+    catIds = _pe.catIds if _pe.useCats else [-1]
+    setK = set(catIds)
+    setA = set(map(tuple, _pe.areaRng))
+    setM = set(_pe.maxDets)
+    setI = set(_pe.imgIds)
+    # get inds to evaluate
+    k_list = [n for n, k in enumerate(p.catIds)  if k in setK]
+    m_list = [m for n, m in enumerate(p.maxDets) if m in setM]
+    a_list = [n for n, a in enumerate(map(lambda x: tuple(x), p.areaRng)) if a in setA]
+    i_list = [n for n, i in enumerate(p.imgIds)  if i in setI]
+    I0 = len(_pe.imgIds)
+    A0 = len(_pe.areaRng)
+    # retrieve E at each category, area range, and max number of detections
+    for k, k0 in enumerate(k_list):
+        Nk = k0*A0*I0
+        for a, a0 in enumerate(a_list):
+            Na = a0*I0
+            for m, maxDet in enumerate(m_list):
+                Es = [E.evalImgs[Nk + Na + i] for i in i_list]
+                Es = [e for e in Es if not e is None]
+                if len(Es) == 0:
+                    continue
+                dtScores = np.concatenate([e['dtScores'][0:maxDet] for e in Es])
+
+                # different sorting method generates slightly different results.
+                # mergesort is used to be consistent as Matlab implementation.
+                inds = np.argsort(-dtScores, kind='mergesort')
+                dtScoresSorted = dtScores[inds]
+
+                dtm  = np.concatenate([e['dtMatches'][:,0:maxDet] for e in Es], axis=1)[:,inds]
+                dtIg = np.concatenate([e['dtIgnore'][:,0:maxDet]  for e in Es], axis=1)[:,inds]
+                gtIg = np.concatenate([e['gtIgnore'] for e in Es])
+                npig = np.count_nonzero(gtIg==0 )
+                if npig == 0:
+                    continue
+                tps = np.logical_and(               dtm,  np.logical_not(dtIg) )
+                fps = np.logical_and(np.logical_not(dtm), np.logical_not(dtIg) )
+
+                tp_sum = np.cumsum(tps, axis=1).astype(dtype=float)
+                fp_sum = np.cumsum(fps, axis=1).astype(dtype=float)
+                for t, (tp, fp) in enumerate(zip(tp_sum, fp_sum)):
+                    tp = np.array(tp)
+                    fp = np.array(fp)
+                    nd = len(tp)
+                    rc = tp / npig
+                    pr = tp / (fp+tp+np.spacing(1))
+                    q  = np.zeros((R,))
+                    ss = np.zeros((R,))
+
+                    if nd:
+                        recall[t,k,a,m] = rc[-1]
+                    else:
+                        recall[t,k,a,m] = 0
+
+                    pr = pr.tolist(); q = q.tolist()
+
+                    for i in range(nd-1, 0, -1):
+                        if pr[i] > pr[i-1]:
+                            pr[i-1] = pr[i]
+
+                    inds = np.searchsorted(rc, p.recThrs, side='left')
+                    try:
+                        for ri, pi in enumerate(inds):
+                            q[ri] = pr[pi]
+                            ss[ri] = dtScoresSorted[pi]
+                    except:
+                        pass
+                    precision[t,:,k,a,m] = np.array(q)
+                    scores[t,:,k,a,m] = np.array(ss)
+    return precision, recall, scores
+
+
+def assertSameAccumulate(E, p):
+    ref = pythonAccumulate(E, copy.deepcopy(p))
+    E.accumulate(copy.deepcopy(p))
+    for key, r in zip(['precision', 'recall', 'scores'], ref):
+        assert E.eval[key].shape == r.shape, key
+        assert np.array_equal(E.eval[key], r), key
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm', 'keypoints'])
+@pytest.mark.parametrize('useCats', [1, 0])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_accumulate_matches_python(iouType, useCats, seed):
+    E = evaluated(iouType, seed, useCats)
+    assertSameAccumulate(E, E.params)
+    # the last category has neither gts nor dts
+    if useCats:
+        assert np.all(E.eval['precision'][:, :, -1] == -1)
+        assert np.any(E.eval['precision'][:, :, :-1] > 0)
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm', 'keypoints'])
+def test_accumulate_matches_python_subset(iouType):
+    # accumulate a subset of the evaluated images, categories and max detections
+    E = evaluated(iouType, 3)
+    p = copy.deepcopy(E.params)
+    p.imgIds = p.imgIds[::2]
+    p.catIds = p.catIds[1:]
+    p.maxDets = [1, 3, 10]
+    p.recThrs = np.linspace(0, 1, 11)
+    assertSameAccumulate(E, p)
@@ -0,0 +1,98 @@
+'''
+An evaluation interrupted between shards and resumed from its checkpoint must
+give the results of an uninterrupted one, and a checkpoint must not be resumed
+for other annotations or params.
+'''
+import os
+
+import numpy as np
+import pytest
+
+from pycocotools import cocoeval
+from pycocotools.cocoeval import COCOeval
+from synthetic import randomDataset, randomResults, loadCoco, loadRes
+
+
+def makeEval(iouType, seed, dets=None):
+    dataset = randomDataset(seed)
+    cocoGt = loadCoco(dataset)
+    dets = dets if dets is not None else randomResults(dataset, seed, iouType)
+    return COCOeval(cocoGt, loadRes(cocoGt, dets), iouType)
+
+
+def countShards(monkeypatch, interruptAfter=None):
+    '''
+    Count the shards evaluated by _evaluateShard, raising KeyboardInterrupt after interruptAfter of them
+    :return: list of the image ids of the evaluated shards
+    '''
+    shards = []
+    evaluateShard = cocoeval._evaluateShard
+    def interrupted(job):
+        if len(shards) == interruptAfter:
+            raise KeyboardInterrupt
+        shards.append(job[1])
+        return evaluateShard(job)
+    monkeypatch.setattr(cocoeval, '_evaluateShard', interrupted)
+    return shards
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm'])
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('workers', [None, 2])
+def test_resume_matches_uninterrupted(monkeypatch, tmp_path, iouType, compact, workers):
+    checkpoint = str(tmp_path / 'eval.ckpt')
+    ref = makeEval(iouType, 7)
+    ref.evaluate(compact=compact)
+    ref.accumulate()
+
+    E = makeEval(iouType, 7)
+    with monkeypatch.context() as m:
+        countShards(m, interruptAfter=6)
+        with pytest.raises(KeyboardInterrupt):
+            E.evaluate(compact=compact, checkpoint=checkpoint, checkpointInterval=0)
+    assert os.path.exists(checkpoint)
+
+    # a new evaluator only evaluates the remaining shards (in worker processes if given)
+    E = makeEval(iouType, 7)
+    if workers is None:
+        shards = countShards(monkeypatch)
+    E.evaluate(compact=compact, workers=workers, checkpoint=checkpoint)
+    if workers is None:
+        assert len(shards) == len(E.params.imgIds) - 6
+        assert shards[0][0] == E.params.imgIds[6]
+    assert not os.path.exists(checkpoint)
+    assert len(E.evalImgs) == len(ref.evalImgs)
+    for e, r in zip(E.evalImgs, ref.evalImgs):
+        assert (e is None) == (r is None)
+        if e is not None:
+            for key in r:
+                assert np.array_equal(np.asarray(e[key]), np.asarray(r[key])), key
+    E.accumulate()
+    for key in ['precision', 'recall', 'scores']:
+        assert np.array_equal(E.eval[key], ref.eval[key]), key
+
+
+def test_checkpoint_of_other_evaluation(monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / 'eval.ckpt')
+    dataset = randomDataset(7)
+    dets = randomResults(dataset, 7, 'bbox')
+    with monkeypatch.context() as m:
+        countShards(m, interruptAfter=3)
+        with pytest.raises(KeyboardInterrupt):
+            makeEval('bbox', 7, dets).evaluate(checkpoint=checkpoint, checkpointInterval=0)
+    # a moved detection, other params or another layout do not resume the checkpoint
+    moved = [dict(dt) for dt in dets]
+    moved[-1]['bbox'] = [b + 1 for b in moved[-1]['bbox']]
+    E = makeEval('bbox', 7, moved)
+    with pytest.raises(Exception, match='different evaluation'):
+        E.evaluate(checkpoint=checkpoint)
+    E = makeEval('bbox', 7, dets)
+    E.params.maxDets = [1, 10]
+    with pytest.raises(Exception, match='different evaluation'):
+        E.evaluate(checkpoint=checkpoint)
+    with pytest.raises(Exception, match='different evaluation'):
+        makeEval('bbox', 7, dets).evaluate(compact=True, checkpoint=checkpoint)
+    # the same evaluation does
+    E = makeEval('bbox', 7, dets)
+    E.evaluate(checkpoint=checkpoint)
+    assert not os.path.exists(checkpoint)
@@ -0,0 +1,78 @@
+'''
+evaluate(sparse=True) and evaluate(compact=True) must give the same per image
+results, accumulate() and summarize() numbers as the dense evalImgs list.
+'''
+import numpy as np
+import pytest
+
+from pycocotools.cocoeval import EvalImgsStore
+from synthetic import evaluated
+
+
+def assertSameResults(E, ref):
+    E.accumulate()
+    ref.accumulate()
+    for key in ['precision', 'recall', 'scores']:
+        assert np.array_equal(E.eval[key], ref.eval[key]), key
+    E.summarize()
+    ref.summarize()
+    assert np.array_equal(E.stats, ref.stats)
+
+
+def assertSameEvalImg(e, ref):
+    if ref is None:
+        assert e is None
+        return
+    assert sorted(e) == sorted(ref)
+    for key in ref:
+        assert np.array_equal(np.asarray(e[key]), np.asarray(ref[key])), key
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm', 'keypoints'])
+@pytest.mark.parametrize('useCats', [1, 0])
+def test_sparse_matches_dense(iouType, useCats):
+    ref = evaluated(iouType, 0, useCats)
+    E = evaluated(iouType, 0, useCats, sparse=True)
+    p = ref.params
+    catIds = p.catIds if useCats else [-1]
+    I, A = len(p.imgIds), len(p.areaRng)
+    # the pairs left out are the ones without any result
+    assert isinstance(E.evalImgs, dict)
+    for k, catId in enumerate(catIds):
+        for i, imgId in enumerate(p.imgIds):
+            for a in range(A):
+                e = E.evalImgs[imgId, catId][a] if (imgId, catId) in E.evalImgs else None
+                assertSameEvalImg(e, ref.evalImgs[k*A*I + a*I + i])
+    assertSameResults(E, ref)
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm', 'keypoints'])
+@pytest.mark.parametrize('useCats', [1, 0])
+@pytest.mark.parametrize('packSize', [64, 3])
+def test_compact_matches_dense(monkeypatch, iouType, useCats, packSize):
+    # small chunks make the store pack and merge several chunks of each (k, a)
+    monkeypatch.setattr(EvalImgsStore, 'packSize', packSize)
+    ref = evaluated(iouType, 1, useCats)
+    E = evaluated(iouType, 1, useCats, compact=True)
+    assertSameResults(E, ref)
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_compact_view_matches_dense(monkeypatch, workers):
+    monkeypatch.setattr(EvalImgsStore, 'packSize', 3)
+    ref = evaluated('segm', 2)
+    E = evaluated('segm', 2, compact=True, workers=workers)
+    assert len(E.evalImgs) == len(ref.evalImgs)
+    # iteration, indexing from either end and slicing give the dicts and Nones of the list
+    for e, r in zip(E.evalImgs, ref.evalImgs):
+        assertSameEvalImg(e, r)
+    n = len(ref.evalImgs)
+    for i in [0, 1, n // 2, n - 1, -1, -n]:
+        assertSameEvalImg(E.evalImgs[i], ref.evalImgs[i])
+    for e, r in zip(E.evalImgs[5:n:7], ref.evalImgs[5:n:7]):
+        assertSameEvalImg(e, r)
+    assert len(E.evalImgs[5:n:7]) == len(ref.evalImgs[5:n:7])
+    for i in [n, -n - 1]:
+        with pytest.raises(IndexError):
+            E.evalImgs[i]
+    assertSameResults(E, ref)
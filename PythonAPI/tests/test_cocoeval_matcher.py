@@ -0,0 +1,131 @@
+'''
+The compiled greedy matcher (_cocoeval) must give bit-identical per image
+results to the original Python matching loop of COCOeval.evaluateImg.
+'''
+import numpy as np
+import pytest
+
+from synthetic import evaluated
+
+
+def pythonEvaluateImg(E, imgId, catId, aRng, maxDet):
+    '''
+    Per image evaluation with the original Python matching loop, kept as the reference
+    '''
+    p = E.params
+    if p.useCats:
+        gt = E._gts[imgId,catId]
+        dt = E._dts[imgId,catId]
+    else:
+        gt = [_ for cId in p.catIds for _ in E._gts[imgId,cId]]
+        dt = [_ for cId in p.catIds for _ in E._dts[imgId,cId]]
+    if len(gt) == 0 and len(dt) ==0:
+        return None
+
+    for g in gt:
+        if g['ignore'] or (g['area']<aRng[0] or g['area']>aRng[1]):
+            g['_ignore'] = 1
+        else:
+            g['_ignore'] = 0
+
+    # sort dt highest score first, sort gt ignore last
+    gtind = np.argsort([g['_ignore'] for g in gt], kind='mergesort')
+    gt = [gt[i] for i in gtind]
+    dtind = np.argsort([-d['score'] for d in dt], kind='mergesort')
+    dt = [dt[i] for i in dtind[0:maxDet]]
+    iscrowd = [int(o['iscrowd']) for o in gt]
+    # load computed ious
+    ious = E.ious[imgId, catId][:len(dt), gtind] if len(E.ious[imgId, catId]) > 0 else E.ious[imgId, catId]
+
+    T = len(p.iouThrs)
+    G = len(gt)
+    D = len(dt)
+    gtm  = np.zeros((T,G))
+    dtm  = np.zeros((T,D))
+    gtIg = np.array([g['_ignore'] for g in gt])
+    dtIg = np.zeros((T,D))
+    if not len(ious)==0:
+        for tind, t in enumerate(p.iouThrs):
+            for dind, d in enumerate(dt):
+                # information about best match so far (m=-1 -> unmatched)
+                iou = min([t,1-1e-10])
+                m   = -1
+                for gind, g in enumerate(gt):
+                    # if this gt already matched, and not a crowd, continue
+                    if gtm[tind,gind]>0 and not iscrowd[gind]:
+                        continue
+                    # if dt matched to reg gt, and on ignore gt, stop
+                    if m>-1 and gtIg[m]==0 and gtIg[gind]==1:
+                        break
+                    # continue to next gt unless better match made
+                    if ious[dind,gind] < iou:
+                        continue
+                    # if match successful and best so far, store appropriately
+                    iou=ious[dind,gind]
+                    m=gind
+                # if match made store id of match for both dt and gt
+                if m ==-1:
+                    continue
+                dtIg[tind,dind] = gtIg[m]
+                dtm[tind,dind]  = gt[m]['id']
+                gtm[tind,m]     = d['id']
+    # set unmatched detections outside of area range to ignore
+    a = np.array([d['area']<aRng[0] or d['area']>aRng[1] for d in dt]).reshape((1, len(dt)))
+    dtIg = np.logical_or(dtIg, np.logical_and(dtm==0, np.repeat(a,T,0)))
+    # store results for given image and category
+    return {
+            'image_id':     imgId,
+            'category_id':  catId,
+            'aRng':         aRng,
+            'maxDet':       maxDet,
+            'dtIds':        [d['id'] for d in dt],
+            'gtIds':        [g['id'] for g in gt],
+            'dtMatches':    dtm,
+            'gtMatches':    gtm,
+            'dtScores':     [d['score'] for d in dt],
+            'gtIgnore':     gtIg,
+            'dtIgnore':     dtIg,
+        }
+
+
+def assertSameEvalImg(ref, res):
+    if ref is None:
+        assert res is None
+        return
+    assert sorted(ref) == sorted(res)
+    for key in ref:
+        assert np.array_equal(np.asarray(ref[key]), np.asarray(res[key])), key
+        assert np.asarray(ref[key]).dtype == np.asarray(res[key]).dtype, key
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm', 'keypoints'])
+@pytest.mark.parametrize('useCats', [1, 0])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_evaluate_matches_python(iouType, useCats, seed):
+    E = evaluated(iouType, seed, useCats)
+    p = E.params
+    catIds = p.catIds if useCats else [-1]
+    ref = [pythonEvaluateImg(E, imgId, catId, areaRng, p.maxDets[-1])
+           for catId in catIds
+           for areaRng in p.areaRng
+           for imgId in p.imgIds]
+    assert len(E.evalImgs) == len(ref)
+    # (computeOks has no ious for useCats=0)
+    if useCats or iouType != 'keypoints':
+        assert sum(e is not None and np.count_nonzero(e['dtMatches']) > 0 for e in ref) > 0
+    for r, e in zip(ref, E.evalImgs):
+        assertSameEvalImg(r, e)
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm', 'keypoints'])
+def test_evaluateImg_matches_python_maxDet(iouType):
+    # fewer dts than ious were computed for, crowd gts matched at several thresholds
+    E = evaluated(iouType, 2)
+    p = E.params
+    p.iouThrs = np.array([0., .1, .5, .5, 1.])
+    for imgId in p.imgIds:
+        for catId in p.catIds:
+            for maxDet in [0, 1, 3]:
+                for areaRng in p.areaRng:
+                    assertSameEvalImg(pythonEvaluateImg(E, imgId, catId, areaRng, maxDet),
+                                      E.evaluateImg(imgId, catId, areaRng, maxDet))
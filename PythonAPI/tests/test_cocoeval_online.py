@@ -0,0 +1,53 @@
+'''
+COCOevalOnline fed batch by batch must give the numbers of a single COCOeval
+run on the images seen so far.
+'''
+import numpy as np
+import pytest
+
+from pycocotools.cocoeval import COCOeval, COCOevalOnline
+from synthetic import randomDataset, randomResults, loadCoco, loadRes
+
+
+def evaluateAll(cocoGt, dets, iouType, imgIds):
+    E = COCOeval(cocoGt, loadRes(cocoGt, dets), iouType)
+    E.params.imgIds = imgIds
+    E.evaluate()
+    E.accumulate()
+    E.summarize()
+    return E
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm', 'keypoints'])
+def test_online_matches_cocoeval(iouType):
+    dataset = randomDataset(4)
+    dets = randomResults(dataset, 4, iouType)
+    cocoGt = loadCoco(dataset)
+    imgIds = sorted(cocoGt.getImgIds())
+    # batches in shuffled order, of different sizes
+    order = np.random.default_rng(0).permutation(imgIds).tolist()
+    batches = [order[:3], order[3:4], order[4:12], order[12:]]
+
+    E = COCOevalOnline(cocoGt, iouType)
+    seen = []
+    for batch in batches:
+        E.update(batch, [dt for dt in dets if dt['image_id'] in set(batch)])
+        seen += batch
+        E.accumulate()
+        E.summarize()
+        ref = evaluateAll(cocoGt, dets, iouType, sorted(seen))
+        for key in ['precision', 'recall', 'scores']:
+            assert np.array_equal(E.eval[key], ref.eval[key]), key
+        assert np.array_equal(E.stats, ref.stats)
+    # the caller's detections are not modified
+    assert dets == randomResults(dataset, 4, iouType)
+
+
+def test_online_rejects_images_seen_before():
+    dataset = randomDataset(4)
+    cocoGt = loadCoco(dataset)
+    imgIds = sorted(cocoGt.getImgIds())
+    E = COCOevalOnline(cocoGt, 'bbox')
+    E.update(imgIds[:2], [])
+    with pytest.raises(Exception):
+        E.update(imgIds[1:3], [])
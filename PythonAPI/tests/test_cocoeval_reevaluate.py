@@ -0,0 +1,72 @@
+'''
+COCOeval.reevaluate reuses the cached ious of unchanged (image, category)
+pairs and must give the results of a fresh evaluate().
+'''
+import copy
+
+import numpy as np
+import pytest
+
+from pycocotools.cocoeval import COCOeval
+from synthetic import evaluated
+
+
+def freshEval(E):
+    ref = COCOeval(E.cocoGt, E.cocoDt, E.params.iouType)
+    ref.params = copy.deepcopy(E.params)
+    ref.evaluate()
+    ref.accumulate()
+    return ref
+
+
+def assertSameResults(E, ref):
+    assert len(E.evalImgs) == len(ref.evalImgs)
+    for e, r in zip(E.evalImgs, ref.evalImgs):
+        assert (e is None) == (r is None)
+        if e is not None:
+            for key in r:
+                assert np.array_equal(np.asarray(e[key]), np.asarray(r[key])), key
+    E.accumulate()
+    for key in ['precision', 'recall', 'scores']:
+        assert np.array_equal(E.eval[key], ref.eval[key]), key
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm', 'keypoints'])
+def test_reevaluate_params(iouType):
+    E = evaluated(iouType, 5, params={'maxDets': [1, 3, 5]})
+    # fewer max detections and other area ranges keep all ious
+    E.params.maxDets = [1, 2]
+    E.params.areaRng = [[0, 1e10], [0, 20 ** 2], [20 ** 2, 1e10]]
+    E.params.areaRngLbl = ['all', 'small', 'large']
+    stats = E.reevaluate()
+    assert stats['computed'] == 0 and stats['reused'] > 0
+    assertSameResults(E, freshEval(E))
+    # more max detections need the ious of the pairs that had more dts than were kept again
+    E.params.maxDets = [1, 10, 100]
+    stats = E.reevaluate()
+    assert stats['computed'] > 0
+    assertSameResults(E, freshEval(E))
+
+
+@pytest.mark.parametrize('iouType', ['bbox', 'segm', 'keypoints'])
+def test_reevaluate_changed_geometry(iouType):
+    E = evaluated(iouType, 6)
+    # move a detection onto a gt it does not match perfectly, editing its ann in place
+    for (imgId, catId), gts in sorted(E._gts.items()):
+        ious = E.ious[imgId, catId]
+        dts = sorted(E._dts[imgId, catId], key=lambda d: -d['score'])
+        if len(gts) > 0 and len(dts) > 0 and not gts[0]['iscrowd'] and ious[0, 0] < .9:
+            break
+    gt, dt = gts[0], dts[0]
+    old = [e['dtMatches'].copy() if e is not None else None for e in E.evalImgs]
+    if iouType == 'segm':
+        dt['segmentation'] = E.cocoGt.annToRLE(gt)
+    elif iouType == 'bbox':
+        dt['bbox'] = list(gt['bbox'])
+    else:
+        dt['keypoints'] = list(gt['keypoints'])
+    stats = E.reevaluate()
+    # only the ious of the edited pair are computed again
+    assert stats['computed'] == 1
+    assertSameResults(E, freshEval(E))
+    assert any(o is not None and not np.array_equal(o, e['dtMatches']) for o, e in zip(old, E.evalImgs))
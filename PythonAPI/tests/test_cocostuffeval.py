@@ -0,0 +1,224 @@
+'''
+COCOStuffeval on random label maps against the confusion of the decoded maps.
+'''
+import os
+
+import numpy as np
+import pytest
+
+from pycocotools import mask as maskUtils
+from pycocotools.coco import COCO
+from pycocotools.cocostuffeval import COCOStuffeval
+
+# classes 1-4 are things, 5-11 stuff and 12 the 'other' class
+STUFF_START, STUFF_END, LABEL_COUNT = 5, 11, 12
+
+
+def randomLabelMap(rng, h, w, labels):
+    # blocks of labels with some noise, so the maps have long and short runs
+    L = rng.choice(labels, (h // 8 + 1, w // 8 + 1)).repeat(8, 0).repeat(8, 1)[:h, :w]
+    noise = rng.random((h, w)) < .05
+    L[noise] = rng.choice(labels, np.count_nonzero(noise))
+    return L
+
+
+def randomStuff(seed, numImgs=8):
+    '''
+    Random stuff gt (with unlabeled pixels, things and crowd annotations) and result label maps
+    :return: gt dataset, result anns, and dicts that map image ids to the gt and result label maps
+    '''
+    rng = np.random.default_rng(seed)
+    cats = [{'id': c, 'name': str(c), 'supercategory': 'thing' if c < STUFF_START else 'other' if c == LABEL_COUNT
+             else 'stuff%d' % (c % 3)} for c in range(1, LABEL_COUNT + 1)]
+    imgs, anns, res, gtMaps, resMaps = [], [], [], {}, {}
+    for i in range(numImgs):
+        h, w = int(rng.integers(20, 60)), int(rng.integers(20, 60))
+        imgId = 1000 + 7 * i
+        imgs.append({'id': imgId, 'height': h, 'width': w})
+        gtMaps[imgId] = randomLabelMap(rng, h, w, np.arange(0, LABEL_COUNT + 1))
+        resMaps[imgId] = randomLabelMap(rng, h, w, np.arange(STUFF_START, LABEL_COUNT + 1))
+        for labelMap, out in [(gtMaps[imgId], anns), (resMaps[imgId], res)]:
+            for label, R in maskUtils.encodeLabelMap(labelMap).items():
+                if label > 0:
+                    out.append({'id': len(out) + 1, 'image_id': imgId, 'category_id': int(label), 'iscrowd': 0,
+                                'segmentation': {'size': [h, w], 'counts': R['counts'].decode()},
+                                'area': float(maskUtils.area(R)), 'bbox': maskUtils.toBbox(R).tolist()})
+        # a crowd annotation overlapping the others, which is not evaluated
+        R = maskUtils.encode(np.asfortranarray(rng.random((h, w)) < .3, dtype=np.uint8))
+        anns.append({'id': len(anns) + 1, 'image_id': imgId, 'category_id': STUFF_START, 'iscrowd': 1,
+                     'segmentation': {'size': [h, w], 'counts': R['counts'].decode()},
+                     'area': float(maskUtils.area(R)), 'bbox': maskUtils.toBbox(R).tolist()})
+    return {'images': imgs, 'annotations': anns, 'categories': cats}, res, gtMaps, resMaps
+
+
+def denseConfusion(gtMaps, resMaps, imgIds):
+    # confusion of the decoded label maps, ignoring gt labels that are not evaluated
+    confusion = np.zeros((LABEL_COUNT, LABEL_COUNT), dtype=np.int64)
+    for imgId in imgIds:
+        gt, res = gtMaps[imgId].ravel(), resMaps[imgId].ravel()
+        valid = gt >= STUFF_START
+        confusion += np.bincount((gt[valid] - 1) * LABEL_COUNT + res[valid] - 1,
+                                 minlength=LABEL_COUNT ** 2).reshape((LABEL_COUNT, LABEL_COUNT))
+    return confusion
+
+
+def stuffEval(seed, imgIds=None, **kwargs):
+    dataset, res, gtMaps, resMaps = randomStuff(seed)
+    cocoGt = COCO(dataset)
+    E = COCOStuffeval(cocoGt, cocoGt.loadRes(res), stuffStartId=STUFF_START, stuffEndId=STUFF_END)
+    if imgIds is not None:
+        E.params.imgIds = imgIds
+    E.evaluate(**kwargs)
+    return E, gtMaps, resMaps
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_confusion_matches_dense(seed):
+    E, gtMaps, resMaps = stuffEval(seed)
+    assert np.array_equal(E.confusion, denseConfusion(gtMaps, resMaps, E.params.imgIds))
+    # and on the level of single images, straight from the RLE kernel
+    for imgId in E.params.imgIds:
+        gt, res = E.cocoGt.imgToAnns[imgId], E.cocoRes.imgToAnns[imgId]
+        gt = [a for a in gt if not a['iscrowd'] and a['category_id'] >= STUFF_START]
+        C = maskUtils.confusion([E.cocoGt.annToRLE(a) for a in gt], [a['category_id'] - 1 for a in gt],
+                                [E.cocoRes.annToRLE(a) for a in res], [a['category_id'] - 1 for a in res], LABEL_COUNT)
+        assert np.array_equal(C, denseConfusion(gtMaps, resMaps, [imgId]))
+
+
+def test_confusion_rejects_overlaps():
+    dataset, _, gtMaps, _ = randomStuff(0, numImgs=1)
+    cocoGt = COCO(dataset)
+    # the crowd annotation overlaps the others
+    anns = cocoGt.loadAnns(cocoGt.getAnnIds())
+    rles = [cocoGt.annToRLE(a) for a in anns]
+    labels = [a['category_id'] - 1 for a in anns]
+    with pytest.raises(maskUtils.OverlapError):
+        maskUtils.confusion(rles, labels, rles[:1], labels[:1], LABEL_COUNT)
+    with pytest.raises(maskUtils.OverlapError):
+        maskUtils.confusion(rles[:1], labels[:1], rles, labels, LABEL_COUNT)
+    C = maskUtils.confusion(rles[:-1], labels[:-1], rles[:-1], labels[:-1], LABEL_COUNT)
+    assert C.sum() == np.count_nonzero(list(gtMaps.values())[0])
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_workers_match_serial(workers):
+    ref, _, _ = stuffEval(1)
+    E, _, _ = stuffEval(1, workers=workers)
+    assert np.array_equal(E.confusion, ref.confusion)
+    assert np.array_equal(E.summarize()[0], ref.summarize()[0])
+    # fewer images than shards
+    imgIds = ref.params.imgIds[2:4]
+    ref, _, _ = stuffEval(1, imgIds=imgIds)
+    E, _, _ = stuffEval(1, imgIds=imgIds, workers=workers)
+    assert np.array_equal(E.confusion, ref.confusion)
+
+
+def interruptAfter(monkeypatch, n):
+    # raise KeyboardInterrupt when the serial loop reaches the n+1-th image
+    images = []
+    accumulateConfusion = COCOStuffeval._accumulateConfusion
+    def interrupted(self, cocoGt, cocoRes, confusion, imgId):
+        if len(images) == n:
+            raise KeyboardInterrupt
+        images.append(imgId)
+        return accumulateConfusion(self, cocoGt, cocoRes, confusion, imgId)
+    monkeypatch.setattr(COCOStuffeval, '_accumulateConfusion', interrupted)
+    return images
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_resume_matches_uninterrupted(monkeypatch, tmp_path, workers):
+    checkpoint = str(tmp_path / 'stuff.ckpt')
+    ref, _, _ = stuffEval(4)
+    with monkeypatch.context() as m:
+        interruptAfter(m, 3)
+        with pytest.raises(KeyboardInterrupt):
+            stuffEval(4, checkpoint=checkpoint, checkpointInterval=0)
+    assert os.path.exists(checkpoint)
+    images = interruptAfter(monkeypatch, None)
+    E, _, _ = stuffEval(4, workers=workers, checkpoint=checkpoint)
+    if workers is None:
+        assert images == ref.params.imgIds[3:]
+    assert not os.path.exists(checkpoint)
+    assert np.array_equal(E.confusion, ref.confusion)
+
+
+def test_checkpoint_of_other_evaluation(monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / 'stuff.ckpt')
+    with monkeypatch.context() as m:
+        interruptAfter(m, 3)
+        with pytest.raises(KeyboardInterrupt):
+            stuffEval(5, checkpoint=checkpoint, checkpointInterval=0)
+    # a result with one label changed does not resume it, nor do other images
+    dataset, res, _, _ = randomStuff(5)
+    res[0]['category_id'] = STUFF_START + (res[0]['category_id'] - STUFF_START + 1) % (LABEL_COUNT - STUFF_START)
+    cocoGt = COCO(dataset)
+    E = COCOStuffeval(cocoGt, cocoGt.loadRes(res), stuffStartId=STUFF_START, stuffEndId=STUFF_END)
+    with pytest.raises(Exception, match='different evaluation'):
+        E.evaluate(checkpoint=checkpoint)
+    with pytest.raises(Exception, match='different evaluation'):
+        stuffEval(5, imgIds=sorted(cocoGt.getImgIds())[1:], checkpoint=checkpoint)
+    stuffEval(5, checkpoint=checkpoint)
+    assert not os.path.exists(checkpoint)
+
+
+def test_group_confusion_matches_summation():
+    E, _, _ = stuffEval(2)
+    confusion = E.confusion
+    rng = np.random.default_rng(0)
+    # groups of some of the leaves, the others are ignored
+    groupOf = {c: 'g%d' % rng.integers(0, 3) for c in range(STUFF_START, LABEL_COUNT + 1) if rng.random() < .8}
+    supCatOf = {c['id']: c['supercategory'] for c in E.cocoGt.cats.values()}
+    for mapping in [groupOf, supCatOf]:
+        confusionGroup, groups = E._getGroupConfusion(confusion, mapping)
+        assert groups == sorted(set(mapping.values()))
+        ref = np.zeros((len(groups), len(groups)))
+        for a, ga in mapping.items():
+            for b, gb in mapping.items():
+                ref[groups.index(ga), groups.index(gb)] += confusion[a - 1, b - 1]
+        assert np.array_equal(confusionGroup, ref)
+    assert np.array_equal(E._getSupCatConfusion(confusion), E._getGroupConfusion(confusion, supCatOf)[0])
+
+
+def writeLabelMaps(resDir, resMaps):
+    # label maps in both naming schemes and formats, and files that are not label maps of images
+    from PIL import Image
+    for n, (imgId, labelMap) in enumerate(sorted(resMaps.items())):
+        if n % 2:
+            np.save(str(resDir / ('%012d.npy' % imgId)), labelMap.astype(np.uint16))
+        else:
+            Image.fromarray(labelMap.astype(np.uint8)).save(str(resDir / ('COCO_val2014_%012d.png' % imgId)))
+    other = sorted(resMaps)[0]
+    for name in ['readme.txt', 'palette.png', 'COCO_val2014_%012d_color.png' % other, 'maps_%d.npy' % other]:
+        (resDir / name).write_bytes(b'not a label map')
+
+
+@pytest.mark.parametrize('workers', [None, 1, 3])
+def test_resDir_matches_serial(tmp_path, capsys, workers):
+    ref, _, resMaps = stuffEval(3)
+    writeLabelMaps(tmp_path, resMaps)
+    E = COCOStuffeval(ref.cocoGt, resDir=str(tmp_path), stuffStartId=STUFF_START, stuffEndId=STUFF_END)
+    E.evaluate(workers=workers)
+    assert np.array_equal(E.confusion, ref.confusion)
+    assert np.array_equal(E.summarize()[0], ref.summarize()[0])
+    # the files not named after an image id are reported and skipped
+    assert 'Skipping 3 files' in capsys.readouterr().out
+
+
+def test_resDir_missing_and_invalid_label_maps(tmp_path):
+    ref, _, resMaps = stuffEval(3)
+    imgIds = sorted(resMaps)
+    writeLabelMaps(tmp_path, {imgId: resMaps[imgId] for imgId in imgIds[1:]})
+    E = COCOStuffeval(ref.cocoGt, resDir=str(tmp_path), stuffStartId=STUFF_START, stuffEndId=STUFF_END)
+    with pytest.raises(Exception, match='not found in the result'):
+        E.evaluate()
+    # a subset of the images with label maps can be evaluated
+    E.params.imgIds = imgIds[1:]
+    E.evaluate()
+    assert np.array_equal(E.confusion, stuffEval(3, imgIds=imgIds[1:])[0].confusion)
+    # labels beyond the evaluated classes are invalid
+    labelMap = resMaps[imgIds[2]].copy()
+    labelMap[0, 0] = LABEL_COUNT + 1
+    np.save(str(tmp_path / ('%012d.npy' % imgIds[2])), labelMap)
+    with pytest.raises(Exception, match='Invalid classes'):
+        E.evaluate()
@@ -0,0 +1,97 @@
+'''
+The label maps painted from the annotations of an image must be the ones of
+the original per-annotation loops, with the same dtypes.
+'''
+import numpy as np
+import pytest
+
+from pycocotools import mask as maskUtils
+from pycocotools.coco import COCO
+from pycocotools.cocostuffhelper import cocoSegmentationToSegmentationMap
+
+
+def maskDataset(masks, catIds, iscrowd=None):
+    '''
+    Dataset of one image with an RLE annotation for each of the [h x w x n] masks
+    '''
+    h, w, n = masks.shape
+    anns = []
+    for i, R in enumerate(maskUtils.encode(np.asfortranarray(masks))):
+        anns.append({'id': i + 1, 'image_id': 1, 'category_id': int(catIds[i]), 'area': float(maskUtils.area(R)),
+                     'bbox': maskUtils.toBbox(R).tolist(), 'iscrowd': iscrowd[i] if iscrowd else 0,
+                     'segmentation': {'size': [h, w], 'counts': R['counts'].decode()}})
+    cats = [{'id': c, 'name': str(c), 'supercategory': 'x'} for c in sorted(set(catIds))]
+    return {'images': [{'id': 1, 'height': h, 'width': w}], 'annotations': anns, 'categories': cats}
+
+
+def randomBlobs(rng, h, w, n):
+    masks = np.zeros((h, w, n), dtype=np.uint8)
+    for i in range(n):
+        y, x = rng.integers(0, h - 5), rng.integers(0, w - 5)
+        masks[y:y + rng.integers(2, 12), x:x + rng.integers(2, 12), i] = 1
+    return masks
+
+
+def loopSegmentationMap(coco, imgId, checkUniquePixelLabel, includeCrowd):
+    # the original loop over the annotations of the image
+    curImg = coco.imgs[imgId]
+    labelMap = np.zeros((curImg['height'], curImg['width']))
+    annIds = coco.getAnnIds(imgIds=imgId) if includeCrowd else coco.getAnnIds(imgIds=imgId, iscrowd=False)
+    for a in coco.loadAnns(annIds):
+        labelMask = coco.annToMask(a) == 1
+        if checkUniquePixelLabel and (labelMap[labelMask] != 0).any():
+            return None
+        labelMap[labelMask] = a['category_id']
+    return labelMap
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('includeCrowd', [False, True])
+def test_segmentation_map_matches_loop(seed, includeCrowd):
+    rng = np.random.default_rng(seed)
+    masks = randomBlobs(rng, 30, 40, 6)
+    coco = COCO(maskDataset(masks, rng.integers(92, 182, 6), [0, 1, 0, 0, 1, 0]))
+    for checkUniquePixelLabel in [False, True]:
+        ref = loopSegmentationMap(coco, 1, checkUniquePixelLabel, includeCrowd)
+        if ref is None:
+            with pytest.raises(Exception):
+                cocoSegmentationToSegmentationMap(coco, 1, checkUniquePixelLabel, includeCrowd)
+            continue
+        labelMap = cocoSegmentationToSegmentationMap(coco, 1, checkUniquePixelLabel, includeCrowd)
+        assert labelMap.dtype == np.float64
+        assert np.array_equal(labelMap, ref)
+
+
+def test_segmentation_map_touching_masks():
+    # masks sharing an edge inside a column and between columns have unique pixel labels
+    masks = np.zeros((10, 12, 3), dtype=np.uint8)
+    masks[0:5, 0:6, 0] = 1
+    masks[5:10, 0:6, 1] = 1
+    masks[:, 6:12, 2] = 1
+    coco = COCO(maskDataset(masks, [92, 93, 94]))
+    labelMap = cocoSegmentationToSegmentationMap(coco, 1)
+    assert np.array_equal(labelMap, loopSegmentationMap(coco, 1, True, False))
+    masks[4, 6, 2] = masks[4, 5, 1] = 1
+    coco = COCO(maskDataset(masks, [92, 93, 94]))
+    with pytest.raises(Exception):
+        cocoSegmentationToSegmentationMap(coco, 1)
+
+
+def test_annsToSeg_matches_loop():
+    pytest.importorskip('cytoolz')
+    pytest.importorskip('lxml')
+    from pycocotools.coco2voc_seg import annsToSeg
+    rng = np.random.default_rng(0)
+    masks = randomBlobs(rng, 30, 40, 8)
+    coco = COCO(maskDataset(masks, rng.integers(1, 20, 8)))
+    anns = coco.loadAnns(coco.getAnnIds(imgIds=1))
+    class_seg, instance_seg, id_seg = annsToSeg(anns, coco)
+    # the original loop, smallest annotation first, keeping labeled pixels
+    ref = [np.zeros((30, 40)), np.zeros((30, 40)), np.zeros((30, 40))]
+    for i, ann in enumerate(sorted(anns, key=lambda x: x['area'])):
+        m = coco.annToMask(ann)
+        for seg, label in zip(ref, [ann['category_id'], i + 1, ann['id']]):
+            seg[:] = np.where(seg > 0, seg, m * label)
+    assert class_seg.dtype == np.float64 and np.array_equal(class_seg, ref[0])
+    assert instance_seg.dtype == np.float64 and np.array_equal(instance_seg, ref[1])
+    assert id_seg.dtype == np.int64 and np.array_equal(id_seg, ref[2])
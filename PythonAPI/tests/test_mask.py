@@ -0,0 +1,301 @@
+'''
+The C kernels of pycocotools.mask against plain numpy references on random
+masks and boxes.
+'''
+import math
+
+import numpy as np
+import pytest
+
+from pycocotools import mask as maskUtils
+
+
+def randomMasks(rng, h, w, n, empty=0, cols=None):
+    '''
+    Random blobs (a rectangle with holes) within the columns cols
+    :param empty: number of empty masks appended
+    :return: [h x w x n] uint8 masks in Fortran order
+    '''
+    x0, x1 = cols if cols is not None else (0, w)
+    masks = np.zeros((h, w, n + empty), dtype=np.uint8, order='F')
+    for i in range(n):
+        xs = np.sort(rng.integers(x0, x1, 2)) + [0, 1]
+        ys = np.sort(rng.integers(0, h, 2)) + [0, 1]
+        masks[ys[0]:ys[1], xs[0]:xs[1], i] = rng.random((ys[1] - ys[0], xs[1] - xs[0])) < .8
+    return masks
+
+
+def denseIou(dt, gt, iscrowd):
+    '''
+    iou of every pair of decoded dt and gt masks (0 when they do not intersect)
+    :return: [m x n] array as returned by maskUtils.iou
+    '''
+    dt = dt.reshape((-1, dt.shape[2]), order='F').astype(np.int64)
+    gt = gt.reshape((-1, gt.shape[2]), order='F').astype(np.int64)
+    inter = dt.T.dot(gt)
+    union = dt.sum(0)[:, None] + gt.sum(0)[None, :] - inter
+    union = np.where(np.array(iscrowd, dtype=bool)[None, :], dt.sum(0)[:, None], union)
+    return np.where(inter > 0, inter / np.maximum(union, 1), 0)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_iou_matches_unpruned(seed):
+    rng = np.random.default_rng(seed)
+    h, w = int(rng.integers(20, 80)), int(rng.integers(20, 80))
+    # dts in the left half, some gts in the right one, and empty masks on both sides
+    dt = randomMasks(rng, h, w, 12, empty=2, cols=(0, w // 2))
+    gt = np.concatenate([randomMasks(rng, h, w, 6), randomMasks(rng, h, w, 4, empty=1, cols=(w // 2, w))], axis=2)
+    iscrowd = (rng.random(gt.shape[2]) < .4).astype(np.uint8)
+    Rd, Rg = maskUtils.encode(dt), maskUtils.encode(gt)
+    o = maskUtils.iou(Rd, Rg, iscrowd)
+    assert np.array_equal(o, maskUtils.iou(Rd, Rg, iscrowd, pruned=False))
+    assert np.array_equal(o, denseIou(dt, gt, iscrowd))
+    assert np.all(o[:, 6:] == 0) and np.any(o[:, :6] > 0)
+    assert np.all(o[-2:] == 0) and np.all(o[:, -1] == 0)
+
+
+def test_iou_crowd_and_empty():
+    rng = np.random.default_rng(0)
+    masks = randomMasks(rng, 30, 40, 5, empty=1)
+    R = maskUtils.encode(masks)
+    for iscrowd in ([0] * 6, [1] * 6):
+        o = maskUtils.iou(R, R, iscrowd)
+        assert np.array_equal(o, maskUtils.iou(R, R, iscrowd, pruned=False))
+        assert np.array_equal(o, denseIou(masks, masks, iscrowd))
+        assert np.all(np.diag(o)[:5] == 1) and o[5, 5] == 0
+
+
+def naiveNms(ious, scores, thr, categories=None, method='hard', sigma=0.5, scoreThr=0.001):
+    '''
+    Greedy hard nms and Soft-NMS over a precomputed [n x n] iou matrix
+    :return: kept indices (and their decayed scores for Soft-NMS)
+    '''
+    order = np.argsort(-np.asarray(scores), kind='mergesort')
+    s = [float(scores[i]) for i in order]
+    cats = [categories[i] for i in order] if categories is not None else [0] * len(order)
+    alive = list(range(len(order)))
+    keep = []
+    while alive:
+        i = alive[0] if method == 'hard' else max(alive, key=lambda j: (s[j], -j))
+        keep.append(i)
+        alive.remove(i)
+        for j in list(alive):
+            if cats[j] != cats[i]:
+                continue
+            o = float(ious[order[i], order[j]])
+            if method == 'hard':
+                if o > thr:
+                    alive.remove(j)
+                continue
+            s[j] *= (1 - o if o > thr else 1) if method == 'linear' else math.exp(-o * o / sigma)
+            if s[j] < scoreThr:
+                alive.remove(j)
+    if method == 'hard':
+        return order[keep]
+    return order[keep], np.array([s[i] for i in keep])
+
+
+def boxIous(bb):
+    '''
+    iou of every pair of [x y w h] boxes, in the operation order of the C kernel
+    '''
+    n = len(bb)
+    o = np.zeros((n, n))
+    for i in range(n):
+        for j in range(n):
+            A, B = bb[i], bb[j]
+            w = min(A[2] + A[0], B[2] + B[0]) - max(A[0], B[0])
+            h = min(A[3] + A[1], B[3] + B[1]) - max(A[1], B[1])
+            if w > 0 and h > 0:
+                o[i, j] = w * h / (A[2] * A[3] + B[2] * B[3] - w * h)
+    return o
+
+
+@pytest.mark.parametrize('objs', ['boxes', 'masks'])
+@pytest.mark.parametrize('method', ['hard', 'linear', 'gaussian'])
+@pytest.mark.parametrize('withCats', [False, True])
+@pytest.mark.parametrize('seed', range(3))
+def test_nms_matches_naive(objs, method, withCats, seed):
+    rng = np.random.default_rng(seed)
+    n = 40
+    if objs == 'boxes':
+        # clustered boxes, so that many of them overlap
+        centers = rng.uniform(0, 100, (5, 2))[rng.integers(0, 5, n)] + rng.normal(0, 6, (n, 2))
+        wh = rng.uniform(5, 30, (n, 2))
+        dets = np.concatenate([centers - wh / 2, wh], axis=1).tolist()
+        ious = boxIous(dets)
+    else:
+        masks = randomMasks(rng, 40, 50, n - 2, empty=2)
+        dets = maskUtils.encode(masks)
+        ious = denseIou(masks, masks, np.zeros(n))
+    # scores on a coarse grid, so some of them tie
+    scores = rng.integers(1, 10, n) / 10.
+    categories = rng.integers(0, 3, n) * 7 if withCats else None
+    for thr in [.1, .3, .7]:
+        out = maskUtils.nms(dets, scores, thr, categories=categories, method=method)
+        ref = naiveNms(ious, scores, thr, categories, method)
+        if method == 'hard':
+            assert np.array_equal(out, ref)
+        else:
+            assert np.array_equal(out[0], ref[0])
+            assert np.array_equal(out[1], ref[1])
+
+
+def pasteBoxMasks(masks, bb, h, w, thr):
+    '''
+    Bilinear resize (align_corners=False, zero padding) of every [mh x mw] mask
+    into its box of an [h x w] image, thresholded at thr
+    :return: [h x w x n] bool masks
+    '''
+    n, mh, mw = masks.shape
+    out = np.zeros((h, w, n), dtype=bool)
+    def weights(t, m):
+        u = t * m - 0.5
+        f = np.floor(u)
+        i = f.astype(np.int64)
+        w0 = np.where((i < 0) | (i >= m), 0, 1 - (u - f))
+        w1 = np.where((i + 1 < 0) | (i + 1 >= m), 0, u - f)
+        return np.clip(i, 0, m - 1), np.clip(i + 1, 0, m - 1), w0, w1
+    for k in range(n):
+        b = bb[k]
+        if b[2] <= 0 or b[3] <= 0:
+            continue
+        r0, r1, rw0, rw1 = weights((np.arange(h) + 0.5 - b[1]) / b[3], mh)
+        c0, c1, cw0, cw1 = weights((np.arange(w) + 0.5 - b[0]) / b[2], mw)
+        M = masks[k]
+        v = (rw0[:, None] * cw0[None, :]) * M[r0][:, c0] + (rw0[:, None] * cw1[None, :]) * M[r0][:, c1] \
+            + (rw1[:, None] * cw0[None, :]) * M[r1][:, c0] + (rw1[:, None] * cw1[None, :]) * M[r1][:, c1]
+        out[:, :, k] = v >= thr
+    return out
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('thr', [.5, .2])
+def test_frBoxMasks_matches_bilinear_paste(seed, thr):
+    rng = np.random.default_rng(seed)
+    h, w, n = int(rng.integers(30, 90)), int(rng.integers(30, 90)), 12
+    masks = rng.random((n, 7, 9))
+    # fractional boxes, some partly outside the image, tiny or empty
+    xy = rng.uniform(-15, max(h, w), (n, 2))
+    wh = rng.uniform(1, 40, (n, 2))
+    wh[0] = [.6, .8]
+    wh[1, 0] = 0
+    bb = np.concatenate([xy, wh], axis=1)
+    Rs = maskUtils.frBoxMasks(masks, bb, h, w, thr)
+    assert np.array_equal(maskUtils.decode(Rs), pasteBoxMasks(masks, bb, h, w, thr))
+    assert maskUtils.area(Rs)[1] == 0
+
+
+def test_decodeCrop_matches_decode_slice():
+    rng = np.random.default_rng(0)
+    h, w = 37, 51
+    masks = randomMasks(rng, h, w, 6, empty=1)
+    Rs = maskUtils.encode(masks)
+    padded = np.zeros((h + 40, w + 40, 7), dtype=np.uint8)
+    padded[20:20 + h, 20:20 + w] = maskUtils.decode(Rs)
+    # windows inside the image, across its borders, outside of it and empty
+    for x0, y0, cw, ch in [[0, 0, w, h], [5, 3, 20, 11], [-7, 30, 15, 17], [45, -4, 13, 9], [w, 0, 4, 4], [3, 3, 0, 5]]:
+        ref = padded[y0 + 20:y0 + 20 + ch, x0 + 20:x0 + 20 + cw]
+        assert np.array_equal(maskUtils.decodeCrop(Rs, [x0, y0, cw, ch]), ref)
+        # preallocated outputs of any memory order and type uint8 or bool
+        for out in [np.ones((ch, cw, 7), dtype=np.uint8), np.ones((7, cw, ch), dtype=bool).transpose((2, 1, 0))]:
+            assert maskUtils.decodeCrop(Rs, [x0, y0, cw, ch], out=out) is out
+            assert np.array_equal(out, ref)
+    # without a window every mask is cropped to its bbox
+    for R, crop, bb in zip(Rs, maskUtils.decodeCrop(Rs), maskUtils.toBbox(Rs).astype(int)):
+        x, y, bw, bh = bb
+        assert np.array_equal(crop, maskUtils.decode(R)[y:y + bh, x:x + bw])
+        assert np.array_equal(maskUtils.decodeCrop(R), crop)
+
+
+@pytest.mark.parametrize('h', [1, 7, 8, 9, 33])
+def test_packed_matches_packbits(h):
+    rng = np.random.default_rng(h)
+    masks = randomMasks(rng, h, 13, 5, empty=1)
+    masks[:, 0, 0] = 1
+    Rs = maskUtils.encode(masks)
+    packed = maskUtils.decode(Rs, packed=True)
+    assert packed.dtype == np.uint8 and packed.shape == ((h + 7) // 8, 13, 6)
+    assert np.array_equal(packed, np.packbits(masks, axis=0))
+    assert np.array_equal(np.unpackbits(packed, axis=0, count=h), masks)
+    # packed masks of any memory layout encode to the same RLEs
+    for bits in [np.packbits(masks, axis=0), np.asfortranarray(packed), packed.copy(order='C')]:
+        assert maskUtils.encode(bits, packedHeight=h) == Rs
+    assert maskUtils.encode(np.packbits(masks[:, :, 2], axis=0), packedHeight=h) == Rs[2]
+
+
+def paintLabels(masks, labels, overlap):
+    '''
+    Label map painted mask by mask with numpy
+    :return: [h x w] int64 label map, or None if overlap='error' and masks overlap labeled pixels
+    '''
+    L = np.zeros(masks.shape[:2], dtype=np.int64)
+    for i, label in enumerate(labels):
+        m = masks[:, :, i] > 0
+        if overlap == 'error' and np.any(L[m] != 0):
+            return None
+        L[m & (L == 0) if overlap == 'first' else m] = label
+    return L
+
+
+@pytest.mark.parametrize('overlap', ['last', 'first', 'error'])
+@pytest.mark.parametrize('seed', range(3))
+def test_decodeLabelMap_matches_painting(overlap, seed):
+    rng = np.random.default_rng(seed)
+    masks = randomMasks(rng, 41, 33, 8, empty=1)
+    labels = rng.integers(1, 300, 9)
+    labels[3] = 0
+    Rs = maskUtils.encode(masks)
+    ref = paintLabels(masks, labels, overlap)
+    for dtype in [np.uint16, np.int32, np.int64]:
+        if ref is None:
+            with pytest.raises(maskUtils.OverlapError):
+                maskUtils.decodeLabelMap(Rs, labels, dtype=dtype, overlap=overlap)
+            continue
+        L = maskUtils.decodeLabelMap(Rs, labels, dtype=dtype, overlap=overlap)
+        assert L.dtype == dtype and np.array_equal(L, ref)
+    # painting into a preallocated map of any memory order keeps its other pixels
+    out = np.zeros((33, 41), dtype=np.int32).T
+    out[:2, :2] = 7
+    masks[:, :, :] = 0
+    masks[3:9, 4:6, 0] = 1
+    masks[9:12, 4:7, 1] = 1
+    maskUtils.decodeLabelMap(maskUtils.encode(masks[:, :, :2]), [5, 6], out=out, overlap=overlap)
+    ref = np.zeros((41, 33))
+    ref[:2, :2] = 7
+    ref[3:9, 4:6] = 5
+    ref[9:12, 4:7] = 6
+    assert np.array_equal(out, ref)
+
+
+def test_decodeLabelMap_touching_masks_do_not_overlap():
+    # masks sharing run boundaries along a column and between columns
+    masks = np.zeros((10, 12, 4), dtype=np.uint8, order='F')
+    masks[0:5, 0:6, 0] = 1
+    masks[5:10, 0:6, 1] = 1
+    masks[:, 6:8, 2] = 1
+    masks[:, 8:12, 3] = 1
+    Rs = maskUtils.encode(masks)
+    L = maskUtils.decodeLabelMap(Rs, [1, 2, 3, 4], overlap='error')
+    assert np.array_equal(L, paintLabels(masks, [1, 2, 3, 4], 'error'))
+    masks[5, 5, 0] = 1
+    with pytest.raises(maskUtils.OverlapError):
+        maskUtils.decodeLabelMap(maskUtils.encode(masks), [1, 2, 3, 4], overlap='error')
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.int32, np.int64, np.float64, np.bool_])
+def test_encodeLabelMap_matches_encode(dtype):
+    rng = np.random.default_rng(0)
+    L = rng.integers(0, 2 if dtype == np.bool_ else 5, (23, 17)).astype(dtype)
+    L[:, 3] = 0
+    for labelMap in [L, np.asfortranarray(L), L[::-1, ::2]]:
+        Rs = maskUtils.encodeLabelMap(labelMap)
+        labels = np.unique(labelMap)
+        assert list(Rs) == labels.tolist()
+        for label in labels:
+            assert Rs[label] == maskUtils.encode(np.asfortranarray(labelMap == label, dtype=np.uint8))
+        # only the given labels, in their order, of which absent ones are left out
+        sel = [int(labels[-1]), 9, int(labels[0])]
+        Rs = maskUtils.encodeLabelMap(labelMap, labels=sel)
+        assert list(Rs) == [sel[0], sel[2]]
+        assert Rs[sel[0]] == maskUtils.encode(np.asfortranarray(labelMap == sel[0], dtype=np.uint8))
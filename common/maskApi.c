@@ -7,6 +7,7 @@
 #include "maskApi.h"
 #include <math.h>
 #include <stdlib.h>
+#include <string.h>
 
 uint umin( uint a, uint b ) { return (a<b) ? a : b; }
 uint umax( uint a, uint b ) { return (a>b) ? a : b; }
@@ -40,12 +41,218 @@ void rleEncode( RLE *R, const byte *M, siz h, siz w, siz n ) {
   free(cnts);
 }
 
+/* Threshold columns x0..x0+nb of mask Mi into the column-major tile, walking
+ * the mask in whichever order (rows or columns) is contiguous in memory. */
+#define RLE_FILL_TILE(T, ON) { \
+  if(rowMajor) for(y=0; y<h; y++) { const char *My=Mi+y*sh+x0*sw; \
+    for(j=0; j<nb; j++) { T v=*(const T*)(My+j*sw); tile[j*h+y]=(ON); }} \
+  else for(j=0; j<nb; j++) { const char *Mx=Mi+(x0+j)*sw; \
+    for(y=0; y<h; y++) { T v=*(const T*)(Mx+y*sh); tile[j*h+y]=(ON); }}}
+
+void rleEncodeStrided( RLE *R, const void *M, siz h, siz w, siz n,
+  long sh, long sw, long sn, int type, int useThr, double thr )
+{
+  siz i, j, k, x0, y, nb, B, cap=1024; uint c, *cnts; byte p, *tile;
+  int rowMajor = labs(sw)<labs(sh);
+  B = h ? 65536/h : w; if(B<16) B=16; if(B>w) B=w;
+  cnts=malloc(sizeof(uint)*cap); tile=malloc(B*h+1);
+  for(i=0; i<n; i++) {
+    const char *Mi=(const char*) M+i*sn; k=0; p=0; c=0;
+    for(x0=0; x0<w; x0+=nb) {
+      nb = (w-x0<B) ? w-x0 : B;
+      if(type==0 && !useThr) RLE_FILL_TILE(byte, v!=0)
+      else if(type==0) RLE_FILL_TILE(byte, v>=thr)
+      else if(type==1 && !useThr) RLE_FILL_TILE(float, v!=0)
+      else if(type==1) RLE_FILL_TILE(float, v>=thr)
+      else if(!useThr) RLE_FILL_TILE(double, v!=0)
+      else RLE_FILL_TILE(double, v>=thr)
+      for(j=0; j<nb*h; j++) {
+        if(tile[j]!=p) {
+          if(k==cap) { cap*=2; cnts=realloc(cnts,sizeof(uint)*cap); }
+          cnts[k++]=c; c=0; p=tile[j];
+        }
+        c++;
+      }
+    }
+    if(k==cap) { cap*=2; cnts=realloc(cnts,sizeof(uint)*cap); }
+    cnts[k++]=c; rleInit(R+i,h,w,k,cnts);
+  }
+  free(cnts); free(tile);
+}
+
 void rleDecode( const RLE *R, byte *M, siz n ) {
   siz i, j, k; for( i=0; i<n; i++ ) {
     byte v=0; for( j=0; j<R[i].m; j++ ) {
       for( k=0; k<R[i].cnts[j]; k++ ) *(M++)=v; v=!v; }}
 }
 
+/* Hash table (open addressing) from label values to the RLEs being built. */
+typedef struct { long long v; siz last, m, cap; uint *cnts; } rleLabel;
+typedef struct { siz n, cap; long long *keys; siz *idx; rleLabel *ls; } rleLabels;
+
+static siz rleLabelsSlot( const rleLabels *T, long long v ) {
+  siz j=(siz) (((unsigned long long) v*0x9E3779B97F4A7C15ULL)>>20)&(T->cap-1);
+  while(T->idx[j]!=(siz) -1 && T->keys[j]!=v) j=(j+1)&(T->cap-1);
+  return j;
+}
+
+static void rleLabelsInit( rleLabels *T, siz cap ) {
+  siz j; T->n=0; T->cap=cap;
+  T->keys=malloc(sizeof(long long)*cap); T->idx=malloc(sizeof(siz)*cap);
+  T->ls=malloc(sizeof(rleLabel)*(cap/2)); for(j=0; j<cap; j++) T->idx[j]=(siz) -1;
+}
+
+static rleLabel* rleLabelsAdd( rleLabels *T, long long v ) {
+  siz j=rleLabelsSlot(T,v); rleLabel *l;
+  if(T->idx[j]!=(siz) -1) return T->ls+T->idx[j];
+  if(2*(T->n+1)>T->cap) {
+    /* rehash into a table of twice the size */
+    rleLabels U; rleLabelsInit(&U,2*T->cap); U.n=T->n;
+    for(j=0; j<T->cap; j++) if(T->idx[j]!=(siz) -1) {
+      siz k=rleLabelsSlot(&U,T->keys[j]); U.keys[k]=T->keys[j]; U.idx[k]=T->idx[j]; }
+    for(j=0; j<T->n; j++) U.ls[j]=T->ls[j];
+    free(T->keys); free(T->idx); free(T->ls); *T=U; j=rleLabelsSlot(T,v);
+  }
+  T->keys[j]=v; T->idx[j]=T->n; l=T->ls+T->n++;
+  l->v=v; l->last=l->m=l->cap=0; l->cnts=0; return l;
+}
+
+static void rleLabelPush( rleLabel *l, uint c ) {
+  if(l->m==l->cap) { l->cap=l->cap ? 2*l->cap : 16; l->cnts=realloc(l->cnts,sizeof(uint)*l->cap); }
+  l->cnts[l->m++]=c;
+}
+
+/* add the run [s,p) of label v to its RLE (unknown labels only if !fixed) */
+static void rleLabelsRun( rleLabels *T, long long v, siz s, siz p, int fixed ) {
+  rleLabel *l; siz j=rleLabelsSlot(T,v);
+  if(fixed && T->idx[j]==(siz) -1) return;
+  l=rleLabelsAdd(T,v); rleLabelPush(l,(uint) (s-l->last)); rleLabelPush(l,(uint) (p-s)); l->last=p;
+}
+
+#define RLE_LABELS_SCAN(T) { \
+  cur=*(const T*) L; \
+  for( x=0; x<w; x++ ) { const char *Lx=(const char*) L+(long) x*sw; \
+    for( y=0; y<h; y++, p++ ) { long long v=*(const T*) (Lx+(long) y*sh); \
+      if(v!=cur) { rleLabelsRun(&Ts,cur,s,p,sel!=0); cur=v; s=p; } }}}
+
+siz rleEncodeLabels( const void *L, siz h, siz w, long sh, long sw, int type,
+  const long long *sel, siz nsel, long long **vals, RLE **R )
+{
+  siz i, j, x, y, s=0, p=0, cap=64; long long cur; rleLabels Ts;
+  while(cap<4*nsel) cap*=2;
+  rleLabelsInit(&Ts,cap);
+  for( i=0; i<nsel; i++ ) rleLabelsAdd(&Ts,sel[i]);
+  if(h*w>0) {
+    if(type==0) RLE_LABELS_SCAN(unsigned char)
+    else if(type==1) RLE_LABELS_SCAN(unsigned short)
+    else if(type==2) RLE_LABELS_SCAN(int)
+    else RLE_LABELS_SCAN(long long)
+    rleLabelsRun(&Ts,cur,s,p,sel!=0);
+  }
+  /* keep the labels present, closing each RLE with its trailing zeros (if any) */
+  *vals=malloc(sizeof(long long)*(Ts.n+1)); rlesInit(R,Ts.n);
+  for( i=0, j=0; i<Ts.n; i++ ) {
+    rleLabel *l=Ts.ls+i; if(l->m==0) continue;
+    if(l->last<h*w) rleLabelPush(l,(uint) (h*w-l->last));
+    (*vals)[j]=l->v;
+    (*R)[j].h=h; (*R)[j].w=w; (*R)[j].m=l->m; (*R)[j++].cnts=l->cnts;
+  }
+  free(Ts.keys); free(Ts.idx); free(Ts.ls);
+  return j;
+}
+
+void rleDecodePacked( const RLE *R, byte *M, siz n ) {
+  siz i, j, s, e, x, ya, yb, h, w, hb; byte *Mx;
+  for( i=0; i<n; i++ ) {
+    h=R[i].h; w=R[i].w; hb=(h+7)/8; memset(M,0,hb*w);
+    for( j=0, s=0; j<R[i].m; s+=R[i].cnts[j++] ) {
+      if(!(j&1) || R[i].cnts[j]==0) continue;
+      /* set the bits of the run [s,e) column by column, msb first */
+      for( e=s+R[i].cnts[j], x=s/h; x*h<e; x++ ) {
+        ya=s>x*h ? s-x*h : 0; yb=e<(x+1)*h ? e-x*h : h; Mx=M+x*hb;
+        if(ya/8==(yb-1)/8) { Mx[ya/8]|=(byte) (0xFF>>(ya%8)) & (byte) (0xFF<<(7-(yb-1)%8)); continue; }
+        Mx[ya/8]|=(byte) (0xFF>>(ya%8)); Mx[(yb-1)/8]|=(byte) (0xFF<<(7-(yb-1)%8));
+        if(ya/8+1<(yb-1)/8) memset(Mx+ya/8+1,0xFF,(yb-1)/8-ya/8-1);
+      }
+    }
+    M+=hb*w;
+  }
+}
+
+void rleEncodePacked( RLE *R, const byte *M, siz h, siz w, siz n,
+  long sh, long sw, long sn )
+{
+  siz i, x, y, k, cap=1024; uint c, *cnts; byte p, b, v;
+  cnts=malloc(sizeof(uint)*cap);
+  for( i=0; i<n; i++ ) {
+    k=0; p=0; c=0;
+    for( x=0; x<w; x++ ) {
+      const byte *Mx=M+(long) i*sn+(long) x*sw;
+      for( y=0; y<h; y++ ) {
+        b=Mx[(long) (y/8)*sh];
+        /* whole bytes equal to the current value extend the run */
+        if(y%8==0 && y+8<=h && b==(p ? 0xFF : 0)) { c+=8; y+=7; continue; }
+        v=(b>>(7-y%8))&1;
+        if(v!=p) {
+          if(k==cap) { cap*=2; cnts=realloc(cnts,sizeof(uint)*cap); }
+          cnts[k++]=c; c=0; p=v;
+        }
+        c++;
+      }
+    }
+    if(k==cap) { cap*=2; cnts=realloc(cnts,sizeof(uint)*cap); }
+    cnts[k++]=c; rleInit(R+i,h,w,k,cnts);
+  }
+  free(cnts);
+}
+
+static void rleFill( byte *M, long s, siz k, byte v ) {
+  siz j; if(s==1) memset(M,v,k); else for(j=0; j<k; j++) M[(long) j*s]=v;
+}
+
+void rleDecodeCrop( const RLE *R, byte *M, siz n, long x0, long y0,
+  siz cw, siz ch, long sh, long sw, long sn )
+{
+  siz i, j, e, f, p, q, h, w; long x, ya, yb; byte *Mx;
+  for( i=0; i<n; i++ ) {
+    h=R[i].h; w=R[i].w; j=0; e=R[i].m ? R[i].cnts[0] : 0;
+    ya=y0<0 ? 0 : y0; yb=y0+(long) ch>(long) h ? (long) h : y0+(long) ch;
+    for( x=x0; x<x0+(long) cw; x++ ) {
+      Mx=M+(long) i*sn+(x-x0)*sw;
+      if(x<0 || x>=(long) w || ya>=yb) { rleFill(Mx,sh,ch,0); continue; }
+      /* rows of the window above and below the image are background */
+      rleFill(Mx,sh,ya-y0,0); rleFill(Mx+(yb-y0)*sh,sh,y0+ch-yb,0);
+      Mx+=(ya-y0)*sh; p=x*h+ya; q=x*h+yb;
+      while(p<q) {
+        /* skip to the run j=[.., e) holding pixel p, its value is j odd */
+        while(e<=p) e+=R[i].cnts[++j];
+        f=e<q ? e : q; rleFill(Mx,sh,f-p,j&1);
+        Mx+=(long) (f-p)*sh; p=f;
+      }
+    }
+  }
+}
+
+#define RLE_PAINT(T) { \
+  for( i=0; i<n; i++ ) { T v=(T) labels[i]; siz h=R[i].h; \
+    for( j=0, s=0; j<R[i].m; s+=R[i].cnts[j++] ) { \
+      if(!(j&1)) continue; x=s/h; y=s%h; \
+      for( k=0; k<R[i].cnts[j]; k++ ) { \
+        T *t=(T*) ((char*) L+(long) y*sh+(long) x*sw); \
+        if(overlap==0 || *t==0) *t=v; else if(overlap==2) return i+1; \
+        if(++y==h) { y=0; x++; } }}}}
+
+siz rlePaint( const RLE *R, const long long *labels, siz n, void *L,
+  int type, long sh, long sw, int overlap )
+{
+  siz i, j, k, s, x, y;
+  if(type==0) RLE_PAINT(unsigned char)
+  else if(type==1) RLE_PAINT(unsigned short)
+  else if(type==2) RLE_PAINT(int)
+  else RLE_PAINT(long long)
+  return 0;
+}
+
 void rleMerge( const RLE *R, RLE *M, siz n, int intersect ) {
   uint *cnts, c, ca, cb, cc, ct; int v, va, vb, vp;
   siz i, a, b, h=R[0].h, w=R[0].w, m=R[0].m; RLE A, B;
@@ -74,7 +281,59 @@ void rleArea( const RLE *R, siz n, uint *a ) {
     a[i]=0; for( j=1; j<R[i].m; j+=2 ) a[i]+=R[i].cnts[j]; }
 }
 
+siz rleIndex( const RLE *R, siz n, siz **S ) {
+  /* start pixel of every run of every RLE (S[i][m] is the end of R[i]) */
+  siz i, j, k=0; for( i=0; i<n; i++ ) k+=R[i].m+1;
+  S[0]=malloc(sizeof(siz)*(k+1)); for( i=0; i<n; i++ ) {
+    if(i>0) S[i]=S[i-1]+R[i-1].m+1;
+    S[i][0]=0; for( j=0; j<R[i].m; j++ ) S[i][j+1]=S[i][j]+R[i].cnts[j]; }
+  return k;
+}
+
+siz rleSeek( const siz *S, siz m, siz p ) {
+  /* index of the last run starting at or before pixel p (binary search) */
+  siz lo=0, hi=m, mid; while( hi-lo>1 ) {
+    mid=(lo+hi)/2; if(S[mid]<=p) lo=mid; else hi=mid; }
+  return lo;
+}
+
+uint rleInter( const RLE *A, const siz *Sa, const RLE *B, const siz *Sb, siz p, siz e ) {
+  /* area of the intersection of A and B within pixels [p,e) */
+  siz a, b, ea, eb, c; uint i=0; if(A->m==0 || B->m==0) return 0;
+  a=rleSeek(Sa,A->m,p); b=rleSeek(Sb,B->m,p);
+  while( p<e && a<A->m && b<B->m ) {
+    ea=Sa[a+1]; eb=Sb[b+1]; c=ea<eb ? ea : eb; if(c>e) c=e;
+    if((a&1) && (b&1) && c>p) i+=(uint)(c-p);
+    p=c>p ? c : p; a+=ea<=p; b+=eb<=p;
+  }
+  return i;
+}
+
 void rleIou( RLE *dt, RLE *gt, siz m, siz n, byte *iscrowd, double *o ) {
+  siz g, d, p, e, h, **Sd, **Sg; BB db, gb; int crowd; uint *ad, *ag, i;
+  db=malloc(sizeof(double)*m*4); rleToBbox(dt,db,m);
+  gb=malloc(sizeof(double)*n*4); rleToBbox(gt,gb,n);
+  bbIou(db,gb,m,n,iscrowd,o);
+  /* areas and run indices are computed once per mask, not per pair */
+  ad=malloc(sizeof(uint)*m); rleArea(dt,m,ad);
+  ag=malloc(sizeof(uint)*n); rleArea(gt,n,ag);
+  Sd=malloc(sizeof(siz*)*(m+1)); rleIndex(dt,m,Sd);
+  Sg=malloc(sizeof(siz*)*(n+1)); rleIndex(gt,n,Sg);
+  for( g=0; g<n; g++ ) for( d=0; d<m; d++ ) if(o[g*m+d]>0) {
+    crowd=iscrowd!=NULL && iscrowd[g];
+    if(dt[d].h!=gt[g].h || dt[d].w!=gt[g].w) { o[g*m+d]=-1; continue; }
+    /* only the columns both boxes overlap can hold common pixels */
+    h=dt[d].h; p=(siz)(db[d*4]>gb[g*4] ? db[d*4] : gb[g*4])*h;
+    e=(siz)(db[d*4]+db[d*4+2]<gb[g*4]+gb[g*4+2] ? db[d*4]+db[d*4+2] : gb[g*4]+gb[g*4+2])*h;
+    i=rleInter(dt+d,Sd[d],gt+g,Sg[g],p,e);
+    if(i==0) o[g*m+d]=0;
+    else o[g*m+d]=(double)i/(double)(crowd ? ad[d] : ad[d]+ag[g]-i);
+  }
+  free(db); free(gb); free(ad); free(ag);
+  free(Sd[0]); free(Sg[0]); free(Sd); free(Sg);
+}
+
+void rleIouUnpruned( RLE *dt, RLE *gt, siz m, siz n, byte *iscrowd, double *o ) {
   siz g, d; BB db, gb; int crowd;
   db=malloc(sizeof(double)*m*4); rleToBbox(dt,db,m);
   gb=malloc(sizeof(double)*n*4); rleToBbox(gt,gb,n);
@@ -96,14 +355,49 @@ void rleIou( RLE *dt, RLE *gt, siz m, siz n, byte *iscrowd, double *o ) {
 }
 
 void rleNms( RLE *dt, siz n, uint *keep, double thr ) {
-  siz i, j; double u;
-  for( i=0; i<n; i++ ) keep[i]=1;
-  for( i=0; i<n; i++ ) if(keep[i]) {
-    for( j=i+1; j<n; j++ ) if(keep[j]) {
-      rleIou(dt+i,dt+j,1,1,0,&u);
-      if(u>thr) keep[j]=0;
+  siz i, k, *kept=malloc(sizeof(siz)*n); BB bb=malloc(sizeof(double)*n*4);
+  rleToBbox(dt,bb,n); k=objNms(bb,dt,0,0,n,thr,0,0,0,kept);
+  for( i=0; i<n; i++ ) keep[i]=0;
+  for( i=0; i<k; i++ ) keep[kept[i]]=1;
+  free(kept); free(bb);
+}
+
+double objIou( const BB bb, const RLE *R, siz **S, const uint *a, siz i, siz j ) {
+  /* iou of objects i and j, rejecting pairs with disjoint boxes first */
+  const double *A=bb+i*4, *B=bb+j*4; double w, h, x0, x1; uint in; siz hh;
+  x0=fmax(A[0],B[0]); x1=fmin(A[2]+A[0],B[2]+B[0]); w=x1-x0; if(w<=0) return 0;
+  h=fmin(A[3]+A[1],B[3]+B[1])-fmax(A[1],B[1]); if(h<=0) return 0;
+  if(!R) return w*h/(A[2]*A[3]+B[2]*B[3]-w*h);
+  if(R[i].h!=R[j].h || R[i].w!=R[j].w) return 0;
+  hh=R[i].h; in=rleInter(R+i,S[i],R+j,S[j],(siz)x0*hh,(siz)x1*hh);
+  return in ? (double)in/(double)(a[i]+a[j]-in) : 0;
+}
+
+siz objNms( const BB bb, const RLE *R, const uint *cats, double *s, siz n,
+  double thr, int method, double sigma, double sthr, siz *keep )
+{
+  siz i, j, k=0, first=0, **S=0; uint *a=0; byte *alive; double o;
+  alive=malloc(n); for( i=0; i<n; i++ ) alive[i]=1;
+  if(R) {
+    a=malloc(sizeof(uint)*n); rleArea(R,n,a);
+    S=malloc(sizeof(siz*)*(n+1)); rleIndex(R,n,S);
+  }
+  while( 1 ) {
+    /* pick the first alive object (hard) or the alive one with the highest score (soft) */
+    while( first<n && !alive[first] ) first++;
+    if( first==n ) break;
+    i=first; if(method) for( j=first+1; j<n; j++ ) if(alive[j] && s[j]>s[i]) i=j;
+    keep[k++]=i; alive[i]=0;
+    for( j=first; j<n; j++ ) if(alive[j]) {
+      if(cats && cats[i]!=cats[j]) continue;
+      o=objIou(bb,R,S,a,i,j);
+      if(method==0) { if(o>thr) alive[j]=0; continue; }
+      s[j]*=(method==1) ? (o>thr ? 1-o : 1) : exp(-o*o/sigma);
+      if(s[j]<sthr) alive[j]=0;
     }
   }
+  free(alive); if(R) { free(a); free(S[0]); free(S); }
+  return k;
 }
 
 void bbIou( BB dt, BB gt, siz m, siz n, byte *iscrowd, double *o ) {
@@ -120,14 +414,11 @@ void bbIou( BB dt, BB gt, siz m, siz n, byte *iscrowd, double *o ) {
 }
 
 void bbNms( BB dt, siz n, uint *keep, double thr ) {
-  siz i, j; double u;
-  for( i=0; i<n; i++ ) keep[i]=1;
-  for( i=0; i<n; i++ ) if(keep[i]) {
-    for( j=i+1; j<n; j++ ) if(keep[j]) {
-      bbIou(dt+i*4,dt+j*4,1,1,0,&u);
-      if(u>thr) keep[j]=0;
-    }
-  }
+  siz i, k, *kept=malloc(sizeof(siz)*n);
+  k=objNms(dt,0,0,0,n,thr,0,0,0,kept);
+  for( i=0; i<n; i++ ) keep[i]=0;
+  for( i=0; i<k; i++ ) keep[kept[i]]=1;
+  free(kept);
 }
 
 void rleToBbox( const RLE *R, BB bb, siz n ) {
@@ -155,6 +446,89 @@ void rleFrBbox( RLE *R, const BB bb, siz h, siz w, siz n ) {
   }
 }
 
+static void rleSetBilinear( double t, double scale, siz m, long *i0, double *w0, double *w1 ) {
+  /* sample position of output pixel t in an m pixel input (align_corners=0) */
+  double u=t*scale-0.5, f=floor(u); long i=(long) f;
+  *i0=i; *w0=(i<0 || i>=(long) m) ? 0 : 1-(u-f);
+  *w1=(i+1<0 || i+1>=(long) m) ? 0 : u-f;
+}
+
+void rleFrBoxMasks( RLE *R, const double *M, siz mh, siz mw, const BB bb,
+  siz h, siz w, siz n, double thr )
+{
+  siz i, k, cap=1024, last; long x, y, x0, x1, y0, y1, r, c, *ri; uint *cnts;
+  double *rw0, *rw1, cw0, cw1, v; byte p;
+  cnts=malloc(sizeof(uint)*cap);
+  ri=malloc(sizeof(long)*(h+1)); rw0=malloc(sizeof(double)*(h+1)); rw1=malloc(sizeof(double)*(h+1));
+  for( i=0; i<n; i++ ) {
+    const double *Mi=M+i*mh*mw, *b=bb+4*i;
+    k=0; last=0; p=0;
+    if(b[2]<=0 || b[3]<=0 || mh==0 || mw==0) { x0=x1=y0=y1=0; } else {
+      /* pixels whose bilinear sample can touch the mask (one input pixel of slack) */
+      x0=(long) floor(b[0]-b[2]/mw); x1=(long) ceil(b[0]+b[2]+b[2]/mw);
+      y0=(long) floor(b[1]-b[3]/mh); y1=(long) ceil(b[1]+b[3]+b[3]/mh);
+      x0=x0<0 ? 0 : x0; x1=x1>(long) w ? (long) w : x1; x1=x1<x0 ? x0 : x1;
+      y0=y0<0 ? 0 : y0; y1=y1>(long) h ? (long) h : y1; y1=y1<y0 ? y0 : y1;
+    }
+    for( y=y0; y<y1; y++ )
+      rleSetBilinear((y+0.5-b[1])/b[3], mh, mh, ri+y, rw0+y, rw1+y);
+    for( x=x0; x<x1; x++ ) {
+      if(k+h+4>cap) { while(k+h+4>cap) cap*=2; cnts=realloc(cnts,sizeof(uint)*cap); }
+      rleSetBilinear((x+0.5-b[0])/b[2], mw, mw, &c, &cw0, &cw1);
+      /* rows above the window are background */
+      if(p && y0>0) { cnts[k++]=x*h-last; last=x*h; p=0; }
+      for( y=y0; y<y1; y++ ) {
+        const double *Mr; r=ri[y]; v=0;
+        if(rw0[y]>0) { Mr=Mi+r*mw;
+          if(cw0>0) v+=rw0[y]*cw0*Mr[c];
+          if(cw1>0) v+=rw0[y]*cw1*Mr[c+1]; }
+        if(rw1[y]>0) { Mr=Mi+(r+1)*mw;
+          if(cw0>0) v+=rw1[y]*cw0*Mr[c];
+          if(cw1>0) v+=rw1[y]*cw1*Mr[c+1]; }
+        if((v>=thr)!=p) { cnts[k++]=x*h+y-last; last=x*h+y; p=!p; }
+      }
+      /* rows below the window are background */
+      if(p && y1<(long) h) { cnts[k++]=x*h+y1-last; last=x*h+y1; p=0; }
+    }
+    if(p && x1<(long) w) { cnts[k++]=x1*h-last; last=x1*h; }
+    cnts[k++]=h*w-last; rleInit(R+i,h,w,k,cnts);
+  }
+  free(cnts); free(ri); free(rw0); free(rw1);
+}
+
+typedef struct { siz s, e; long long l; } rleRun;
+
+static int rleRunCompare( const void *a, const void *b ) {
+  siz c=((const rleRun*)a)->s, d=((const rleRun*)b)->s; return c>d?1:c<d?-1:0;
+}
+
+/* sorted foreground runs of n masks labeled l, or 0 if two masks overlap */
+static rleRun* rleRuns( const RLE *R, const long long *l, siz n, siz *k ) {
+  siz i, j, s, m=0; rleRun *r;
+  for( i=0; i<n; i++ ) m+=R[i].m/2;
+  r=malloc(sizeof(rleRun)*(m+1)); *k=0;
+  for( i=0; i<n; i++ ) for( j=0, s=0; j<R[i].m; s+=R[i].cnts[j++] )
+    if((j&1) && R[i].cnts[j]>0) { r[*k].s=s; r[*k].e=s+R[i].cnts[j]; r[(*k)++].l=l[i]; }
+  qsort(r,*k,sizeof(rleRun),rleRunCompare);
+  for( i=1; i<*k; i++ ) if(r[i].s<r[i-1].e) { free(r); return 0; }
+  return r;
+}
+
+int rleConfusion( const RLE *gt, const long long *gl, siz ng,
+  const RLE *dt, const long long *dl, siz nd, siz L, long long *C )
+{
+  siz i=0, j=0, kg, kd; rleRun *g, *d;
+  g=rleRuns(gt,gl,ng,&kg); if(!g) return 1;
+  d=rleRuns(dt,dl,nd,&kd); if(!d) { free(g); return 2; }
+  while( i<kg && j<kd ) {
+    siz s=g[i].s>d[j].s ? g[i].s : d[j].s, e=g[i].e<d[j].e ? g[i].e : d[j].e;
+    if(s<e && g[i].l>=0 && g[i].l<(long long) L && d[j].l>=0 && d[j].l<(long long) L)
+      C[g[i].l*L+d[j].l]+=e-s;
+    if(g[i].e<d[j].e) i++; else j++;
+  }
+  free(g); free(d); return 0;
+}
+
 int uintCompare(const void *a, const void *b) {
   uint c=*((uint*)a), d=*((uint*)b); return c>d?1:c<d?-1:0;
 }
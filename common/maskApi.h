@@ -23,18 +23,67 @@ void rlesFree( RLE **R, siz n );
 /* Encode binary masks using RLE. */
 void rleEncode( RLE *R, const byte *mask, siz h, siz w, siz n );
 
+/* Encode masks of any memory layout, with byte strides sh, sw and sn along
+ * h, w and n. Elements are bytes (type=0), floats (1) or doubles (2); a pixel
+ * is set if it is nonzero, or if it is >=thr when useThr is set. */
+void rleEncodeStrided( RLE *R, const void *mask, siz h, siz w, siz n,
+  long sh, long sw, long sn, int type, int useThr, double thr );
+
 /* Decode binary masks encoded via RLE. */
 void rleDecode( const RLE *R, byte *mask, siz n );
 
+/* Encode the [h x w] label map L of type uint8 (type=0), uint16 (1), int32
+ * (2) or int64 (3), with byte strides sh and sw along h and w, as one RLE per
+ * label in a single column-major scan. With sel, only the nsel given labels
+ * are encoded. Allocates the labels present (*vals) and their RLEs (*R, in
+ * the order of sel or of first occurrence) and returns their number. */
+siz rleEncodeLabels( const void *L, siz h, siz w, long sh, long sw, int type,
+  const long long *sel, siz nsel, long long **vals, RLE **R );
+
+/* Decode masks into bits packed along h, msb first (np.packbits(M,axis=0)):
+ * each of the w columns of a mask takes (h+7)/8 bytes, columns are stored
+ * in order, and masks one after another. */
+void rleDecodePacked( const RLE *R, byte *mask, siz n );
+
+/* Encode bit-packed masks (as decoded by rleDecodePacked) of any memory
+ * layout, with byte strides sh, sw and sn between packed rows, columns and masks. */
+void rleEncodePacked( RLE *R, const byte *mask, siz h, siz w, siz n,
+  long sh, long sw, long sn );
+
+/* Decode the [ch x cw] window at (x0,y0) of each mask (pixels outside the
+ * image are 0) into M with byte strides sh, sw and sn along h, w and n.
+ * Runs before the window are skipped and only the window is written. */
+void rleDecodeCrop( const RLE *R, byte *M, siz n, long x0, long y0,
+  siz cw, siz ch, long sh, long sw, long sn );
+
+/* Paint the masks with their labels into the [h x w] label map L of type
+ * uint8 (type=0), uint16 (1), int32 (2) or int64 (3), with byte strides sh
+ * and sw along h and w. Overlapping pixels take the last label (overlap=0)
+ * or keep the first nonzero one (1); with overlap=2 painting stops at the
+ * first mask covering a nonzero pixel and i+1 is returned for that mask i.
+ * Only the runs of the masks are visited. Returns 0 on success. */
+siz rlePaint( const RLE *R, const long long *labels, siz n, void *L,
+  int type, long sh, long sw, int overlap );
+
 /* Compute union or intersection of encoded masks. */
 void rleMerge( const RLE *R, RLE *M, siz n, int intersect );
 
+/* Accumulate the [L x L] confusion C[g*L+d] (pixels labeled g in the ng
+ * masks gt with labels gl and d in the nd masks dt with labels dl) by merging
+ * the sorted runs of both. Labels outside [0,L) and unlabeled pixels are not
+ * counted. Returns 1 (2) if masks of gt (dt) overlap, and 0 otherwise. */
+int rleConfusion( const RLE *gt, const long long *gl, siz ng,
+  const RLE *dt, const long long *dl, siz nd, siz L, long long *C );
+
 /* Compute area of encoded masks. */
 void rleArea( const RLE *R, siz n, uint *a );
 
 /* Compute intersection over union between masks. */
 void rleIou( RLE *dt, RLE *gt, siz m, siz n, byte *iscrowd, double *o );
 
+/* Same as rleIou, walking all runs of each pair (reference for rleIou). */
+void rleIouUnpruned( RLE *dt, RLE *gt, siz m, siz n, byte *iscrowd, double *o );
+
 /* Compute non-maximum suppression between bounding masks */
 void rleNms( RLE *dt, siz n, uint *keep, double thr );
 
@@ -44,12 +93,26 @@ void bbIou( BB dt, BB gt, siz m, siz n, byte *iscrowd, double *o );
 /* Compute non-maximum suppression between bounding boxes */
 void bbNms( BB dt, siz n, uint *keep, double thr );
 
+/* Greedy (method=0) or soft (1=linear, 2=gaussian) non-maximum suppression of
+ * n objects sorted by descending score s: boxes bb, or masks R with boxes bb.
+ * Pairs with disjoint boxes or different cats (if not NULL) never interact.
+ * Soft scores are decayed in place and objects below sthr dropped. Writes the
+ * indices of kept objects in pick order to keep and returns their number. */
+siz objNms( const BB bb, const RLE *R, const uint *cats, double *s, siz n,
+  double thr, int method, double sigma, double sthr, siz *keep );
+
 /* Get bounding boxes surrounding encoded masks. */
 void rleToBbox( const RLE *R, BB bb, siz n );
 
 /* Convert bounding boxes to encoded masks. */
 void rleFrBbox( RLE *R, const BB bb, siz h, siz w, siz n );
 
+/* Paste n [mh x mw] row-major soft masks M into boxes bb ([x y w h]) of an
+ * [h x w] image with bilinear resizing and encode the pixels >=thr (thr>0).
+ * Only the pixels near each box are visited; no full image is allocated. */
+void rleFrBoxMasks( RLE *R, const double *M, siz mh, siz mw, const BB bb,
+  siz h, siz w, siz n, double thr );
+
 /* Convert polygon to encoded mask. */
 void rleFrPoly( RLE *R, const double *xy, siz k, siz h, siz w );
 